@@ -0,0 +1,184 @@
+"""
+    Activity series utility counts messages per user and per channel in hourly buckets.
+    Every series is a row of one NumPy matrix used as a ring buffer of HISTORY_DAYS * 24 hours,
+    so memory depends only on the number of members and channels, never on the traffic, and
+    a report over every member is a single vectorized sum.
+
+    The counts are kept in memory and written to a compressed NumPy file every SAVE_INTERVAL
+    seconds while messages arrive, and when the bot shuts down or the ranking cog is unloaded.
+"""
+import os
+import time
+import atexit
+import asyncio
+
+import numpy as np
+
+from Utility.data_store import DATA_DIR
+
+ACTIVITY = os.path.join(DATA_DIR, "participation", "activity.npz")
+# Days of hourly counts kept; older hours are overwritten as the ring turns
+HISTORY_DAYS = int(os.getenv("ACTIVITY_HISTORY_DAYS", "90"))
+# Seconds between two writes of the counts while messages arrive
+SAVE_INTERVAL = float(os.getenv("ACTIVITY_SAVE_INTERVAL", "300"))
+
+
+def daily(hourly: np.ndarray, hour: int) -> np.ndarray:
+    """
+        Sums hourly counts into UTC days, oldest first.
+
+        Parameters:
+            hourly: consecutive hourly counts, the last one for hour (hours since the epoch).
+            hour: the hour of the last count.
+
+        Returns:
+            the counts of every UTC day the hours touch; hours outside hourly count as zero.
+    """
+    before = (hour - len(hourly) + 1) % 24
+    after = 23 - hour % 24
+    padded = np.concatenate([np.zeros(before, dtype=hourly.dtype), hourly, np.zeros(after, dtype=hourly.dtype)])
+    return padded.reshape(-1, 24).sum(axis=1)
+
+
+class ActivitySeries:
+    """
+        Class keeps one ring of hourly message counts per key (a user or channel id).
+        Bucket h % buckets holds hour h (hours since the epoch) while h is one of the last
+        buckets hours.
+    """
+
+    def __init__(self, buckets: int = HISTORY_DAYS * 24):
+        """
+            Parameters:
+                buckets: hours kept per key.
+        """
+        self.buckets = buckets
+        self.rows = {}
+        self.counts = np.zeros((16, buckets), dtype=np.uint32)
+        # newest hour counted; every bucket of a later hour is cleared before it is used
+        self.hour = None
+
+    def add(self, key, when: float = None):
+        """ counts one message of key, sent at the epoch time when """
+        hour = int((time.time() if when is None else when) // 3600)
+        self.advance(hour)
+        if hour <= self.hour - self.buckets:
+            return
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.rows)
+            if row == len(self.counts):
+                self.counts = np.vstack([self.counts, np.zeros_like(self.counts)])
+        self.counts[row, hour % self.buckets] += 1
+
+    def advance(self, hour: int):
+        """ moves the ring forward to hour, clearing the buckets of the hours skipped """
+        if self.hour is None:
+            self.hour = hour
+            return
+        if hour <= self.hour:
+            return
+        stale = np.arange(self.hour + 1, min(hour, self.hour + self.buckets) + 1) % self.buckets
+        self.counts[:, stale] = 0
+        self.hour = hour
+
+    def _window(self, hours: int, now: float = None) -> np.ndarray:
+        """ ring positions of the last hours hours, oldest first """
+        hour = int((time.time() if now is None else now) // 3600)
+        self.advance(hour)
+        hours = max(1, min(hours, self.buckets))
+        return np.arange(self.hour - hours + 1, self.hour + 1) % self.buckets
+
+    def series(self, key, hours: int, now: float = None) -> np.ndarray:
+        """ hourly counts of key over the last hours hours, oldest first; zeros for unknown keys """
+        window = self._window(hours, now)
+        row = self.rows.get(key)
+        return np.zeros(len(window), dtype=np.int64) if row is None else self.counts[row, window].astype(np.int64)
+
+    def total(self, hours: int, now: float = None) -> np.ndarray:
+        """ hourly counts summed over every key for the last hours hours, oldest first """
+        window = self._window(hours, now)
+        return self.counts[:len(self.rows)].sum(axis=0, dtype=np.int64)[window]
+
+    def to_arrays(self, prefix: str) -> dict:
+        """ the arrays np.savez needs to rebuild the series, named after prefix """
+        return {prefix + "_keys": np.array(list(self.rows), dtype=str),
+                prefix + "_counts": self.counts[:len(self.rows)],
+                prefix + "_hour": np.array(-1 if self.hour is None else self.hour)}
+
+    def from_arrays(self, arrays, prefix: str):
+        """ restores the series saved by to_arrays; ignored if saved with another number of buckets """
+        counts = arrays[prefix + "_counts"]
+        if counts.shape[1] != self.buckets:
+            return
+        self.rows = {str(key): row for row, key in enumerate(arrays[prefix + "_keys"])}
+        self.counts = np.vstack([counts.astype(np.uint32), np.zeros((16, self.buckets), dtype=np.uint32)])
+        hour = int(arrays[prefix + "_hour"])
+        self.hour = None if hour < 0 else hour
+
+
+class ActivityTracker:
+    """
+        Class holds the activity series of users and channels and their file, written again at
+        most every save_interval seconds after a message is recorded.
+    """
+
+    def __init__(self, path: str = ACTIVITY, buckets: int = HISTORY_DAYS * 24,
+                 save_interval: float = SAVE_INTERVAL):
+        """
+            Parameters:
+                path: the .npz file the counts are kept in.
+                buckets: hours kept per user and channel.
+                save_interval: seconds between a recorded message and the write that keeps it.
+        """
+        self.path = path
+        self.save_interval = save_interval
+        self._save_handle = None
+        self.users = ActivitySeries(buckets)
+        self.channels = ActivitySeries(buckets)
+        if os.path.exists(path):
+            with np.load(path) as arrays:
+                self.users.from_arrays(arrays, "users")
+                self.channels.from_arrays(arrays, "channels")
+
+    def record(self, user_id, channel_id, when: float = None):
+        """ counts one message of a user in a channel """
+        self.users.add(str(user_id), when)
+        self.channels.add(str(channel_id), when)
+        self.schedule()
+
+    def schedule(self):
+        """ schedules the next save unless one is pending; saves now if no event loop is running """
+        if self._save_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()
+            return
+        self._save_handle = loop.call_later(self.save_interval, self.save)
+
+    def save(self):
+        """ writes every series to the file, replacing it atomically """
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp = self.path + ".tmp.npz"
+        np.savez_compressed(temp, **self.users.to_arrays("users"), **self.channels.to_arrays("channels"))
+        os.replace(temp, self.path)
+
+
+_tracker = None
+
+
+def get_activity() -> ActivityTracker:
+    """
+        Returns the activity tracker shared by every cog, building it on first use. The counts
+        are also written when the interpreter exits.
+    """
+    global _tracker  # pylint: disable=global-statement
+    if _tracker is None:
+        _tracker = ActivityTracker()
+        atexit.register(_tracker.save)
+    return _tracker
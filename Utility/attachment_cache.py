@@ -0,0 +1,133 @@
+"""
+    Attachment cache utility downloads a Discord attachment once and keeps it MIME-encoded on disk,
+    keyed by the attachment id, so emailing it to many users costs one download and one encoding.
+    Downloads are streamed in chunks into a spool (in memory while small, on disk once large) and
+    encoded off the event loop.
+"""
+import os
+import base64
+import asyncio
+import tempfile
+from collections import OrderedDict
+
+import aiohttp
+import discord
+
+from Utility.data_store import DATA_DIR
+
+CACHE_DIR = os.path.join(DATA_DIR, "email", "attachment_cache")
+# Attachments larger than this are not emailed
+MAX_BYTES = int(os.getenv("EMAIL_ATTACHMENT_MAX_BYTES", str(8 * 1024 * 1024)))
+# Encoded attachments kept for later recipients, least recently used dropped first
+CACHE_BYTES = int(os.getenv("EMAIL_ATTACHMENT_CACHE_BYTES", str(200 * 1024 * 1024)))
+# Downloads up to this size stay in memory while they are encoded
+SPOOL_BYTES = 1024 * 1024
+# Bytes read from the download at a time
+CHUNK_BYTES = 64 * 1024
+
+
+class AttachmentCache:
+    """
+        Class maps attachment ids to files holding their base64 encoding, ready for the outbox.
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = MAX_BYTES,
+                 cache_bytes: int = CACHE_BYTES, in_use=set):
+        """
+            Parameters:
+                directory: folder holding the encoded attachments.
+                max_bytes: size cap of a single attachment.
+                cache_bytes: total size of the encoded attachments kept.
+                in_use: returns the paths still needed by queued emails; those are never dropped.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.cache_bytes = cache_bytes
+        self.in_use = in_use
+        # attachment id -> (path, size of the encoded file)
+        self.files = OrderedDict()
+        self.size = 0
+        self.pending = {}
+        os.makedirs(directory, exist_ok=True)
+        # attachments encoded before a restart are still good
+        for name in sorted(os.listdir(directory), key=lambda n: os.path.getmtime(os.path.join(directory, n))):
+            path = os.path.join(directory, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            self.files[name] = (path, os.path.getsize(path))
+            self.size += self.files[name][1]
+
+    async def get(self, attachment):
+        """
+            Returns the path of the encoded attachment, downloading and encoding it on first use.
+            Concurrent requests for the same attachment share one download.
+
+            Parameters:
+                attachment: the discord.Attachment to send.
+
+            Returns:
+                the path of its base64 encoding, or None if it is larger than max_bytes.
+        """
+        if attachment.size > self.max_bytes:
+            return None
+        key = str(attachment.id)
+        if key in self.files:
+            if os.path.exists(self.files[key][0]):
+                self.files.move_to_end(key)
+                return self.files[key][0]
+            self.size -= self.files.pop(key)[1]
+        if key not in self.pending:
+            self.pending[key] = asyncio.ensure_future(self._encode(attachment, key))
+        try:
+            path = await asyncio.shield(self.pending[key])
+        finally:
+            self.pending.pop(key, None)
+        if key not in self.files:
+            self.files[key] = (path, os.path.getsize(path))
+            self.size += self.files[key][1]
+            self._evict()
+        return path
+
+    async def _encode(self, attachment, key: str) -> str:
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+        try:
+            await self._download(attachment, spool)
+        except BaseException:
+            spool.close()
+            raise
+        path = os.path.join(self.directory, key)
+        await asyncio.get_running_loop().run_in_executor(None, self._write, spool, path)
+        return path
+
+    @staticmethod
+    async def _download(attachment, spool):
+        """ streams the attachment into spool; Attachment.save would read all of it into memory first """
+        async with aiohttp.ClientSession() as session:
+            async with session.get(attachment.url) as response:
+                if response.status != 200:
+                    raise discord.HTTPException(response, "downloading the attachment failed")
+                async for chunk in response.content.iter_chunked(CHUNK_BYTES):
+                    spool.write(chunk)
+
+    @staticmethod
+    def _write(spool, path: str):
+        with spool, open(path + ".tmp", "wb") as output:
+            spool.seek(0)
+            base64.encode(spool, output)
+        os.replace(path + ".tmp", path)
+
+    def _evict(self):
+        in_use = None
+        for key in list(self.files):
+            if self.size <= self.cache_bytes or len(self.files) <= 1:
+                break
+            if in_use is None:
+                in_use = self.in_use()
+            path, size = self.files[key]
+            if path in in_use:
+                continue
+            del self.files[key]
+            self.size -= size
+            if os.path.exists(path):
+                os.remove(path)
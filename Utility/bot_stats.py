@@ -0,0 +1,227 @@
+"""
+    Bot stats utility measures every command, event listener and message pipeline stage.
+    For each handler it keeps the number of calls and errors and two fixed-size histograms:
+    wall time (start to finish, awaits included) and event-loop blocking time (the time the
+    handler's own code ran between awaits, i.e. how long it held up every other handler).
+"""
+import json
+import time
+from bisect import bisect_left
+
+# Upper bounds of the histogram buckets in seconds: 10us doubling up to ~84s, plus overflow
+BUCKETS = [0.00001 * 2 ** i for i in range(24)]
+
+
+class Histogram:
+    """
+        Class counts samples into the fixed BUCKETS, so its size never grows with the traffic.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0
+        self.maximum = 0.0
+
+    def add(self, seconds: float):
+        """ records one sample """
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += 1
+        self.maximum = max(self.maximum, seconds)
+
+    def percentile(self, percent: float) -> float:
+        """
+            Returns the upper bound of the bucket holding the given percentile, in seconds,
+            capped at the slowest sample seen.
+        """
+        if not self.total:
+            return 0.0
+        rank = percent / 100 * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(BUCKETS[index], self.maximum) if index < len(BUCKETS) else self.maximum
+        return self.maximum
+
+
+class HandlerStats:
+    """
+        Class holds the numbers of one handler.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.wall = Histogram()
+        self.blocking = Histogram()
+
+    def to_dict(self) -> dict:
+        """ summary of the handler, as shown by $botstats and written by $dumpstats """
+        summary = {"calls": self.calls, "errors": self.errors}
+        for label, histogram in (("wall", self.wall), ("blocking", self.blocking)):
+            for percent in (50, 95, 99):
+                summary[f"{label}_p{percent}_ms"] = round(histogram.percentile(percent) * 1000, 3)
+            summary[f"{label}_max_ms"] = round(histogram.maximum * 1000, 3)
+        return summary
+
+
+class BotStats:
+    """
+        Class is the registry of HandlerStats, keyed by handler name.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+
+    def record(self, name: str, wall: float, blocking: float, failed: bool = False):
+        """
+            Records one call of a handler.
+
+            Parameters:
+                name: handler name, e.g. '$level' or 'on_message Links.on_message'.
+                wall: seconds from start to finish.
+                blocking: seconds spent running the handler's own code.
+                failed: whether the call raised or the command failed.
+        """
+        handler = self.handlers.get(name)
+        if handler is None:
+            handler = self.handlers[name] = HandlerStats()
+        handler.calls += 1
+        handler.errors += failed
+        handler.wall.add(wall)
+        handler.blocking.add(blocking)
+
+    def report(self) -> dict:
+        """ summaries of every handler, slowest p95 wall time first """
+        summaries = {name: handler.to_dict() for name, handler in self.handlers.items()}
+        return dict(sorted(summaries.items(), key=lambda item: -item[1]["wall_p95_ms"]))
+
+    def dump(self, path: str):
+        """ writes the report to a JSON file for comparing releases offline """
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"created": time.time(), "handlers": self.report(),
+                       "buckets_ms": [bound * 1000 for bound in BUCKETS]}, file, indent=4)
+
+
+class Timed:
+    """
+        Awaitable that runs a coroutine and adds up how long each of its steps took. A step is
+        the code between two suspension points, which is exactly the time the loop was blocked.
+    """
+
+    def __init__(self, coro):
+        self.coro = coro
+        self.blocking = 0.0
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            start = time.perf_counter()
+            try:
+                signal = self.coro.throw(error) if error is not None else self.coro.send(value)
+            except StopIteration as stop:
+                self.blocking += time.perf_counter() - start
+                return stop.value
+            except BaseException:
+                self.blocking += time.perf_counter() - start
+                raise
+            self.blocking += time.perf_counter() - start
+            try:
+                value, error = (yield signal), None
+            except BaseException as exc:  # pylint: disable=broad-except
+                value, error = None, exc
+
+
+async def measure(stats: BotStats, name: str, coro):
+    """
+        Awaits a coroutine and records its wall and blocking time under name.
+    """
+    timed = Timed(coro)
+    start = time.perf_counter()
+    failed = True
+    try:
+        result = await timed
+        failed = False
+        return result
+    finally:
+        stats.record(name, time.perf_counter() - start, timed.blocking, failed)
+
+
+class TimedListener:
+    """
+        Class wraps an event listener so its calls are measured. It compares equal to the
+        function it wraps, so bot.remove_listener still finds it when a cog is unloaded.
+    """
+
+    def __init__(self, func, name: str, stats: BotStats):
+        self.func = func
+        self.name = name
+        self.stats = stats
+
+    async def __call__(self, *args, **kwargs):
+        return await measure(self.stats, self.name, self.func(*args, **kwargs))
+
+    def __eq__(self, other):
+        return other is self or self.func == other
+
+    def __hash__(self):
+        return hash(self.func)
+
+
+def get_stats(bot) -> BotStats:
+    """
+        Returns the stats registry of a bot, creating it on first use.
+    """
+    stats = getattr(bot, "stats", None)
+    if stats is None:
+        stats = bot.stats = BotStats()
+    return stats
+
+
+def instrument(bot) -> BotStats:
+    """
+        Starts measuring every command and event listener of a bot. Listeners added later,
+        e.g. by cogs loaded afterwards, are measured as well. Calling it again does nothing.
+    """
+    stats = get_stats(bot)
+    if getattr(bot, "instrumented", False):
+        return stats
+    bot.instrumented = True
+
+    def listener_name(func, event):
+        return f"{event} {getattr(func, '__qualname__', repr(func))}"
+
+    for event, listeners in bot.extra_events.items():
+        listeners[:] = [listener if isinstance(listener, TimedListener)
+                        else TimedListener(listener, listener_name(listener, event), stats)
+                        for listener in listeners]
+
+    add_listener = bot.add_listener
+
+    def timed_add_listener(func, name=None):
+        add_listener(func, name)
+        event = func.__name__ if name is None else name
+        listeners = bot.extra_events[event]
+        listeners[-1] = TimedListener(func, listener_name(func, event), stats)
+
+    bot.add_listener = timed_add_listener
+
+    # handlers registered with @bot.event live on the instance; on_error must stay untouched
+    for event, handler in list(vars(bot).items()):
+        if event.startswith("on_") and event != "on_error" and callable(handler):
+            bot.__dict__[event] = TimedListener(handler, f"{event} (event)", stats)
+
+    invoke = bot.invoke
+
+    async def timed_invoke(ctx):
+        timed = Timed(invoke(ctx))
+        start = time.perf_counter()
+        try:
+            await timed
+        finally:
+            if ctx.command is not None:
+                stats.record("$" + ctx.command.qualified_name, time.perf_counter() - start,
+                             timed.blocking, ctx.command_failed)
+
+    bot.invoke = timed_invoke
+    return stats
@@ -0,0 +1,198 @@
+"""
+    Data store utility keeps the bot's JSON and CSV datasets in memory and writes them behind.
+    Cogs load a dataset once, mutate it in place and mark it dirty; the store then flushes
+    every dirty dataset after a short delay using an atomic temp-file-and-rename write.
+"""
+import io
+import os
+import csv
+import json
+import atexit
+import asyncio
+import tempfile
+
+# Root folder holding every dataset, i.e. <repo>/data
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+# Seconds a dirty dataset may wait in memory before it is written to disk
+FLUSH_DELAY = float(os.getenv("DATA_FLUSH_DELAY", "2"))
+# Storage backend: "json" keeps the files under data/, "sqlite" uses the database below
+BACKEND = os.getenv("DATA_BACKEND", "json")
+DB_PATH = os.getenv("DATA_DB_PATH", os.path.join(DATA_DIR, "classmate.db"))
+# Permission bits masked off new files; read once, as os.umask can only be read by setting it
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def atomic_write(path: str, text: str):
+    """
+        Writes text to path without ever leaving a truncated file behind. The file keeps its
+        permissions, or gets those open() would give a new file.
+
+        Parameters:
+            path: destination file.
+            text: full contents of the file.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        # mkstemp creates the file readable by its owner only
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o666 & ~UMASK
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def trim_row(cells: list) -> list:
+    """
+        Drops the trailing empty cells of a CSV row; empty cells in the middle keep their
+        place, so the columns after them do not shift.
+    """
+    cells = list(cells)
+    while cells and cells[-1] in ("", None):
+        cells.pop()
+    return cells
+
+
+class DataStore:
+    """
+        Class keeps every dataset in memory, tracks which ones changed and flushes them on a
+        coalescing timer so a burst of mutations costs a single write.
+
+        JSON datasets are kept as the decoded object. CSV datasets are kept as a dict mapping
+        the first column of each row to the list of its remaining cells without the trailing
+        empty ones; the header row is remembered and the rows are padded back to its width
+        when written.
+    """
+
+    def __init__(self, root: str = DATA_DIR, flush_delay: float = FLUSH_DELAY):
+        self.root = root
+        self.flush_delay = flush_delay
+        self.datasets = {}
+        self.indents = {}
+        self.headers = {}
+        self.dirty = set()
+        self._flush_handle = None
+        # called after every flush of all dirty datasets, e.g. to checkpoint a ledger
+        self.flush_hooks = []
+
+    def path(self, name: str) -> str:
+        """
+            Resolves a dataset name such as 'participation/users.json' to its file.
+        """
+        return os.path.join(self.root, name)
+
+    def load(self, name: str, default=None, indent=None):
+        """
+            Returns the live in-memory object of a dataset, reading it from disk only once.
+
+            Parameters:
+                name: dataset path relative to the data folder.
+                default: value used when the file does not exist yet.
+                indent: json indentation used whenever the dataset is written back.
+
+            Returns:
+                the dataset object; mutate it in place and call mark_dirty afterwards.
+        """
+        if name not in self.datasets:
+            self.datasets[name] = self._read(name, default)
+            self.indents[name] = indent
+        return self.datasets[name]
+
+    def _read(self, name: str, default):
+        path = self.path(name)
+        if not os.path.exists(path):
+            return {} if default is None else default
+        with open(path, "r", encoding="utf-8", newline="") as file:
+            if not name.endswith(".csv"):
+                return json.load(file)
+            rows = [row for row in csv.reader(file) if row]
+        self.headers[name] = rows[0] if rows else []
+        return {row[0]: trim_row(row[1:]) for row in rows[1:]}
+
+    def _write(self, name: str):
+        data = self.datasets[name]
+        if not name.endswith(".csv"):
+            atomic_write(self.path(name), json.dumps(data, indent=self.indents[name]))
+            return
+        header = self.headers.get(name, [])
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if header:
+            writer.writerow(header)
+        for key, values in data.items():
+            writer.writerow([key] + values + [None] * (len(header) - 1 - len(values)))
+        atomic_write(self.path(name), buffer.getvalue())
+
+    def mark_dirty(self, name: str, key=None):
+        """
+            Records that a dataset changed and schedules a flush.
+
+            Parameters:
+                name: dataset that changed.
+                key: the record that changed, if known; unused by the JSON backend.
+        """
+        self.dirty.add(name)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (scripts, shutdown): write straight away
+            self.flush()
+            return
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.flush_delay, self.flush)
+
+    def flush(self, name: str = None):
+        """
+            Writes dirty datasets to disk.
+
+            Parameters:
+                name: only flush this dataset; every dirty dataset is written when omitted.
+        """
+        if name is None:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            names = list(self.dirty)
+        else:
+            names = [name] if name in self.dirty else []
+        for dataset in names:
+            self.dirty.discard(dataset)
+            self._write(dataset)
+        if name is None:
+            for hook in self.flush_hooks:
+                hook()
+
+    def reload(self, name: str):
+        """
+            Drops the cached copy of a dataset so the next load reads it again.
+        """
+        self.flush(name)
+        self.datasets.pop(name, None)
+        self.indents.pop(name, None)
+
+
+def create_store() -> DataStore:
+    """
+        Builds the store for the configured backend.
+    """
+    if BACKEND == "sqlite":
+        # pylint: disable=import-outside-toplevel
+        from Utility.sqlite_store import SqliteDataStore
+        return SqliteDataStore(DB_PATH)
+    return DataStore()
+
+
+# The one store shared by every cog
+store = create_store()
+atexit.register(store.flush)
@@ -0,0 +1,299 @@
+"""
+    Email outbox utility queues outgoing emails and sends them from a small pool of worker threads.
+    Each worker keeps one authenticated SMTP session open and reuses it for every email it sends.
+    The queue is a dataset of the data store, so emails that were not sent yet survive a restart,
+    and failed sends are retried with exponential backoff. Handlers only enqueue and return.
+"""
+import os
+import time
+import queue
+import base64
+import smtplib
+import asyncio
+import threading
+from email.mime.base import MIMEBase
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+from Utility.data_store import store, DATA_DIR
+
+OUTBOX = "email/outbox.json"
+# Attachments waiting to be sent, stored base64-encoded so they are encoded only once
+ATTACHMENT_DIR = os.path.join(DATA_DIR, "email", "attachments")
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+# Set SMTP_STARTTLS=0 for a local SMTP stand-in without TLS
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+FROM_ADDRESS = os.getenv("EMAIL_FROM", "no-reply@classmatebot.com")
+WORKERS = int(os.getenv("EMAIL_WORKERS", "2"))
+MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+# Seconds before the first retry; every further retry waits twice as long
+RETRY_DELAY = float(os.getenv("EMAIL_RETRY_DELAY", "30"))
+
+
+def connect_smtp():
+    """
+        Opens an authenticated SMTP session with the configured server.
+        Credentials are read from the USERNAME and PASSWORD variables; without them no login is done.
+    """
+    session = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+    session.ehlo()
+    if SMTP_STARTTLS:
+        session.starttls()
+        session.ehlo()
+    if os.getenv("USERNAME") and os.getenv("PASSWORD"):
+        session.login(os.getenv("USERNAME"), os.getenv("PASSWORD"))
+    return session
+
+
+def save_attachment(data: bytes, name: str = None, directory: str = ATTACHMENT_DIR) -> str:
+    """
+        Stores attachment data base64-encoded under directory for the outbox to send.
+
+        Parameters:
+            data: raw attachment contents.
+            name: file name to store it under; a unique one is picked when omitted.
+            directory: attachment folder of the outbox that will send it.
+
+        Returns:
+            the path of the stored attachment.
+    """
+    os.makedirs(directory, exist_ok=True)
+    if name is None:
+        name = "{}-{}".format(time.time_ns(), threading.get_ident())
+    path = os.path.join(directory, name)
+    with open(path, "wb") as file:
+        file.write(base64.encodebytes(data))
+    return path
+
+
+def build_message(entry: dict, from_address: str = FROM_ADDRESS) -> MIMEMultipart:
+    """
+        Builds the MIME message of an outbox entry. Attachments are read already encoded.
+    """
+    message = MIMEMultipart()
+    message["Subject"] = entry["SUBJECT"]
+    message["From"] = from_address
+    message["To"] = ", ".join(entry["TO"])
+    message.attach(MIMEText(entry["BODY"], "plain"))
+    for filename, path in entry["ATTACHMENTS"]:
+        part = MIMEBase("application", "octet-stream")
+        with open(path, "r", encoding="ascii") as file:
+            part.set_payload(file.read())
+        part["Content-Transfer-Encoding"] = "base64"
+        part.add_header("Content-Disposition", "attachment", filename=filename)
+        message.attach(part)
+    return message
+
+
+class EmailOutbox:
+    """
+        Class owns the queued emails and the worker threads sending them.
+
+        The queue is only changed on the event loop; workers get a copy of each entry and report
+        back through loop.call_soon_threadsafe, so the data store is never touched from a thread.
+        An email is handed to the workers at most once until they report back on it, even across
+        stop and start.
+    """
+
+    def __init__(self, connect=connect_smtp, workers: int = WORKERS, max_attempts: int = MAX_ATTEMPTS,
+                 retry_delay: float = RETRY_DELAY, dataset: str = OUTBOX, data_store=store,
+                 attachment_dir: str = ATTACHMENT_DIR):
+        """
+            Parameters:
+                connect: opens an SMTP session; replaceable with a local stand-in in tests.
+                workers: number of worker threads, i.e. of SMTP sessions kept open.
+                max_attempts: sends tried before an email is given up.
+                retry_delay: seconds before the first retry, doubled for each further one.
+                dataset: data store dataset holding the queue.
+                data_store: store holding the dataset.
+                attachment_dir: folder of the attachments this outbox owns.
+        """
+        self.connect = connect
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.dataset = dataset
+        self.store = data_store
+        self.attachment_dir = attachment_dir
+        self.entries = None
+        self.jobs = queue.Queue()
+        self.threads = []
+        self.loop = None
+        self.next_id = 1
+        # ids of the emails queued for the workers, waiting for a retry or being sent
+        self.scheduled = set()
+        # email id -> timer handing it to the workers for a retry
+        self.timers = {}
+
+    def start(self, loop=None):
+        """
+            Starts the workers and queues the emails left over from the last run.
+        """
+        if self.loop is not None:
+            return
+        self.loop = loop or asyncio.get_running_loop()
+        self.entries = self.store.load(self.dataset, default={})
+        self.next_id = max(map(int, self.entries), default=0) + 1
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(self.loop, self.jobs), name="email-outbox",
+                                      daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        now = time.time()
+        # emails still being sent since before a stop are not queued twice
+        for email_id, entry in self.entries.items():
+            self._schedule(email_id, entry["NEXT_TRY"] - now)
+
+    def stop(self):
+        """ lets the workers finish the email they are sending and end; the queue is kept """
+        for handle in self.timers.values():
+            handle.cancel()
+        self.scheduled.difference_update(self.timers)
+        self.timers = {}
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                self.scheduled.discard(job[0])
+        for _ in self.threads:
+            self.jobs.put(None)
+        # workers still sending keep the old queue and its stop markers
+        self.jobs = queue.Queue()
+        self.threads = []
+        self.loop = None
+
+    def _schedule(self, email_id: str, delay: float):
+        if email_id in self.scheduled:
+            return
+        self.scheduled.add(email_id)
+        if delay > 0:
+            self.timers[email_id] = self.loop.call_later(delay, self._put, email_id)
+        else:
+            self._put(email_id)
+
+    def _put(self, email_id: str):
+        self.timers.pop(email_id, None)
+        self.jobs.put((email_id, dict(self.entries[email_id])))
+
+    def enqueue(self, recipients, subject: str, body: str, attachments=()) -> str:
+        """
+            Queues an email. Must be called on the event loop; returns straight away.
+
+            Parameters:
+                recipients: an address or a list of addresses.
+                subject: subject line.
+                body: plain text body.
+                attachments: (filename, path) pairs of attachments stored with save_attachment.
+
+            Returns:
+                the id of the queued email.
+        """
+        return self.enqueue_many([(recipients, subject, body, attachments)])[0]
+
+    def enqueue_many(self, emails: list) -> list:
+        """
+            Queues a batch of emails with a single write of the queue.
+
+            Parameters:
+                emails: (recipients, subject, body) or (recipients, subject, body, attachments)
+                        tuples, as taken by enqueue.
+
+            Returns:
+                the ids of the queued emails.
+        """
+        self.start()
+        ids = []
+        for recipients, subject, body, *attachments in emails:
+            email_id = str(self.next_id)
+            self.next_id += 1
+            entry = {"TO": recipients if isinstance(recipients, list) else [recipients],
+                     "SUBJECT": subject, "BODY": body,
+                     "ATTACHMENTS": [list(pair) for pair in (attachments[0] if attachments else ())],
+                     "ATTEMPTS": 0, "NEXT_TRY": time.time()}
+            self.entries[email_id] = entry
+            self._schedule(email_id, 0)
+            ids.append(email_id)
+        if ids:
+            self.store.mark_dirty(self.dataset)
+        return ids
+
+    def _work(self, loop, jobs):
+        session = None
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            email_id, entry = job
+            error = None
+            try:
+                message = build_message(entry).as_string()
+                for attempt in range(2):
+                    if session is None:
+                        session = self.connect()
+                    try:
+                        session.sendmail(FROM_ADDRESS, entry["TO"], message)
+                        break
+                    except smtplib.SMTPServerDisconnected:
+                        # the kept-open session timed out; reconnect once
+                        session = None
+                        if attempt:
+                            raise
+            except Exception as exc:  # pylint: disable=broad-except
+                error = exc
+                if not isinstance(exc, smtplib.SMTPRecipientsRefused):
+                    session = None
+            loop.call_soon_threadsafe(self._finished, email_id, error)
+        if session is not None:
+            try:
+                session.quit()
+            except smtplib.SMTPException:
+                pass
+
+    def _finished(self, email_id: str, error):
+        self.scheduled.discard(email_id)
+        entry = self.entries.get(email_id)
+        if entry is None:
+            return
+        if error is None:
+            self._drop(email_id)
+            return
+        entry["ATTEMPTS"] += 1
+        if entry["ATTEMPTS"] >= self.max_attempts:
+            with open("err.log", "a") as file:
+                file.write(f"Error while sending email to {entry['TO']}, giving up: {error}\n")
+            self._drop(email_id)
+            return
+        delay = self.retry_delay * 2 ** (entry["ATTEMPTS"] - 1)
+        entry["NEXT_TRY"] = time.time() + delay
+        self.store.mark_dirty(self.dataset, email_id)
+        if self.loop is not None:
+            self._schedule(email_id, delay)
+
+    def _drop(self, email_id: str):
+        entry = self.entries.pop(email_id)
+        self.store.mark_dirty(self.dataset, email_id)
+        # only files saved by save_attachment belong to the outbox, and one may be shared
+        in_use = self.attachment_paths()
+        for _, path in entry["ATTACHMENTS"]:
+            if os.path.dirname(path) == self.attachment_dir and path not in in_use and os.path.exists(path):
+                os.remove(path)
+
+    def save_attachment(self, data: bytes, name: str = None) -> str:
+        """ stores attachment data in the attachment folder of this outbox; see save_attachment """
+        return save_attachment(data, name, self.attachment_dir)
+
+    def attachment_paths(self) -> set:
+        """ paths of the attachments of every queued email """
+        return {path for entry in (self.entries or {}).values() for _, path in entry["ATTACHMENTS"]}
+
+    def pending(self) -> int:
+        """ number of emails waiting to be sent """
+        return len(self.entries or {})
+
+
+# The one outbox shared by the bot and every cog
+outbox = EmailOutbox()
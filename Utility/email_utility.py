@@ -1,29 +1,25 @@
 """
     Email utility file contains logic of mailing attachments and several notifications to user.
 """
-import os
-import smtplib
-from email import encoders
-from email.mime.base import MIMEBase
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from Utility.email_outbox import outbox
 
 
 class EmailUtility:
     """
         Class provides methods handling mailing logic of attachments and remainders
     """
-    def __init__(self):
-        # Accepting username and password from env file.
-        self.username = os.getenv("USERNAME")
-        self.password = os.getenv("PASSWORD")
-        self.from_address = 'no-reply@classmatebot.com'
+    def __init__(self, mail_outbox=None):
+        """
+            Parameters:
+                mail_outbox: the EmailOutbox queuing the emails; the shared outbox by default.
+        """
         self.subject = 'CLASSMATE BOT NOTIFICATION'
+        self.outbox = outbox if mail_outbox is None else mail_outbox
 
     def send_email(self, recipient: str, attachment=None, subject: str = '', body: str = '',
-                   filename: str = ''):
+                   filename: str = '', attachments=()):
         """
-             Adds the homework to json in the specified format.
+             Queues an email in the outbox; it is sent in the background.
 
              Parameters:
                  recipient: user email address.
@@ -31,42 +27,16 @@ class EmailUtility:
                  subject: subject of the email.
                  body: body of the email.
                  filename: specifies the file name it should use for attachment data.
+                 attachments: (filename, path) pairs of attachments already stored encoded,
+                              e.g. by the attachment cache.
 
              Returns:
-                 returns either an error stating a reason for failure or returns a success message
-                 indicating that the reminder has been added
+                 the id of the queued email.
 
          """
-        # Recipient address are to be provided as list.
-        to_address = recipient if type(recipient) is list else [recipient]
-
-        msg = MIMEMultipart()
-        msg['Subject'] = subject if subject else self.subject
-        msg['From'] = self.from_address
-        msg['To'] = recipient
         body = body if body else "This mail was sent from classmatebot notification service," \
                                  " Please unsubscribe to stop notifications."
-        msg.attach(MIMEText(body, 'plain'))
-
+        attachments = list(attachments)
         if attachment:
-            # Attaching the attachment data only if it exists.
-            part = MIMEBase('application', "octet-stream")
-            part.set_payload(attachment)
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', 'attachment', filename=filename)
-            msg.attach(part)
-
-        try:
-            server = smtplib.SMTP("smtp.gmail.com", 587)
-            server.ehlo()
-            server.starttls()
-            server.login(self.username, self.password)
-            server.sendmail(list(self.from_address), to_address, msg.as_string())
-            server.close()
-            print("successfully sent the mail to " + recipient)
-        except Exception as error:
-            with open("err.log", "a") as f:
-                f.write(f"Error while sending email : {str(error)}\n")
-            print(error)
-            raise error
-
+            attachments.append((filename, self.outbox.save_attachment(attachment)))
+        return self.outbox.enqueue(recipient, subject if subject else self.subject, body, attachments)
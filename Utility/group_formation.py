@@ -0,0 +1,128 @@
+"""
+    Group formation utility places students into groups so that as many of their teammate and
+    time-slot preferences as possible are met, with groups kept balanced and under the size cap.
+
+    Preferences become one sparse affinity matrix between people: a teammate request counts
+    TEAMMATE_WEIGHT for both sides and every shared time slot counts SLOT_WEIGHT. The placement
+    is improved in rounds; each round scores every student against every group at once
+    (affinity @ membership) and re-seats half of the students optimally with linear_sum_assignment.
+"""
+import heapq
+
+import numpy as np
+from scipy import sparse
+from scipy.optimize import linear_sum_assignment
+
+TEAMMATE_WEIGHT = 3.0
+SLOT_WEIGHT = 1.0
+# rounds of reassignment, each moving half of the students
+ROUNDS = 8
+
+
+def balanced_seats(sizes: list, count: int, group_size: int) -> list:
+    """
+        Spreads count new students over groups of the given sizes, emptiest group first.
+
+        Returns:
+            the number of seats opened in each group.
+    """
+    heap = [(size, order) for order, size in enumerate(sizes) if size < group_size]
+    heapq.heapify(heap)
+    seats = [0] * len(sizes)
+    for _ in range(count):
+        if not heap:
+            break
+        size, order = heap[0]
+        seats[order] += 1
+        if size + 1 < group_size:
+            heapq.heapreplace(heap, (size + 1, order))
+        else:
+            heapq.heappop(heap)
+    return seats
+
+
+def affinity_matrix(people: list, preferences: dict, teammate_weight: float = TEAMMATE_WEIGHT,
+                    slot_weight: float = SLOT_WEIGHT):
+    """
+        Builds the symmetric people x people affinity matrix of the preferences.
+
+        Parameters:
+            people: names, in matrix order.
+            preferences: name -> {"TEAMMATES": [names], "SLOTS": [slots]}; names not in people are ignored.
+
+        Returns:
+            a scipy.sparse csr matrix with an empty diagonal.
+    """
+    index = {name: i for i, name in enumerate(people)}
+    pairs = [(index[name], index[mate]) for name, prefs in preferences.items() if name in index
+             for mate in prefs.get("TEAMMATES", []) if mate in index]
+    rows, cols = zip(*pairs) if pairs else ((), ())
+    wants = sparse.coo_matrix((np.ones(len(pairs)), (rows, cols)), shape=(len(people), len(people))).tocsr()
+    slot_index = {}
+    slot_pairs = [(index[name], slot_index.setdefault(slot, len(slot_index)))
+                  for name, prefs in preferences.items() if name in index for slot in set(prefs.get("SLOTS", []))]
+    rows, cols = zip(*slot_pairs) if slot_pairs else ((), ())
+    slots = sparse.coo_matrix((np.ones(len(slot_pairs)), (rows, cols)),
+                              shape=(len(people), max(1, len(slot_index)))).tocsr()
+    affinity = (teammate_weight * (wants + wants.T) + slot_weight * (slots @ slots.T)).tolil()
+    affinity.setdiag(0)
+    return affinity.tocsr()
+
+
+def form_groups(students: list, groups: dict, preferences: dict, group_size: int,
+                rounds: int = ROUNDS) -> dict:
+    """
+        Places students into groups, maximising the affinity between members of the same group.
+
+        Parameters:
+            students: names of the students to place.
+            groups: group -> names of its current members, who stay where they are.
+            preferences: name -> {"TEAMMATES": [names], "SLOTS": [slots]}.
+            group_size: most members a group may have.
+            rounds: most rounds of reassignment.
+
+        Returns:
+            student -> group for every student placed, in the order of students. Students are
+            left out only when the groups are full.
+    """
+    names = list(groups)
+    seats = balanced_seats([len(groups[name]) for name in names], len(students), group_size)
+    columns = np.repeat(np.arange(len(names)), seats)
+    placed = min(len(students), len(columns))
+    if not placed:
+        return {}
+    people = list(students) + [member for name in names for member in groups[name]]
+    affinity = affinity_matrix(people, preferences)
+    # members already in groups never move
+    fixed = np.repeat(np.arange(len(names)), [len(groups[name]) for name in names])
+    membership = sparse.csr_matrix((np.ones(len(fixed)), (np.arange(len(students), len(people)), fixed)),
+                                   shape=(len(people), len(names))).toarray()
+
+    # seed: students sharing their first slot sit next to each other
+    first_slot = [min(preferences.get(name, {}).get("SLOTS") or [""]) for name in students]
+    order = np.argsort(np.array(first_slot, dtype=object), kind="stable")[:placed]
+    choice = np.full(len(students), -1)
+    choice[order] = columns[:placed]
+
+    best, best_score = choice, -1.0
+    for turn in range(rounds + 1):
+        membership[:len(students)] = 0
+        membership[np.flatnonzero(choice >= 0), choice[choice >= 0]] = 1
+        score = affinity @ membership
+        satisfaction = float((score * membership).sum())
+        if satisfaction > best_score:
+            best, best_score = choice, satisfaction
+        if turn == rounds:
+            break
+        # half of the students move per round while the other half hold their seats, so two
+        # students who want each other do not swap groups past one another
+        movers = np.flatnonzero(np.arange(len(students)) % 2 == turn % 2)
+        staying = np.setdiff1d(np.flatnonzero(choice >= 0), movers)
+        free = np.array(seats) - np.bincount(choice[staying], minlength=len(names))
+        open_seats = np.repeat(np.arange(len(names)), free)
+        # a student's own pull on their group is excluded by the empty diagonal
+        rows, cols = linear_sum_assignment(score[movers][:, open_seats], maximize=True)
+        choice = choice.copy()
+        choice[movers] = -1
+        choice[movers[rows]] = open_seats[cols]
+    return {students[i]: names[best[i]] for i in range(len(students)) if best[i] >= 0}
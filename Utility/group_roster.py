@@ -0,0 +1,290 @@
+"""
+    Group roster utility keeps the class groups and the student name pool in memory, with the
+    reverse indexes the group commands need: member -> group, and Discord name / real name ->
+    student. Both datasets are loaded once from the data store; every change marks them dirty,
+    so each command results in one batched write. Membership changes are also appended to the
+    ledger before they are acknowledged, and replayed from it on start.
+"""
+import heapq
+
+from Utility.data_store import store
+from Utility.ledger import ledger, entry, MEMBER
+
+GROUPS = "server_data/groups.csv"
+STUDENTS = "server_data/name_mapping.csv"
+# username -> {"TEAMMATES": [usernames], "SLOTS": [time slots]}
+PREFERENCES = "server_data/group_preferences.json"
+GROUP_SIZE = 6
+# group number of a student who is not in a group yet
+UNASSIGNED = "-1"
+
+
+class GroupRoster:
+    """
+        Class holds groups.csv as group -> members (upper-cased display names) and
+        name_mapping.csv as username -> [real name, group].
+    """
+
+    def __init__(self, data_store=store, journal=ledger):
+        self.store = data_store
+        self.journal = journal
+        # (ledger entry, group the member was in before) of changes not written to the ledger yet
+        self.unlogged = []
+        self.groups = data_store.load(GROUPS)
+        self.students = data_store.load(STUDENTS)
+        self.preferences = data_store.load(PREFERENCES, default={})
+        self.member_group = {}
+        for group, members in self.groups.items():
+            for member in members:
+                self.member_group[member] = group
+        # upper-cased Discord name or real name -> username as stored
+        self.names = {}
+        for username, values in self.students.items():
+            self._index_student(username, values)
+        # changes the CSV snapshots missed when the bot stopped before they were flushed
+        changed = [self._move(item["NAME"], item["TARGET"]) for item in journal.replay(MEMBER)]
+        if any(changed):
+            self.store.mark_dirty(GROUPS)
+            self.store.mark_dirty(STUDENTS)
+
+    def _index_student(self, username: str, values: list):
+        self.names[username.upper()] = username
+        if values and values[0]:
+            self.names.setdefault(values[0].upper(), username)
+
+    def save(self):
+        """
+            Writes the pending changes to the ledger and marks both datasets dirty; the store
+            writes them in one delayed flush. Blocks until the ledger write is on disk, so code
+            running on the event loop awaits commit() instead.
+        """
+        pending = self._take_unlogged()
+        try:
+            self.journal.write([item for item, _ in pending])
+        except Exception:
+            self._undo(pending)
+            raise
+        self.store.mark_dirty(GROUPS)
+        self.store.mark_dirty(STUDENTS)
+
+    async def commit(self):
+        """
+            Like save, but waits for the ledger write off the event loop. Commands call it while
+            holding the locks of the groups and members they changed. If the write fails, the
+            changes are undone before the error is raised, so nothing unlogged is ever confirmed.
+        """
+        pending = self._take_unlogged()
+        try:
+            await self.journal.append([item for item, _ in pending])
+        except Exception:
+            self._undo(pending)
+            raise
+        self.store.mark_dirty(GROUPS)
+        self.store.mark_dirty(STUDENTS)
+
+    def _take_unlogged(self) -> list:
+        pending, self.unlogged = self.unlogged, []
+        return pending
+
+    def _undo(self, pending: list):
+        # latest change first, so a member moved twice ends up where they started
+        for item, previous in reversed(pending):
+            self._move(item["NAME"], previous)
+        # a flush while the write was awaited may have saved the undone changes
+        self.store.mark_dirty(GROUPS)
+        self.store.mark_dirty(STUDENTS)
+
+    def group_of(self, member: str):
+        """ the group of a member, or None """
+        return self.member_group.get(member)
+
+    def is_full(self, group: str) -> bool:
+        """ True once a group has GROUP_SIZE members """
+        return len(self.groups[group]) >= GROUP_SIZE
+
+    def find_student(self, name: str):
+        """
+            Looks a student up by Discord name or real name, ignoring case.
+
+            Returns:
+                the username the student is stored under, or None.
+        """
+        return self.names.get(name.upper())
+
+    def student_group(self, username: str) -> str:
+        """ group number recorded for a student in the name pool """
+        values = self.students.get(username, [])
+        return values[1] if len(values) > 1 else UNASSIGNED
+
+    def _set_student_group(self, member: str, group: str):
+        username = self.find_student(member)
+        if username is None:
+            return
+        values = self.students[username]
+        values[1:] = [group]
+
+    def _move(self, member: str, group) -> bool:
+        """ puts a member in a group, or in none when group is None; False if nothing changed """
+        if group not in self.groups:
+            group = None
+        current = self.member_group.pop(member, None)
+        if current == group:
+            if current is not None:
+                self.member_group[member] = current
+            return False
+        if current is not None:
+            self.groups[current].remove(member)
+        if group is not None:
+            self.groups[group].append(member)
+            self.member_group[member] = group
+        self._set_student_group(member, group or UNASSIGNED)
+        return True
+
+    def _join(self, member: str, group: str):
+        previous = self.member_group.get(member)
+        self._move(member, group)
+        self.unlogged.append((entry(MEMBER, member, group), previous))
+
+    def join(self, member: str, group: str, save: bool = True):
+        """
+            Adds a member to a group. The caller checks that the group exists, has room and
+            that the member is in no group yet.
+
+            Parameters:
+                save: save straight away; pass False and await commit() instead from a command.
+        """
+        self._join(member, group)
+        if save:
+            self.save()
+
+    def leave(self, member: str, save: bool = True):
+        """
+            Removes a member from their group.
+
+            Parameters:
+                save: save straight away; pass False and await commit() instead from a command.
+
+            Returns:
+                the group the member left, or None if they were in no group.
+        """
+        group = self.member_group.get(member)
+        if group is None:
+            return None
+        self._move(member, None)
+        self.unlogged.append((entry(MEMBER, member, None), group))
+        if save:
+            self.save()
+        return group
+
+    def unassigned(self) -> list:
+        """ usernames of the students in no group, in name pool order """
+        return [username for username in self.students
+                if self.student_group(username) == UNASSIGNED and self.group_of(username.upper()) is None]
+
+    def assign(self, assignments: dict, save: bool = True) -> dict:
+        """
+            Puts students into groups and saves the roster once. Students who joined a group
+            meanwhile and groups that filled up meanwhile are skipped.
+
+            Parameters:
+                assignments: username -> group.
+                save: save straight away; pass False and await commit() instead from a command.
+
+            Returns:
+                the assignments made.
+        """
+        made = {}
+        for username, group in assignments.items():
+            if self.group_of(username.upper()) is None and not self.is_full(group):
+                self._join(username.upper(), group)
+                made[username] = group
+        if made and save:
+            self.save()
+        return made
+
+    def auto_assign(self, save: bool = True) -> dict:
+        """
+            Puts every student who is in no group into the group with the fewest members that still
+            has room, in one pass over the students with a min-heap of group sizes. Ties go to the
+            group listed first. The roster is saved once, after every assignment.
+
+            Parameters:
+                save: save straight away; pass False and await commit() instead from a command.
+
+            Returns:
+                the assignments made, username -> group, in name pool order.
+        """
+        # (size, position in groups.csv, group) of every group with room
+        heap = [(len(members), order, group) for order, (group, members) in enumerate(self.groups.items())
+                if len(members) < GROUP_SIZE]
+        heapq.heapify(heap)
+        assignments = {}
+        for username in self.unassigned():
+            if not heap:
+                break
+            size, order, group = heap[0]
+            assignments[username] = group
+            if size + 1 < GROUP_SIZE:
+                heapq.heapreplace(heap, (size + 1, order, group))
+            else:
+                heapq.heappop(heap)
+        return self.assign(assignments, save)
+
+    def set_preferences(self, username: str, kind: str, values: list):
+        """
+            Records the TEAMMATES or SLOTS preferences of a student for group formation.
+        """
+        self.preferences.setdefault(username, {})[kind] = values
+        self.store.mark_dirty(PREFERENCES, username)
+
+    def formation_input(self) -> tuple:
+        """
+            Copies what group formation needs, so it can run off the event loop.
+
+            Returns:
+                (students to place, group -> members as usernames where known, preferences).
+        """
+        groups = {group: [self.find_student(member) or member for member in members]
+                  for group, members in self.groups.items()}
+        preferences = {username: {kind: list(values) for kind, values in prefs.items()}
+                       for username, prefs in self.preferences.items()}
+        return self.unassigned(), groups, preferences
+
+    def add_student(self, username: str, real_name: str):
+        """
+            Adds a verified student to the name pool, not yet in a group.
+        """
+        self.students[username] = [real_name, UNASSIGNED]
+        self._index_student(username, self.students[username])
+        self.save()
+
+    def remove_student(self, name: str, save: bool = True):
+        """
+            Removes a student, found by Discord name or real name, from the pool and their group.
+
+            Parameters:
+                save: save straight away; pass False and await commit() instead from a listener.
+        """
+        self.leave(name.upper(), save=False)
+        username = self.find_student(name)
+        if username is not None:
+            self.leave(username.upper(), save=False)
+            values = self.students.pop(username)
+            for key in [username] + values[:1]:
+                if self.names.get(key.upper()) == username:
+                    del self.names[key.upper()]
+        if save:
+            self.save()
+
+
+_roster = None
+
+
+def get_roster() -> GroupRoster:
+    """
+        Returns the roster shared by every cog, building it on first use.
+    """
+    global _roster  # pylint: disable=global-statement
+    if _roster is None:
+        _roster = GroupRoster()
+    return _roster
@@ -0,0 +1,199 @@
+"""
+    Ledger utility records every group membership and project vote as one appended line, so a
+    change is on disk before the command answers, while the CSV snapshots are still written
+    behind by the data store. Each entry is an absolute assignment ("NAME is now in TARGET"),
+    so replaying the whole ledger over any older snapshot gives the current state back.
+    Once the data store has flushed every dataset, the entries the snapshots now hold are dropped,
+    so the ledger only ever holds what happened since the last flush.
+
+    Commands changing the same group, member or project are serialized by per-resource locks;
+    commands touching different resources never wait for each other.
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from Utility.data_store import DATA_DIR, store, atomic_write
+
+LEDGER = os.path.join(DATA_DIR, "server_data", "ledger.jsonl")
+# entry kinds: a member joining a group (TARGET None when leaving), a group voting for a project
+MEMBER = "MEMBER"
+VOTE = "VOTE"
+
+
+def entry(kind: str, name: str, target) -> dict:
+    """ a ledger entry saying that name is now assigned to target, or to nothing when None """
+    return {"KIND": kind, "NAME": name, "TARGET": target, "TIME": time.time()}
+
+
+class ResourceLocks:
+    """
+        Class hands out one asyncio lock per resource key; a lock is dropped once nobody holds
+        or waits for it, so the number of locks is bounded by the commands in flight.
+    """
+
+    def __init__(self):
+        self.locks = {}
+        self.users = {}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, *keys):
+        """
+            Holds the locks of every key, taken in sorted order so two commands never deadlock.
+
+            Parameters:
+                keys: hashable, sortable resource keys, e.g. ("GROUP", "GROUP 1").
+        """
+        keys = sorted(set(keys))
+        for key in keys:
+            self.users[key] = self.users.get(key, 0) + 1
+            self.locks.setdefault(key, asyncio.Lock())
+        acquired = []
+        try:
+            for key in keys:
+                await self.locks[key].acquire()
+                acquired.append(key)
+            yield
+        finally:
+            for key in reversed(acquired):
+                self.locks[key].release()
+            for key in keys:
+                self.users[key] -= 1
+                if not self.users[key]:
+                    del self.users[key]
+                    del self.locks[key]
+
+
+class Ledger:
+    """
+        Class appends entries to the ledger file and reads them back.
+
+        Every entry gets a sequence number (SEQ), counting on from the entries already in the
+        file. A checkpoint drops the entries up to the last acknowledged one, plus the entries of
+        earlier runs whose kind was replayed.
+    """
+
+    def __init__(self, path: str = LEDGER, fsync: bool = True):
+        """
+            Parameters:
+                path: the JSON-lines ledger file.
+                fsync: force every append to disk; tests turn it off.
+        """
+        self.path = path
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        # one writer thread keeps appends and checkpoints in submission order
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ledger")
+        # entries up to start were written by earlier runs
+        self.start = max((item.get("SEQ", 0) for item in self._entries()), default=0)
+        self.sequence = self.start
+        # last entry known to be on disk; its owner marked its dataset dirty in the same step
+        self.acknowledged = self.start
+        # kinds whose entries of earlier runs were replayed into the datasets
+        self.replayed = set()
+        self._checkpointed = (self.start, frozenset())
+
+    def replay(self, kind: str) -> list:
+        """
+            Returns the entries of one kind, oldest first. A line cut short by a crash is skipped.
+            The caller applies them and marks its datasets dirty, so the next checkpoint may drop them.
+        """
+        self.replayed.add(kind)
+        return [item for item in self._entries() if item.get("KIND") == kind]
+
+    def _entries(self) -> list:
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with self.lock, open(self.path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        return entries
+
+    def write(self, entries: list):
+        """
+            Appends entries with a single write, blocking until they and every append queued
+            before them are on disk.
+        """
+        if entries:
+            last = self._number(entries)
+            self.executor.submit(self._write, entries).result()
+            self.acknowledged = max(self.acknowledged, last)
+
+    async def append(self, entries: list):
+        """
+            Appends entries off the event loop; returns once they are on disk.
+        """
+        if entries:
+            last = self._number(entries)
+            await asyncio.get_running_loop().run_in_executor(self.executor, self._write, entries)
+            self.acknowledged = max(self.acknowledged, last)
+
+    def _number(self, entries: list) -> int:
+        for item in entries:
+            self.sequence += 1
+            item["SEQ"] = self.sequence
+        return self.sequence
+
+    def checkpoint(self):
+        """
+            Drops the entries the data store snapshots hold. Called on the event loop right after
+            the store flushed every dirty dataset: entries appended but not acknowledged yet,
+            and entries of earlier runs nobody replayed, are kept.
+        """
+        state = (self.acknowledged, frozenset(self.replayed))
+        if state == self._checkpointed:
+            return
+        self._checkpointed = state
+        try:
+            self.executor.submit(self._compact, *state)
+        except RuntimeError:
+            # the final flush at exit runs after the writer thread was shut down
+            self._compact(*state)
+
+    def _compact(self, acknowledged: int, replayed: frozenset):
+        with self.lock:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, encoding="utf-8") as file:
+                lines = file.readlines()
+            kept = []
+            for line in lines:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue
+                sequence = item.get("SEQ", 0)
+                if sequence > acknowledged or (sequence <= self.start and item.get("KIND") not in replayed):
+                    kept.append(line if line.endswith("\n") else line + "\n")
+            if len(kept) == len(lines):
+                return
+            atomic_write(self.path, "".join(kept))
+
+    def _write(self, entries: list):
+        text = "".join(json.dumps(item) + "\n" for item in entries)
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if os.path.exists(self.path) and os.path.getsize(self.path):
+                with open(self.path, "rb") as file:
+                    file.seek(-1, os.SEEK_END)
+                    # a line cut short by a crash must not swallow the next entry
+                    if file.read(1) != b"\n":
+                        text = "\n" + text
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(text)
+                file.flush()
+                if self.fsync:
+                    os.fsync(file.fileno())
+
+
+# The one ledger shared by the group and voting cogs, checkpointed after every full flush
+ledger = Ledger()
+store.flush_hooks.append(ledger.checkpoint)
@@ -0,0 +1,132 @@
+"""
+    Message pipeline utility runs every incoming message through one ordered list of stages.
+    Facts several stages need (author roles, urls, tokens, verified status) are computed once
+    per message, a stage can stop the rest, and the time spent in each stage is recorded in the
+    bot's stats (see bot_stats.py).
+"""
+import os
+import re
+import traceback
+
+import discord
+from Utility.bot_stats import BotStats, get_stats, measure
+
+URL_REGEX = re.compile(
+    r"(?i)\b((?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+"
+    r"\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:'\".,<>?«»“”‘’]))")
+TOKEN_REGEX = re.compile(r"[\w']+")
+
+
+class MessageContext:
+    """
+        Class wraps a message with the facts shared between stages. Each fact is worked out the
+        first time a stage asks for it and reused by every later stage.
+    """
+
+    def __init__(self, message):
+        self.message = message
+        self.stopped = False
+        self._roles = None
+        self._urls = None
+        self._tokens = None
+        self._exempt = None
+
+    @property
+    def is_dm(self) -> bool:
+        """ True when the message was sent in a direct message """
+        return isinstance(self.message.channel, discord.DMChannel)
+
+    @property
+    def roles(self) -> frozenset:
+        """ names of the author's roles; empty in direct messages """
+        if self._roles is None:
+            self._roles = frozenset(role.name for role in getattr(self.message.author, "roles", []))
+        return self._roles
+
+    @property
+    def verified(self) -> bool:
+        """ False when the author still carries the unverified role """
+        return os.getenv("UNVERIFIED_ROLE_NAME") not in self.roles
+
+    @property
+    def urls(self) -> list:
+        """ urls found in the message content """
+        if self._urls is None:
+            self._urls = [match[0] for match in URL_REGEX.findall(self.message.content)]
+        return self._urls
+
+    @property
+    def tokens(self) -> list:
+        """ lower-cased words of the message content """
+        if self._tokens is None:
+            self._tokens = TOKEN_REGEX.findall(self.message.content.lower())
+        return self._tokens
+
+    async def exempt(self, bot) -> bool:
+        """ True for the bot's own messages and for commands, which content filters leave alone """
+        if self._exempt is None:
+            prefix = await bot.get_prefix(self.message)
+            self._exempt = self.message.author == bot.user or \
+                self.message.content.startswith(prefix if isinstance(prefix, str) else tuple(prefix))
+        return self._exempt
+
+    def stop(self):
+        """ skips every stage after the current one, e.g. once the message was deleted """
+        self.stopped = True
+
+
+class MessagePipeline:
+    """
+        Class holds the message stages sorted by their order and runs them one after another.
+    """
+
+    def __init__(self, stats: BotStats = None):
+        self.stages = []
+        self.stats = BotStats() if stats is None else stats
+
+    def add_stage(self, name: str, handler, order: int):
+        """
+            Registers a stage, replacing any stage with the same name.
+
+            Parameters:
+                name: unique name of the stage, used for timings and removal.
+                handler: coroutine function taking a MessageContext.
+                order: stages run from the lowest order to the highest.
+        """
+        self.remove_stage(name)
+        self.stages.append((order, name, handler))
+        self.stages.sort(key=lambda stage: stage[0])
+
+    def remove_stage(self, name: str):
+        """
+            Unregisters a stage, e.g. when its cog is unloaded.
+        """
+        self.stages = [stage for stage in self.stages if stage[1] != name]
+
+    async def run(self, message):
+        """
+            Runs the stages for one message until they finish or one of them stops the rest.
+
+            Parameters:
+                message: the discord message that was received.
+        """
+        context = MessageContext(message)
+        for _, name, handler in list(self.stages):
+            try:
+                await measure(self.stats, "stage " + name, handler(context))
+            except Exception:  # pylint: disable=broad-except
+                # one failing stage must not starve the others
+                traceback.print_exc()
+            if context.stopped:
+                break
+
+
+def get_pipeline(bot) -> MessagePipeline:
+    """
+        Returns the pipeline of a bot, creating it and hooking it to on_message on first use.
+    """
+    pipeline = getattr(bot, "message_pipeline", None)
+    if pipeline is None:
+        pipeline = bot.message_pipeline = MessagePipeline(get_stats(bot))
+        bot.add_listener(pipeline.run, "on_message")
+    return pipeline
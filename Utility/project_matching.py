@@ -0,0 +1,43 @@
+"""
+    Project matching utility assigns groups to projects from their ranked preferences.
+    Every project is expanded into one column per free seat, so the capacitated matching becomes
+    a plain assignment problem that linear_sum_assignment solves optimally in one call.
+"""
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+# Most groups that can work on one project
+PROJECT_CAPACITY = 6
+
+
+def match_projects(rankings: dict, capacities: dict) -> dict:
+    """
+        Matches groups to projects so that the sum of the ranks the groups gave their projects is
+        as small as possible. Projects a group did not rank cost more than any ranked one, so a
+        group only gets one of them when all its ranked projects are full.
+
+        Parameters:
+            rankings: group -> projects, most wanted first.
+            capacities: project -> number of groups it can still take.
+
+        Returns:
+            group -> project for every group that got a seat. Groups are left out only when
+            there are fewer seats than groups.
+    """
+    groups = list(rankings)
+    projects = list(capacities)
+    seats = np.repeat(np.arange(len(projects)), [max(0, capacities[p]) for p in projects])
+    if not groups or not len(seats):
+        return {}
+    column = {project: i for i, project in enumerate(projects)}
+    cost = np.full((len(groups), len(projects)), float(len(projects)))
+    rows, cols, ranks = [], [], []
+    for row, group in enumerate(groups):
+        for rank, project in enumerate(dict.fromkeys(rankings[group])):
+            if project in column:
+                rows.append(row)
+                cols.append(column[project])
+                ranks.append(rank)
+    cost[rows, cols] = ranks
+    matched_groups, matched_seats = linear_sum_assignment(cost[:, seats])
+    return {groups[g]: projects[seats[s]] for g, s in zip(matched_groups, matched_seats)}
@@ -0,0 +1,87 @@
+"""
+    Reminder index utility keeps homework reminders sorted by due time, overall and per course,
+    so "due between", "due today" and "due for a course" are bisect range lookups instead of
+    scans that re-parse every due date.
+"""
+from bisect import bisect_left, insort
+
+
+class ReminderIndex:
+    """
+        Class indexes reminders (dicts with COURSE, HOMEWORK and FUTURE, the due time in epoch
+        seconds) by (course, homework), by due time and by course and due time.
+        A reminder's FUTURE must not change while it is indexed: remove it, change it, add it.
+    """
+
+    def __init__(self, reminders=()):
+        self.reminders = {}
+        self.by_due = []
+        self.by_course = {}
+        for reminder in reminders:
+            self.add(reminder)
+
+    def __len__(self):
+        return len(self.reminders)
+
+    @staticmethod
+    def _entry(reminder):
+        return reminder["FUTURE"], reminder["COURSE"], reminder["HOMEWORK"]
+
+    def get(self, course: str, homework: str):
+        """ the reminder of a homework, or None """
+        return self.reminders.get((course, homework))
+
+    def add(self, reminder: dict):
+        """
+            Indexes a reminder, replacing the one for the same course and homework.
+        """
+        self.remove(reminder["COURSE"], reminder["HOMEWORK"])
+        self.reminders[(reminder["COURSE"], reminder["HOMEWORK"])] = reminder
+        entry = self._entry(reminder)
+        insort(self.by_due, entry)
+        insort(self.by_course.setdefault(reminder["COURSE"], []), entry)
+
+    def remove(self, course: str, homework: str):
+        """
+            Drops the reminder of a homework from the index.
+
+            Returns:
+                the removed reminder, or None if there was none.
+        """
+        reminder = self.reminders.pop((course, homework), None)
+        if reminder is None:
+            return None
+        entry = self._entry(reminder)
+        del self.by_due[bisect_left(self.by_due, entry)]
+        entries = self.by_course[course]
+        del entries[bisect_left(entries, entry)]
+        if not entries:
+            del self.by_course[course]
+        return reminder
+
+    def clear(self):
+        """ drops every reminder """
+        self.reminders.clear()
+        self.by_due.clear()
+        self.by_course.clear()
+
+    def _slice(self, entries: list, start: float, end: float) -> list:
+        low = 0 if start is None else bisect_left(entries, (start,))
+        high = len(entries) if end is None else bisect_left(entries, (end,), low)
+        return [self.reminders[(course, homework)] for _, course, homework in entries[low:high]]
+
+    def due_between(self, start: float = None, end: float = None) -> list:
+        """
+            Reminders due in [start, end), soonest first.
+
+            Parameters:
+                start: epoch seconds, or None for no lower bound.
+                end: epoch seconds, or None for no upper bound.
+        """
+        return self._slice(self.by_due, start, end)
+
+    def course_due(self, course: str, start: float = None, end: float = None) -> list:
+        """
+            Reminders of one course due in [start, end), soonest first.
+        """
+        return self._slice(self.by_course.get(course, []), start, end)
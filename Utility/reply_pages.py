@@ -0,0 +1,127 @@
+"""
+    Reply pages utility sends a list of rows as few messages as Discord's size limit allows.
+    A reply that fits in one message is sent as one message; a longer one is sent as a single
+    message that is flipped through with reactions. The pages are kept in memory, so flipping
+    only edits the message and never re-runs the command.
+"""
+from collections import OrderedDict
+
+import discord
+
+# Discord rejects messages over 2000 characters; room is kept for the page footer
+PAGE_LIMIT = 1900
+PREVIOUS = "⬅️"
+NEXT = "➡️"
+# paginated replies remembered for flipping, oldest forgotten first
+CACHE_SIZE = 500
+
+
+def paginate(lines: list, limit: int = PAGE_LIMIT) -> list:
+    """
+        Packs lines into pages of at most limit characters, splitting over-long lines.
+
+        Parameters:
+            lines: the rows of the reply.
+            limit: maximum length of a page.
+
+        Returns:
+            the pages, each the lines it holds joined by newlines.
+    """
+    pages, page = [], ""
+    for line in lines:
+        while len(line) > limit:
+            if page:
+                pages.append(page)
+                page = ""
+            pages.append(line[:limit])
+            line = line[limit:]
+        if page and len(page) + 1 + len(line) > limit:
+            pages.append(page)
+            page = ""
+        page = page + "\n" + line if page else line
+    if page:
+        pages.append(page)
+    return pages
+
+
+class ReplyRenderer:
+    """
+        Class sends paginated replies and flips their pages when a reaction is added.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        # message id -> [pages, current page]
+        self.books = OrderedDict()
+
+    @staticmethod
+    def render(pages: list, number: int) -> str:
+        """ text of one page, with a footer when there are several """
+        if len(pages) == 1:
+            return pages[0]
+        return "{}\n*Page {}/{}*".format(pages[number], number + 1, len(pages))
+
+    async def send(self, destination, lines: list, header: str = None, empty: str = None):
+        """
+            Sends rows as one message, or as one paginated message if they do not fit.
+
+            Parameters:
+                destination: the context or channel to reply in.
+                lines: the rows of the reply.
+                header: optional first line repeated at the top of every page.
+                empty: optional message sent when there are no rows.
+
+            Returns:
+                the message sent, or None when nothing was sent.
+        """
+        if not lines:
+            return await destination.send(empty) if empty else None
+        limit = PAGE_LIMIT - (len(header) + 1 if header else 0)
+        pages = paginate(lines, limit)
+        if header:
+            pages = [header + "\n" + page for page in pages]
+        message = await destination.send(self.render(pages, 0))
+        if len(pages) > 1:
+            self.books[message.id] = [pages, 0]
+            while len(self.books) > CACHE_SIZE:
+                self.books.popitem(last=False)
+            try:
+                await message.add_reaction(PREVIOUS)
+                await message.add_reaction(NEXT)
+            except discord.HTTPException:
+                pass
+        return message
+
+    async def on_raw_reaction_add(self, payload):
+        """
+            Flips the page of a paginated reply when someone reacts with an arrow.
+        """
+        emoji = str(payload.emoji)
+        if emoji not in (PREVIOUS, NEXT) or payload.user_id == self.bot.user.id:
+            return
+        book = self.books.get(payload.message_id)
+        if book is None:
+            return
+        pages, number = book
+        book[1] = (number + (1 if emoji == NEXT else -1)) % len(pages)
+        channel = self.bot.get_channel(payload.channel_id)
+        if channel is None:
+            channel = await self.bot.fetch_channel(payload.channel_id)
+        message = channel.get_partial_message(payload.message_id)
+        await message.edit(content=self.render(pages, book[1]))
+        try:
+            await message.remove_reaction(payload.emoji, discord.Object(id=payload.user_id))
+        except discord.HTTPException:
+            # not allowed in direct messages or without Manage Messages
+            pass
+
+
+def get_renderer(bot) -> ReplyRenderer:
+    """
+        Returns the reply renderer of a bot, creating it and hooking it to reactions on first use.
+    """
+    renderer = getattr(bot, "reply_renderer", None)
+    if renderer is None:
+        renderer = bot.reply_renderer = ReplyRenderer(bot)
+        bot.add_listener(renderer.on_raw_reaction_add, "on_raw_reaction_add")
+    return renderer
@@ -0,0 +1,119 @@
+"""
+    Scheduler utility runs timed jobs from one task that sleeps until the earliest job is due.
+    Jobs are kept in a min-heap ordered by fire time; adding, replacing or cancelling a job wakes
+    the task so it can sleep for the new shortest time. With no jobs it waits without waking up.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+import traceback
+
+
+class Scheduler:
+    """
+        Class keeps jobs keyed by a caller chosen key, e.g. ('due', 'CSC510', 'HW2').
+        Scheduling an existing key replaces the job; cancelled jobs are dropped lazily.
+    """
+
+    def __init__(self, clock=time.time):
+        """
+            Parameters:
+                clock: time source returning epoch seconds, replaceable in tests.
+        """
+        self.clock = clock
+        self.heap = []
+        self.jobs = {}
+        self.counter = itertools.count()
+        self._wake = None
+        self._task = None
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def __contains__(self, key):
+        return key in self.jobs
+
+    def schedule(self, key, when: float, callback):
+        """
+            Adds or replaces a job.
+
+            Parameters:
+                key: hashable name of the job.
+                when: epoch seconds at which the job fires; a time in the past fires right away.
+                callback: coroutine function called without arguments.
+        """
+        self.cancel(key)
+        job = [when, next(self.counter), key, callback]
+        self.jobs[key] = job
+        heapq.heappush(self.heap, job)
+        if self.heap[0] is job:
+            self._wakeup()
+
+    def cancel(self, key) -> bool:
+        """
+            Cancels a job.
+
+            Returns:
+                True if a job with that key was waiting.
+        """
+        job = self.jobs.pop(key, None)
+        if job is None:
+            return False
+        job[-1] = None
+        # rebuild once cancelled jobs make up most of the heap
+        if len(self.heap) > 2 * len(self.jobs) + 32:
+            self.heap = [job for job in self.heap if job[-1] is not None]
+            heapq.heapify(self.heap)
+        return True
+
+    def next_time(self):
+        """ fire time of the earliest job, or None when there is none """
+        while self.heap and self.heap[0][-1] is None:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def start(self, loop=None):
+        """
+            Starts the dispatching task on the given (or the running) loop.
+        """
+        if self._task is None or self._task.done():
+            loop = loop or asyncio.get_event_loop()
+            self._task = loop.create_task(self._run())
+
+    def stop(self):
+        """ stops dispatching; waiting jobs are kept and run after the next start """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _wakeup(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _run(self):
+        self._wake = asyncio.Event()
+        while True:
+            self._wake.clear()
+            when = self.next_time()
+            if when is None:
+                await self._wake.wait()
+                continue
+            delay = when - self.clock()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, key, callback = heapq.heappop(self.heap)
+            del self.jobs[key]
+            # a slow job must not hold up the ones due after it
+            asyncio.ensure_future(self._call(callback))
+
+    @staticmethod
+    async def _call(callback):
+        try:
+            await callback()
+        except Exception:  # pylint: disable=broad-except
+            traceback.print_exc()
@@ -0,0 +1,146 @@
+"""
+    Sentiment model utility loads the flair sentiment classifier once and keeps it resident.
+    Loading and prediction run in a worker thread so the event loop, and with it the gateway
+    heartbeat, never waits on the model. Requests are queued and gathered into micro-batches
+    so many concurrent requests cost one predict call.
+"""
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# Load the model when the cog loads ("1") or on the first request ("0")
+PRELOAD = os.getenv("SENTIMENT_PRELOAD", "0") == "1"
+MODEL_NAME = os.getenv("SENTIMENT_MODEL", "en-sentiment")
+# A batch is sent to the model once it holds BATCH_SIZE sentences or BATCH_WINDOW_MS passed
+BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "32"))
+BATCH_WINDOW_MS = float(os.getenv("SENTIMENT_BATCH_WINDOW_MS", "10"))
+
+
+class SentimentModel:
+    """
+        Class owns the classifier and its worker thread.
+
+        state is one of 'unloaded', 'loading', 'ready' or 'failed'.
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, batch_size: int = BATCH_SIZE,
+                 batch_window_ms: float = BATCH_WINDOW_MS):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.batch_window = batch_window_ms / 1000
+        self.state = "unloaded"
+        self.error = None
+        self.classifier = None
+        # one worker: the classifier is not meant to be called from several threads at once
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sentiment")
+        self._loading = None
+        self._queue = None
+        self._batcher = None
+
+    @property
+    def ready(self) -> bool:
+        """ True once the classifier is loaded and can answer requests """
+        return self.state == "ready"
+
+    def _load(self):
+        # pylint: disable=import-outside-toplevel
+        from flair.models import TextClassifier
+        return TextClassifier.load(self.model_name)
+
+    async def load(self):
+        """
+            Loads the classifier in the worker thread. Concurrent callers share one load, and
+            calls after a successful load return straight away.
+
+            Returns:
+                the loaded classifier; raises the load error if loading failed.
+        """
+        if self.ready:
+            return self.classifier
+        if self._loading is None or self._loading.get_loop() is not asyncio.get_running_loop():
+            self._loading = asyncio.ensure_future(self._load_once())
+        return await asyncio.shield(self._loading)
+
+    async def _load_once(self):
+        self.state = "loading"
+        try:
+            self.classifier = await asyncio.get_running_loop().run_in_executor(self.executor, self._load)
+        except Exception as error:
+            self.state, self.error = "failed", error
+            # let a later request try again
+            self._loading = None
+            raise
+        self.state = "ready"
+        return self.classifier
+
+    def _predict(self, texts: list) -> list:
+        # pylint: disable=import-outside-toplevel
+        from flair.data import Sentence
+        sentences = [Sentence(text) for text in texts]
+        self.classifier.predict(sentences, mini_batch_size=len(sentences))
+        return [sentence.labels for sentence in sentences]
+
+    async def predict(self, text: str) -> list:
+        """
+            Classifies one text, loading the model first if needed.
+
+            Parameters:
+                text: the sentence to classify.
+
+            Returns:
+                the flair labels of the text, e.g. [POSITIVE (0.9981)].
+        """
+        return (await self.predict_many([text]))[0]
+
+    async def predict_many(self, texts: list) -> list:
+        """
+            Classifies several texts through the batching queue.
+
+            Parameters:
+                texts: the sentences to classify.
+
+            Returns:
+                the flair labels of each text, in the same order.
+        """
+        await self.load()
+        loop = asyncio.get_running_loop()
+        if self._batcher is None or self._batcher.done() or self._batcher.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._batcher = loop.create_task(self._run_batches())
+        futures = [loop.create_future() for _ in texts]
+        for text, future in zip(texts, futures):
+            self._queue.put_nowait((text, future))
+        return list(await asyncio.gather(*futures))
+
+    async def _run_batches(self):
+        """
+            Gathers queued requests for up to batch_window seconds or batch_size sentences and
+            answers all of them with one predict call. Requests arriving while a batch is being
+            predicted simply wait in the queue and form the next batch.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            if self._queue.qsize() < self.batch_size - 1:
+                await asyncio.sleep(self.batch_window)
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            # callers that gave up (e.g. a cancelled command) are skipped
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if not batch:
+                continue
+            try:
+                labels = await loop.run_in_executor(self.executor, self._predict,
+                                                    [text for text, _ in batch])
+            except Exception as error:  # pylint: disable=broad-except
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            for (_, future), label in zip(batch, labels):
+                if not future.done():
+                    future.set_result(label)
+
+
+# The one model shared by every cog, kept across cog reloads
+sentiment_model = SentimentModel()
@@ -0,0 +1,67 @@
+"""
+    Spam limiter utility tracks how many messages each user sent in a sliding time window.
+"""
+import time
+from collections import deque, OrderedDict
+
+
+class SpamLimiter:
+    """
+        Class keeps a short, bounded log of recent messages per user. Checking a message only
+        touches that user's log, so the cost does not depend on how busy the server is.
+        Logs are ordered by their user's latest message, so logs whose window is empty are
+        dropped from the front and only users active within the window are kept.
+    """
+
+    def __init__(self, max_messages: int = 4, window: float = 10.0, clock=time.monotonic):
+        """
+            Parameters:
+                max_messages: messages a user may send within the window without being flagged.
+                window: length of the sliding window in seconds.
+                clock: time source, replaceable in tests.
+        """
+        self.max_messages = max_messages
+        self.window = window
+        self.clock = clock
+        # user id -> deque of (time, channel id, message id), least recently active user first
+        self.logs = OrderedDict()
+
+    def hit(self, user_id: int, channel_id: int, message_id: int) -> dict:
+        """
+            Records a message and checks the author against the limit.
+
+            Parameters:
+                user_id: author of the message.
+                channel_id: channel the message was sent in.
+                message_id: id of the message.
+
+            Returns:
+                an empty dict while the user is within the limit; otherwise the ids of the
+                offending messages grouped by channel, after which the user's log starts over.
+        """
+        now = self.clock()
+        log = self.logs.get(user_id)
+        if log is None:
+            log = self.logs[user_id] = deque(maxlen=self.max_messages + 1)
+        else:
+            self.logs.move_to_end(user_id)
+        while log and now - log[0][0] > self.window:
+            log.popleft()
+        log.append((now, channel_id, message_id))
+        self._prune(now)
+        if len(log) <= self.max_messages:
+            return {}
+
+        offending = {}
+        for _, channel, message in log:
+            offending.setdefault(channel, []).append(message)
+        del self.logs[user_id]
+        return offending
+
+    def _prune(self, now: float):
+        """ drops the logs of users whose latest message is older than the window """
+        while self.logs:
+            user_id, log = next(iter(self.logs.items()))
+            if now - log[-1][0] <= self.window:
+                break
+            del self.logs[user_id]
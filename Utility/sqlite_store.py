@@ -0,0 +1,226 @@
+"""
+    SQLite storage backend for the shared data store.
+    Every dataset under data/ gets its own table, keyed like its records, in a WAL-mode database.
+    Datasets are still served from memory, so the primary keys are only used by flushes, which
+    write the rows that changed since the last one.
+    Run `python -m Utility.sqlite_store` once to import the existing JSON and CSV files.
+"""
+import sys
+import sqlite3
+
+from Utility.data_store import DataStore, DATA_DIR, DB_PATH, trim_row
+
+
+class Table:
+    """
+        Class describes how one dataset maps onto a table.
+
+        Parameters:
+            name: table name.
+            columns: column names; the first key_len columns form the primary key.
+            key_len: number of primary key columns.
+            schema: CREATE statements of the table.
+            to_rows: turns the in-memory dataset into an iterable of row tuples.
+            from_rows: rebuilds the in-memory dataset from rows in `order_by` order.
+            order_by: ORDER BY clause used when the dataset is loaded.
+    """
+
+    def __init__(self, name, columns, key_len, schema, to_rows, from_rows, order_by):
+        self.name = name
+        self.columns = columns
+        self.key_len = key_len
+        self.schema = schema
+        self.to_rows = to_rows
+        self.from_rows = from_rows
+        self.order_by = order_by
+
+
+def _slots(data: dict, width: int):
+    """ rows for a CSV roster: one per (key, slot), empty slots stored as NULL """
+    for position, (key, values) in enumerate(data.items()):
+        for slot in range(max(width, len(values))):
+            yield key, slot, values[slot] if slot < len(values) else None, position
+
+
+def _unslot(rows) -> dict:
+    data = {}
+    for key, _, value, _ in rows:
+        members = data.setdefault(key, [])
+        if value is not None:
+            members.append(value)
+    return data
+
+
+def _user(experience, level, last_message) -> dict:
+    user = {"experience": experience, "level": level}
+    if last_message is not None:
+        user["LastMessage"] = last_message
+    return user
+
+
+TABLES = {
+    "participation/users.json": Table(
+        "users", ("user_id", "experience", "level", "last_message"), 1,
+        ["CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, experience INTEGER NOT NULL,"
+         " level INTEGER NOT NULL, last_message INTEGER)"],
+        lambda data: ((uid, user.get("experience", 0), user.get("level", 1), user.get("LastMessage"))
+                      for uid, user in data.items()),
+        lambda rows: {uid: _user(experience, level, last) for uid, experience, level, last in rows},
+        "rowid"),
+    "remindme/reminders.json": Table(
+        "reminders", ("course", "homework", "author_id", "duedate", "future"), 2,
+        ["CREATE TABLE IF NOT EXISTS reminders (course TEXT NOT NULL, homework TEXT NOT NULL,"
+         " author_id INTEGER, duedate TEXT NOT NULL, future REAL NOT NULL,"
+         " PRIMARY KEY (course, homework))"],
+        lambda data: ((r["COURSE"], r["HOMEWORK"], r["ID"], r["DUEDATE"], r["FUTURE"]) for r in data),
+        lambda rows: [{"ID": author, "COURSE": course, "HOMEWORK": homework, "DUEDATE": duedate,
+                       "FUTURE": future} for course, homework, author, duedate, future in rows],
+        "future"),
+    "remindme/personal.json": Table(
+        "personal_reminders", ("reminder_id", "user_id", "channel_id", "future", "text"), 1,
+        ["CREATE TABLE IF NOT EXISTS personal_reminders (reminder_id INTEGER PRIMARY KEY,"
+         " user_id INTEGER NOT NULL, channel_id INTEGER, future REAL NOT NULL, text TEXT)"],
+        lambda data: ((int(rid), r["USER"], r["CHANNEL"], r["FUTURE"], r["TEXT"])
+                      for rid, r in data.items()),
+        lambda rows: {str(rid): {"USER": user, "CHANNEL": channel, "FUTURE": future, "TEXT": text}
+                      for rid, user, channel, future, text in rows},
+        "reminder_id"),
+    "qanda/qandastorage.json": Table(
+        "questions", ("number", "question", "author", "message_id", "answer"), 1,
+        ["CREATE TABLE IF NOT EXISTS questions (number INTEGER PRIMARY KEY, question TEXT,"
+         " author TEXT, message_id TEXT, answer TEXT)"],
+        lambda data: ((int(num), q["question"], q["author"], q["id"], q["answer"])
+                      for num, q in data.items()),
+        lambda rows: {str(num): {"question": question, "author": author, "id": message_id,
+                                 "answer": answer}
+                      for num, question, author, message_id, answer in rows},
+        "number"),
+    "PinMessage/PinnedMessages.json": Table(
+        "pins", ("position", "author_id", "tag", "description", "link"), 1,
+        ["CREATE TABLE IF NOT EXISTS pins (position INTEGER PRIMARY KEY, author_id INTEGER,"
+         " tag TEXT, description TEXT, link TEXT)"],
+        lambda data: ((pos, p["ID"], p["TAG"], p["DESCRIPTION"], p["LINK"])
+                      for pos, p in enumerate(data)),
+        lambda rows: [{"ID": author, "TAG": tag, "DESCRIPTION": description, "LINK": link}
+                      for _, author, tag, description, link in rows],
+        "position"),
+    "charts/chartstorage.json": Table(
+        "charts", ("name", "url"), 1,
+        ["CREATE TABLE IF NOT EXISTS charts (name TEXT PRIMARY KEY, url TEXT)"],
+        lambda data: ((name, chart.get("URL")) for name, chart in data.items()),
+        lambda rows: {name: {"URL": url} for name, url in rows},
+        "rowid"),
+    "email/emails.json": Table(
+        "emails", ("user_id", "email"), 1,
+        ["CREATE TABLE IF NOT EXISTS emails (user_id TEXT PRIMARY KEY, email TEXT NOT NULL)"],
+        lambda data: data.items(),
+        dict,
+        "rowid"),
+    "server_data/groups.csv": Table(
+        "group_members", ("group_num", "slot", "member", "position"), 2,
+        ["CREATE TABLE IF NOT EXISTS group_members (group_num TEXT NOT NULL, slot INTEGER NOT NULL,"
+         " member TEXT, position INTEGER NOT NULL, PRIMARY KEY (group_num, slot))"],
+        lambda data: _slots(data, 6),
+        _unslot,
+        "position, slot"),
+    "server_data/Project_mapping.csv": Table(
+        "project_groups", ("project_num", "slot", "group_num", "position"), 2,
+        ["CREATE TABLE IF NOT EXISTS project_groups (project_num TEXT NOT NULL,"
+         " slot INTEGER NOT NULL, group_num TEXT, position INTEGER NOT NULL,"
+         " PRIMARY KEY (project_num, slot))"],
+        lambda data: _slots(data, 6),
+        _unslot,
+        "position, slot"),
+    "server_data/name_mapping.csv": Table(
+        "students", ("username", "realname", "group_num"), 1,
+        ["CREATE TABLE IF NOT EXISTS students (username TEXT PRIMARY KEY, realname TEXT,"
+         " group_num TEXT)"],
+        lambda data: ((name, *(values + [None, None])[:2]) for name, values in data.items()),
+        lambda rows: {name: trim_row([realname, group]) for name, realname, group in rows},
+        "rowid"),
+}
+
+# Header rows of the CSV datasets, used if the rows are ever exported back to CSV
+HEADERS = {
+    "server_data/groups.csv": ["GROUP_NUM"] + [f"NAME {i}" for i in range(1, 7)],
+    "server_data/Project_mapping.csv": ["PROJECT_NUM"] + [f"GROUP_NUMBER {i}" for i in range(1, 7)],
+    "server_data/name_mapping.csv": ["USERNAME", "REALNAME", "GROUP_NUM"],
+}
+
+
+class SqliteDataStore(DataStore):
+    """
+        Class is a DataStore whose datasets live in SQLite tables instead of files.
+        It remembers the rows it last wrote for each dataset, so a flush deletes and upserts
+        only the rows whose primary key or contents changed.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.db_path = db_path
+        self.written = {}
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            for table in TABLES.values():
+                for statement in table.schema:
+                    self.connection.execute(statement)
+
+    def _read(self, name: str, default):
+        if name not in TABLES:
+            return super()._read(name, default)
+        table = TABLES[name]
+        rows = self.connection.execute(
+            f"SELECT {', '.join(table.columns)} FROM {table.name} ORDER BY {table.order_by}").fetchall()
+        self.written[name] = {row[:table.key_len]: row for row in rows}
+        self.headers[name] = HEADERS.get(name, [])
+        return table.from_rows(rows)
+
+    def _write(self, name: str):
+        if name not in TABLES:
+            super()._write(name)
+            return
+        table = TABLES[name]
+        rows = {row[:table.key_len]: row for row in map(tuple, table.to_rows(self.datasets[name]))}
+        previous = self.written.get(name, {})
+        key_match = " AND ".join(f"{column} = ?" for column in table.columns[:table.key_len])
+        placeholders = ", ".join("?" * len(table.columns))
+        with self.connection:
+            self.connection.executemany(
+                f"DELETE FROM {table.name} WHERE {key_match}",
+                [key for key in previous if key not in rows])
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO {table.name} ({', '.join(table.columns)}) VALUES ({placeholders})",
+                [row for key, row in rows.items() if previous.get(key) != row])
+        self.written[name] = rows
+
+
+def migrate(data_dir: str = DATA_DIR, db_path: str = DB_PATH) -> dict:
+    """
+        One-shot import of the JSON and CSV files under data_dir into the database.
+        Running it again overwrites the tables with the current contents of the files.
+
+        Parameters:
+            data_dir: folder holding the existing datasets.
+            db_path: database to create or update.
+
+        Returns:
+            the number of records imported per dataset.
+    """
+    files = DataStore(data_dir)
+    database = SqliteDataStore(db_path)
+    counts = {}
+    for name in TABLES:
+        database.load(name)
+        database.datasets[name] = files.load(name, default=TABLES[name].from_rows([]))
+        database.dirty.add(name)
+        counts[name] = len(database.datasets[name])
+    database.flush()
+    database.connection.close()
+    return counts
+
+
+if __name__ == "__main__":
+    for dataset, count in migrate(*sys.argv[1:3]).items():
+        print(f"{dataset}: {count} records imported")
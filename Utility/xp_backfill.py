@@ -0,0 +1,175 @@
+"""
+    XP backfill utility rebuilds participation XP from the message history of a server, so a new
+    deployment does not start everyone at zero. Channels are read a page at a time, a few at once,
+    and their messages merged oldest first; progress is checkpointed in the data store so an
+    interrupted backfill resumes where it stopped, and the resulting XP is written with a single write.
+
+    History earns XP like live messages do: at most one message per author per XP cooldown.
+"""
+import os
+import time
+import heapq
+import asyncio
+from collections import deque
+from datetime import datetime, timezone
+
+import discord
+
+from Utility.data_store import store
+from Utility.xp_engine import XP_PER_MESSAGE, total_xp
+
+BACKFILL = "participation/backfill.json"
+# Channels whose next page is fetched at the same time; discord.py queues the requests on rate limits
+CONCURRENCY = int(os.getenv("BACKFILL_CHANNELS", "3"))
+# Messages walked between two checkpoints
+CHECKPOINT_EVERY = 500
+# Messages fetched per history request, the most Discord returns
+PAGE_SIZE = 100
+
+
+class XPBackfill:
+    """
+        Class walks channel histories and replaces every author's XP with the XP of their messages,
+        keeping what they earned live while the backfill ran.
+
+        The checkpoint holds the time the backfill started (BEFORE, only older messages count), the
+        last message walked per unfinished channel (CHANNELS), the finished channels (DONE), the
+        messages that earned XP per user (AWARDS), the send time of each user's last one (LAST)
+        and every user's XP when it started (BASE).
+
+        Messages are walked in the order they were sent across all channels, each channel a page
+        ahead, so every message not walked yet is newer than every message walked. Resuming needs
+        no more than each author's last award time to apply the cooldown.
+    """
+
+    def __init__(self, engine, data_store=store, concurrency: int = CONCURRENCY,
+                 checkpoint_every: int = CHECKPOINT_EVERY, cooldown: float = None, page_size: int = PAGE_SIZE):
+        """
+            Parameters:
+                engine: the XPEngine receiving the result.
+                data_store: store holding the checkpoint.
+                concurrency: channels whose next page is fetched at the same time.
+                checkpoint_every: messages walked between two checkpoints.
+                cooldown: seconds between two messages of an author that earn XP; the engine's by default.
+                page_size: messages fetched per history request.
+        """
+        self.engine = engine
+        self.cooldown = engine.cooldown if cooldown is None else cooldown
+        self.store = data_store
+        self.concurrency = concurrency
+        self.checkpoint_every = checkpoint_every
+        self.page_size = page_size
+        self.state = data_store.load(BACKFILL, default={})
+        self.running = False
+
+    def reset(self):
+        """ drops the checkpoint, so the next run starts over """
+        self.state.clear()
+        self.store.mark_dirty(BACKFILL)
+
+    async def run(self, channels: list) -> tuple:
+        """
+            Backfills XP from the channels, resuming from the checkpoint if there is one.
+
+            Parameters:
+                channels: text channels whose history can be read.
+
+            Returns:
+                (messages that earned XP, members whose XP was set).
+        """
+        self.running = True
+        try:
+            if "LAST" not in self.state:
+                # also drops a checkpoint left by a version that kept every award time
+                self.state.clear()
+                self.state.update(BEFORE=time.time(), CHANNELS={}, DONE=[], AWARDS={}, LAST={},
+                                  BASE={user_id: total_xp(record) for user_id, record in self.engine.users.items()})
+                self.store.mark_dirty(BACKFILL)
+            before = datetime.fromtimestamp(self.state["BEFORE"], timezone.utc).replace(tzinfo=None)
+            # the checkpoint keeps what was walked if this fails; the next run resumes from it
+            await self._walk([channel for channel in channels if str(channel.id) not in self.state["DONE"]], before)
+
+            # XP earned live since the backfill started comes on top of the history
+            totals = {}
+            for user_id, awards in self.state["AWARDS"].items():
+                live = total_xp(self.engine.users.get(user_id, {})) - self.state["BASE"].get(user_id, 0)
+                totals[user_id] = awards * XP_PER_MESSAGE + max(0, live)
+            self.engine.set_totals(totals)
+            result = sum(self.state["AWARDS"].values()), len(totals)
+            self.state.clear()
+            self.store.mark_dirty(BACKFILL)
+            self.store.flush(BACKFILL)
+            return result
+        finally:
+            self.running = False
+
+    async def _walk(self, channels: list, before: datetime):
+        """ walks the messages of every channel, oldest first across channels """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        queues = [asyncio.Queue(maxsize=1) for _ in channels]
+        readers = [asyncio.ensure_future(self._read(channel, before, semaphore, pages))
+                   for channel, pages in zip(channels, queues)]
+        try:
+            # (message id, channel index, message, rest of its page); snowflake ids grow with time
+            heap = []
+            for index, pages in enumerate(queues):
+                await self._next(heap, index, channels[index], pages, deque())
+            walked = 0
+            while heap:
+                _, index, message, page = heapq.heappop(heap)
+                if not message.author.bot:
+                    self._award(str(message.author.id), message.created_at)
+                self.state["CHANNELS"][str(channels[index].id)] = message.id
+                walked += 1
+                if walked % self.checkpoint_every == 0:
+                    self.store.mark_dirty(BACKFILL)
+                await self._next(heap, index, channels[index], queues[index], page)
+        finally:
+            for reader in readers:
+                reader.cancel()
+
+    async def _next(self, heap: list, index: int, channel, pages: asyncio.Queue, page: deque):
+        """ pushes the next message of a channel onto the heap, or records the channel as done """
+        if not page:
+            page = await pages.get()
+            if isinstance(page, Exception):
+                raise page
+        if page:
+            message = page.popleft()
+            heapq.heappush(heap, (message.id, index, message, page))
+            return
+        key = str(channel.id)
+        self.state["CHANNELS"].pop(key, None)
+        self.state["DONE"].append(key)
+        self.store.mark_dirty(BACKFILL)
+
+    async def _read(self, channel, before: datetime, semaphore: asyncio.Semaphore, pages: asyncio.Queue):
+        """ fetches the pages of a channel one ahead of the walk; an empty page ends it """
+        last = self.state["CHANNELS"].get(str(channel.id))
+        try:
+            while True:
+                async with semaphore:
+                    page = deque([message async for message in channel.history(
+                        limit=self.page_size, before=before, oldest_first=True,
+                        after=discord.Object(id=last) if last else None)])
+                if page:
+                    last = page[-1].id
+                    await pages.put(page)
+                if len(page) < self.page_size:
+                    await pages.put(deque())
+                    return
+        except discord.Forbidden:
+            await pages.put(deque())
+        except Exception as error:  # pylint: disable=broad-except
+            # raised by the walk once it needs this channel
+            await pages.put(error)
+
+    def _award(self, user_id: str, sent: datetime):
+        """ gives a message XP unless the author's last award was less than a cooldown earlier """
+        # discord.py gives naive UTC datetimes
+        sent = sent.replace(tzinfo=timezone.utc).timestamp()
+        last = self.state["LAST"].get(user_id)
+        if last is not None and sent - last < self.cooldown:
+            return
+        self.state["LAST"][user_id] = sent
+        self.state["AWARDS"][user_id] = self.state["AWARDS"].get(user_id, 0) + 1
@@ -0,0 +1,231 @@
+"""
+    XP engine utility keeps the participation XP of every user in memory and writes it behind.
+    A message only updates that user's counters and level, so its cost does not depend on how
+    many users there are; the users touched since the last flush are written together every
+    few seconds and when the bot shuts down.
+
+    The engine also keeps every user sorted by (level, experience), updated as XP changes, so a
+    user's rank is a binary search and the top of the leaderboard is a slice.
+
+    Messages only earn XP once per cooldown window per user; the time of each user's last award
+    is kept in memory, so a message inside the window costs one dictionary lookup.
+"""
+import os
+import time
+import atexit
+import asyncio
+from bisect import bisect_left, insort
+
+from Utility.data_store import store
+
+USERS = "participation/users.json"
+XP_PER_MESSAGE = 15
+# Seconds XP changes may wait in memory before they are handed to the data store
+FLUSH_INTERVAL = float(os.getenv("XP_FLUSH_INTERVAL", "10"))
+# Seconds after an award during which a user's messages earn no XP; 0 awards every message
+COOLDOWN = float(os.getenv("XP_COOLDOWN", "60"))
+
+
+def level_cap(level: int) -> int:
+    """ experience needed to go from level to level + 1 """
+    return 5 * level ** 2 + 50 * level + 100
+
+
+def xp_to_reach(level: int) -> int:
+    """ experience needed to go from level 1 to level, the sum of level_cap(1 .. level - 1) """
+    n = max(0, level - 1)
+    return 5 * n * (n + 1) * (2 * n + 1) // 6 + 25 * n * (n + 1) + 100 * n
+
+
+def total_xp(record: dict) -> int:
+    """ all experience a user earned since level 1 """
+    return xp_to_reach(record.get("level", 1)) + record.get("experience", 0)
+
+
+def level_for(total: int) -> tuple:
+    """
+        Inverts xp_to_reach: the level reached with total experience from level 1.
+
+        xp_to_reach(n + 1) = 5/3 n^3 + 55/2 n^2 + 755/6 n is solved for n with a few Newton steps
+        from the cube-root estimate, then made exact with integer arithmetic.
+
+        Returns:
+            (level, experience left towards the next level).
+    """
+    n = (3 * max(total, 0) / 5) ** (1 / 3)
+    for _ in range(4):
+        n -= (5 / 3 * n ** 3 + 55 / 2 * n ** 2 + 755 / 6 * n - total) / (5 * n ** 2 + 55 * n + 755 / 6)
+    level = max(1, int(n) + 1)
+    while level > 1 and xp_to_reach(level) > total:
+        level -= 1
+    while xp_to_reach(level + 1) <= total:
+        level += 1
+    return level, total - xp_to_reach(level)
+
+
+class XPEngine:
+    """
+        Class owns users.json (user id -> {"experience", "level"}) and the users changed since
+        the last flush.
+    """
+
+    def __init__(self, data_store=store, dataset: str = USERS, flush_interval: float = FLUSH_INTERVAL,
+                 cooldown: float = COOLDOWN):
+        """
+            Parameters:
+                data_store: store holding the dataset.
+                dataset: the users dataset.
+                flush_interval: seconds between two writes of the users that changed.
+                cooldown: seconds after an award during which a user's messages earn no XP.
+        """
+        self.store = data_store
+        self.dataset = dataset
+        self.flush_interval = flush_interval
+        self.cooldown = cooldown
+        # user id -> time.monotonic() of their last message award; not persisted
+        self.last_award = {}
+        self.users = data_store.load(dataset, default={}, indent=4)
+        self.dirty = set()
+        self._flush_handle = None
+        # (-level, -experience, user id) of every user, best first
+        self.ranking = []
+        self.keys = {}
+        # (size, key of its last user, top users) of the last leaderboard page, dropped when it changes
+        self._top = None
+        self.rebuild()
+
+    def user(self, user_id, level: int = 1) -> dict:
+        """ the record of a user, created with no experience at the given level if missing """
+        record = self.users.get(str(user_id))
+        if record is None:
+            record = self.users[str(user_id)] = {"experience": 0, "level": level}
+            self.touch(user_id)
+            self._rerank(str(user_id))
+        return record
+
+    def message(self, user_id, now: float = None):
+        """
+            Awards the XP of one message unless the user was awarded less than cooldown seconds ago,
+            in which case nothing else is touched.
+
+            Returns:
+                the new level if the user levelled up, else None.
+        """
+        now = time.monotonic() if now is None else now
+        last = self.last_award.get(user_id)
+        if last is not None and now - last < self.cooldown:
+            return None
+        self.last_award[user_id] = now
+        return self.award(user_id)
+
+    def award(self, user_id, amount: int = XP_PER_MESSAGE):
+        """
+            Adds experience to a user and levels them up as many times as it allows.
+
+            Returns:
+                the new level if the user levelled up, else None.
+        """
+        record = self.user(user_id)
+        record["experience"] += amount
+        start = record["level"]
+        while record["experience"] >= level_cap(record["level"]):
+            record["experience"] -= level_cap(record["level"])
+            record["level"] += 1
+        self.touch(user_id)
+        self._rerank(str(user_id))
+        return record["level"] if record["level"] != start else None
+
+    def set_totals(self, totals: dict):
+        """
+            Sets the all-time experience of many users at once, then re-sorts and writes once.
+
+            Parameters:
+                totals: user id -> experience earned since level 1.
+        """
+        for user_id, total in totals.items():
+            level, experience = level_for(total)
+            record = self.users.setdefault(str(user_id), {})
+            record["level"], record["experience"] = level, experience
+            self.dirty.add(str(user_id))
+        self.rebuild()
+        self.flush()
+
+    def rebuild(self):
+        """ sorts every user again; for bulk changes of users """
+        self.keys = {user_id: self._key(user_id) for user_id in self.users}
+        self.ranking = sorted(self.keys.values())
+        self._top = None
+
+    def _key(self, user_id: str) -> tuple:
+        record = self.users[user_id]
+        return -record.get("level", 0), -record.get("experience", 0), user_id
+
+    def _rerank(self, user_id: str):
+        old, new = self.keys.get(user_id), self._key(user_id)
+        if old == new:
+            return
+        if old is not None:
+            del self.ranking[bisect_left(self.ranking, old)]
+        insort(self.ranking, new)
+        self.keys[user_id] = new
+        if self._top is not None:
+            _, last, _ = self._top
+            # the cached page only changes if the user was on it or got onto it
+            if last is None or new <= last or (old is not None and old <= last):
+                self._top = None
+
+    def rank(self, user_id) -> int:
+        """ position of a user on the leaderboard, 1 for the best """
+        key = self.keys.get(str(user_id))
+        return None if key is None else bisect_left(self.ranking, key) + 1
+
+    def top(self, size: int) -> list:
+        """
+            The best users, best first; cached until one of them changes or someone overtakes them.
+
+            Returns:
+                (user id, record) pairs.
+        """
+        if self._top is None or self._top[0] != size:
+            keys = self.ranking[:size]
+            self._top = (size, keys[-1] if len(keys) == size else None,
+                         [(key[2], self.users[key[2]]) for key in keys])
+        return self._top[2]
+
+    def touch(self, user_id):
+        """ records that a user changed and schedules the next flush """
+        self.dirty.add(str(user_id))
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self._flush_handle = loop.call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        """ hands every changed user to the data store and writes the dataset """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self.dirty:
+            return
+        self.dirty.clear()
+        self.store.mark_dirty(self.dataset)
+        self.store.flush(self.dataset)
+
+
+_engine = None
+
+
+def get_xp_engine() -> XPEngine:
+    """
+        Returns the XP engine shared by every cog, building it on first use. Pending XP is
+        written when the interpreter exits.
+    """
+    global _engine  # pylint: disable=global-statement
+    if _engine is None:
+        _engine = XPEngine()
+        atexit.register(_engine.flush)
+    return _engine
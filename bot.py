@@ -1,14 +1,18 @@
 # bot.py
 # Copyright (c) 2021 War-Keeper
-import json
 import os
+from collections import OrderedDict
 import discord
 from discord.utils import get
 from discord import Intents
 from dotenv import load_dotenv
 from discord.ext.commands import Bot, has_permissions
 from Utility.email_utility import EmailUtility
-import asyncio
+from Utility.data_store import store
+from Utility.spam_limiter import SpamLimiter
+from Utility.message_pipeline import get_pipeline
+from Utility.email_outbox import outbox
+from Utility.attachment_cache import AttachmentCache
 # ----------------------------------------------------------------------------------------------
 # Initializes the discord bot with a unique TOKEN and joins the bot to a server provided by the
 # GUILD token. Handles bot shutdown and error events
@@ -26,7 +30,14 @@ VERIFIED_MEMBER_ROLE = os.getenv("VERIFIED_MEMBER_ROLE")
 intents = Intents.all()
 # Set all bot commands to begin with $
 bot = Bot(intents=intents, command_prefix="$")
-spam_log=[]
+# Flags a user who sends more than SPAM_MAX_MESSAGES messages within SPAM_WINDOW seconds
+spam_limiter = SpamLimiter(int(os.getenv("SPAM_MAX_MESSAGES", "4")), float(os.getenv("SPAM_WINDOW", "10")))
+# Reacting with this emoji to a message emails its attachments to the user
+ATTACHMENT_EMOJI = '\N{WHITE HEAVY CHECK MARK}'
+# Each attachment is downloaded and encoded once, whoever reacts to it
+attachment_cache = AttachmentCache(in_use=outbox.attachment_paths)
+# Messages reacted to recently, so further reactions need no fetch
+fetched_messages = OrderedDict()
 
 
 # ------------------------------------------------------------------------------------------------------------------
@@ -139,33 +150,73 @@ async def on_ready():
         )
     )
     print("READY!")
-    while True:
-        print('spam cleared')
-        await asyncio.sleep(10)
-        spam_log.clear()
 
+# ------------------------------------------------------------------------------------------------------------------
+#    Function: on_message(message)
+#    Description: Processes the commands of a message; every other per-message check runs as a stage of the
+#                 message pipeline (see Utility/message_pipeline.py)
+#    Inputs:
+#    - message: the message that was received
+#    Outputs:
+#    -
+# ------------------------------------------------------------------------------------------------------------------
 @bot.event
 async def on_message(message):
     if message.author == bot.user:
         return
-    if not isinstance(message.channel, discord.channel.DMChannel):
-        if UNVERIFIED_ROLE_NAME in [y.name for y in message.author.roles]:
-            await message.delete()
-            await message.channel.send(message.author.mention+' verify yourself in DM with me before mesaging in channel!')
-            await message.author.send(
-                "Verify yourself before getting started! \n To use the verify command, do: $verify <your_full_name> \n \
-                ( For example: $verify Jane Doe )")
     await bot.process_commands(message)
-    counter=1    
-    for i in range(len(spam_log)): 
-        if spam_log[i]==str(message.author.id):
-            counter=counter+1
-    spam_log.append(str(message.author.id))
-    if counter>4:
+
+
+# ------------------------------------------------------------------------------------------------------------------
+#    Function: verification_stage(context)
+#    Description: Message pipeline stage, deletes channel messages of unverified members and asks them to verify
+#    Inputs:
+#    - context: MessageContext of the received message
+#    Outputs:
+#    -
+# ------------------------------------------------------------------------------------------------------------------
+async def verification_stage(context):
+    message = context.message
+    if message.author == bot.user or context.is_dm or context.verified:
+        return
+    await message.delete()
+    await message.channel.send(message.author.mention+' verify yourself in DM with me before mesaging in channel!')
+    await message.author.send(
+        "Verify yourself before getting started! \n To use the verify command, do: $verify <your_full_name> \n \
+        ( For example: $verify Jane Doe )")
+    context.stop()
+
+
+# ------------------------------------------------------------------------------------------------------------------
+#    Function: spam_stage(context)
+#    Description: Message pipeline stage, warns spammers and bulk deletes their flagged messages
+#    Inputs:
+#    - context: MessageContext of the received message
+#    Outputs:
+#    -
+# ------------------------------------------------------------------------------------------------------------------
+async def spam_stage(context):
+    message = context.message
+    if message.author == bot.user:
+        return
+    offending = spam_limiter.hit(message.author.id, message.channel.id, message.id)
+    if offending:
         await message.channel.send('please stop spamming! '+message.author.mention+', this may lead to a BAN/KICK!')
-        def check(m):
-            return str(m.author) == str(message.author)
-        await message.channel.purge(limit=6, check=check)
+        # bulk delete the flagged messages instead of paging through channel history
+        for channel_id, message_ids in offending.items():
+            channel = bot.get_channel(channel_id)
+            if isinstance(channel, discord.TextChannel):
+                try:
+                    await channel.delete_messages([discord.Object(id=message_id) for message_id in message_ids])
+                except discord.HTTPException:
+                    # some of them were already removed, e.g. by the profanity filter
+                    pass
+        context.stop()
+
+
+message_pipeline = get_pipeline(bot)
+message_pipeline.add_stage("verification", verification_stage, 10)
+message_pipeline.add_stage("spam", spam_stage, 20)
 
 
 # ------------------------------------------------------------------------------------------------------------------
@@ -177,22 +228,30 @@ async def on_message(message):
 #    -
 # ------------------------------------------------------------------------------------------------------------------
 @bot.event
-@bot.event
 async def on_raw_reaction_add(payload):
-    print(payload)
-    email = EmailUtility()
-    email_list = json.load(open("./data/email/emails.json"))
-    guild = bot.get_guild(payload.guild_id)
-    channel = guild.get_channel(payload.channel_id)
-    message = await channel.fetch_message(payload.message_id)
-    if payload.emoji.name == '\N{WHITE HEAVY CHECK MARK}':
-        if str(payload.user_id) not in email_list:
-            await channel.send("Please make sure you have an email address configured..!")
-            return
-        for attachment in message.attachments:
-            filename = attachment.filename
-            attachment = await attachment.read()
-            email.send_email(email_list[str(payload.user_id)], attachment, filename=filename)
+    # most reactions are not the mail reaction; skip them before any lookup
+    if payload.emoji.name != ATTACHMENT_EMOJI or payload.guild_id is None:
+        return
+    email_list = store.load("email/emails.json")
+    # uncached channels are not in get_channel and are fetched instead
+    channel = bot.get_channel(payload.channel_id) or await bot.fetch_channel(payload.channel_id)
+    if str(payload.user_id) not in email_list:
+        await channel.send("Please make sure you have an email address configured..!")
+        return
+    message = fetched_messages.get(payload.message_id)
+    if message is None:
+        message = fetched_messages[payload.message_id] = await channel.fetch_message(payload.message_id)
+        if len(fetched_messages) > 256:
+            fetched_messages.popitem(last=False)
+    attachments = []
+    for attachment in message.attachments:
+        path = await attachment_cache.get(attachment)
+        if path is None:
+            await channel.send("{} is too large to be emailed".format(attachment.filename))
+        else:
+            attachments.append((attachment.filename, path))
+    if attachments:
+        EmailUtility().send_email(email_list[str(payload.user_id)], attachments=attachments)
 
 
 # ------------------------------------------------------------------------------------------------------------------
@@ -244,6 +303,7 @@ async def on_error(event, *args, **kwargs):
 @has_permissions(administrator=True)
 async def shutdown(ctx):
     await ctx.send('Shutting Down bot')
+    store.flush()
     print("Bot closed successfully")
     ctx.bot.logout()
     exit()
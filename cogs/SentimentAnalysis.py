@@ -1,11 +1,18 @@
 # Copyright (c) 2021 War-Keeper
 
+import asyncio
 import csv
 import discord
 from discord.ext import commands
 import os
-import flair
+from collections import OrderedDict
 from threading import Event
+from Utility.message_pipeline import get_pipeline
+from Utility.sentiment_model import sentiment_model, PRELOAD, BATCH_SIZE
+
+# $mood reads at most MOOD_MAX_MESSAGES messages; SCORE_CACHE_SIZE scores are kept between reports
+MOOD_MAX_MESSAGES = int(os.getenv("MOOD_MAX_MESSAGES", "1000"))
+SCORE_CACHE_SIZE = int(os.getenv("SENTIMENT_CACHE_SIZE", "20000"))
 
 """
 -----------------------------------------------------------
@@ -22,13 +29,28 @@ class Sentiment(commands.Cog):
     """
     def __init__(self, bot):
         self.bot = bot
-        self.mess = ""
-
-
-
-    @commands.Cog.listener()
-    async def on_message(self, message):
-        self.mess = message.content
+        # last message of every channel, so $sentiment in one channel is not about another
+        self.last_messages = {}
+        # message id -> (label, confidence), oldest evicted first
+        self.scores = OrderedDict()
+        self.model = sentiment_model
+        get_pipeline(bot).add_stage("sentiment", self.remember_message, 50)
+        if PRELOAD:
+            bot.loop.create_task(self.warm_up())
+
+    def cog_unload(self):
+        get_pipeline(self.bot).remove_stage("sentiment")
+
+    async def remember_message(self, context):
+        content = context.message.content
+        if content and not content.startswith(self.bot.command_prefix):
+            self.last_messages[context.message.channel.id] = content
+
+    async def warm_up(self):
+        try:
+            await self.model.load()
+        except Exception:
+            print("sentiment model could not be loaded: " + str(self.model.error))
 
     """
     -------------------------------------------------------------------------------------------------------------
@@ -48,22 +70,92 @@ class Sentiment(commands.Cog):
     (For example: sentiment)', pass_context=True)
     async def sentiment(self, ctx):
         try:
-            flair_sentiment = flair.models.TextClassifier.load('en-sentiment')
-            message = self.mess
+            message = self.last_messages.get(ctx.channel.id)
 
             if message == "" or message is None:
                 await ctx.send("Please enter your message")
             else:
-                print(message)
-                s = flair.data.Sentence(message)
-                flair_sentiment.predict(s)
-                sentiment = s.labels
-                print(sentiment)
+                sentiment = await self.model.predict(message)
                 await ctx.send(sentiment)
 
         except:
             print("an exception has occurred")
 
+    async def score_messages(self, messages: list):
+        """
+            Scores messages in one batch and caches the result by message id.
+        """
+        labels = await self.model.predict_many([message.content for message in messages])
+        for message, label in zip(messages, labels):
+            if label:
+                self.scores[message.id] = (label[0].value, label[0].score)
+        while len(self.scores) > SCORE_CACHE_SIZE:
+            self.scores.popitem(last=False)
+
+    """
+    -------------------------------------------------------------------------------------------------------------
+        Function: mood(self, ctx, channel, count)
+        Description: Reports how positive or negative the recent messages of a channel are.
+        Inputs:
+        - self: used to access parameters passed to the class through the constructor
+        - ctx: used to access the values passed through the current context
+        - channel: the channel to look at
+        - count: how many of the latest messages to read
+        Outputs: The bot replies with the number and share of positive and negative messages.
+                    Messages scored by an earlier report are taken from the cache, only new ones
+                    are sent to the model, in batches while the history is still being read.
+        --------------------------------------------------------------------------------------------------------------
+    """
+    @commands.command(name='mood',
+                      help='Shows how positive or negative the last N messages of a channel are, \
+    ex. $mood #general 200')
+    async def mood(self, ctx, channel: discord.TextChannel, count: int = 100):
+        if not channel.permissions_for(ctx.author).read_message_history:
+            await ctx.send("You cannot read the history of " + channel.mention)
+            return
+        count = max(1, min(count, MOOD_MAX_MESSAGES))
+
+        async with ctx.typing():
+            read, pending, batches = [], [], []
+            async for message in channel.history(limit=count):
+                if message.author.bot or not message.content \
+                        or message.content.startswith(self.bot.command_prefix):
+                    continue
+                read.append(message.id)
+                if message.id in self.scores:
+                    self.scores.move_to_end(message.id)
+                else:
+                    pending.append(message)
+                    if len(pending) == BATCH_SIZE:
+                        # score this batch while the next page of history is fetched
+                        batches.append(self.bot.loop.create_task(self.score_messages(pending)))
+                        pending = []
+            if pending:
+                batches.append(self.bot.loop.create_task(self.score_messages(pending)))
+            try:
+                await asyncio.gather(*batches)
+            except Exception:
+                for batch in batches:
+                    batch.cancel()
+                await ctx.send("The sentiment model is not available right now, please try again later.")
+                return
+
+        totals = {"POSITIVE": 0, "NEGATIVE": 0}
+        for message_id in read:
+            if message_id in self.scores:
+                label = self.scores[message_id][0]
+                totals[label] = totals.get(label, 0) + 1
+        scored = sum(totals.values())
+        if not scored:
+            await ctx.send("There are no messages to score in " + channel.mention)
+            return
+        await ctx.send("Mood of {} over the last {} messages:\n"
+                       ":thumbsup: POSITIVE: {} ({:.0%})\n"
+                       ":thumbsdown: NEGATIVE: {} ({:.0%})".format(
+                           channel.mention, scored,
+                           totals["POSITIVE"], totals["POSITIVE"] / scored,
+                           totals["NEGATIVE"], totals["NEGATIVE"] / scored))
+
 
 
 
@@ -3,11 +3,21 @@ This functionality creates charts for the admin to quickly present to the rest
 of the server. Simple charts like grades and attendance are made for quick access
 while custom chart command is used to make any kind of chart. Students can
 recall the chart presented by admins at any time by providing a name.
+Anyone can chart the message activity of the server, a member or a channel.
 """
-import json
+import time
+import typing
+from datetime import datetime, timedelta
+import discord
 from discord.ext import commands
 from quickchart import QuickChart
 import pyshorteners
+from Utility.data_store import store
+from Utility.activity_series import get_activity, daily, HISTORY_DAYS
+
+CHARTS = 'charts/chartstorage.json'
+# Days charted by $activity unless asked otherwise
+ACTIVITY_DAYS = 7
 
 
 class Charts(commands.Cog):
@@ -36,8 +46,7 @@ class Charts(commands.Cog):
             Returns:
                 returns a graph in the chat box
         """
-        with open('./data/charts/chartstorage.json', 'r', encoding='utf-8') as file:
-            storage = json.load(file)
+        storage = store.load(CHARTS, indent=4)
         quick_chart = QuickChart()
         quick_chart.width = 500
         quick_chart.height = 300
@@ -61,8 +70,7 @@ class Charts(commands.Cog):
         shortener = pyshorteners.Shortener()
         shortened_link = shortener.tinyurl.short(link)
         await self.update_chart(storage, "grades", shortened_link)
-        with open('./data/charts/chartstorage.json', 'w', encoding='utf-8') as file:
-            json.dump(storage, file, indent=4)
+        store.mark_dirty(CHARTS, "grades")
         await ctx.send(f"{shortened_link}")
 
     @grades.error
@@ -93,8 +101,7 @@ class Charts(commands.Cog):
             Returns:
                 returns a graph in the chat box
         """
-        with open('./data/charts/chartstorage.json', 'r', encoding='utf-8') as file:
-            storage = json.load(file)
+        storage = store.load(CHARTS, indent=4)
         quick_chart = QuickChart()
         quick_chart.width = 500
         quick_chart.height = 300
@@ -115,8 +122,7 @@ class Charts(commands.Cog):
         shortener = pyshorteners.Shortener()
         shortened_link = shortener.tinyurl.short(link)
         await self.update_chart(storage, "attendance", shortened_link)
-        with open('./data/charts/chartstorage.json', 'w', encoding='utf-8') as file:
-            json.dump(storage, file, indent=4)
+        store.mark_dirty(CHARTS, "attendance")
         await ctx.send(f"{shortened_link}")
 
     @attendance.error
@@ -141,12 +147,11 @@ class Charts(commands.Cog):
             Returns:
                 returns a graph in the chat box if grades chart exists
         """
-        with open('./data/charts/chartstorage.json', 'r', encoding='utf-8') as file:
-            storage = json.load(file)
-            if not storage or storage["grades"] == '':
-                await ctx.send("No grades posted!")
-            else:
-                await ctx.send(f" View grade distribution: {storage['grades']['URL']}")
+        storage = store.load(CHARTS, indent=4)
+        if not storage or storage["grades"] == '':
+            await ctx.send("No grades posted!")
+        else:
+            await ctx.send(f" View grade distribution: {storage['grades']['URL']}")
 
     @commands.command()
     async def checkattendance(self, ctx):
@@ -157,12 +162,11 @@ class Charts(commands.Cog):
             Returns:
                 returns a graph in the chat box if attendance chart exists
         """
-        with open('./data/charts/chartstorage.json', 'r', encoding='utf-8') as file:
-            storage = json.load(file)
-            if not storage or storage["attendance"] == '':
-                await ctx.send("No attendance chart posted!")
-            else:
-                await ctx.send(f" View attendance: {storage['attendance']['URL']}")
+        storage = store.load(CHARTS, indent=4)
+        if not storage or storage["attendance"] == '':
+            await ctx.send("No attendance chart posted!")
+        else:
+            await ctx.send(f" View attendance: {storage['attendance']['URL']}")
 
     @commands.command()
     async def checkchart(self, ctx, name: str):
@@ -174,12 +178,11 @@ class Charts(commands.Cog):
             Returns:
                 returns the custom chart in the chat box if it exists
         """
-        with open('./data/charts/chartstorage.json', 'r', encoding='utf-8') as file:
-            storage = json.load(file)
-            if not storage or storage[name] == '':
-                await ctx.send("No chart with that name!")
-            else:
-                await ctx.send(f"Your requested chart: {storage[name]['URL']}")
+        storage = store.load(CHARTS, indent=4)
+        if not storage or storage[name] == '':
+            await ctx.send("No chart with that name!")
+        else:
+            await ctx.send(f"Your requested chart: {storage[name]['URL']}")
 
     @checkchart.error
     async def checkchart_error(self, ctx, error):
@@ -215,8 +218,7 @@ class Charts(commands.Cog):
         if len(args) / 2 != data_count:
             raise IllegalArgumentsError
 
-        with open('./data/charts/chartstorage.json', 'r', encoding='utf-8') as file:
-            storage = json.load(file)
+        storage = store.load(CHARTS, indent=4)
 
         labels_list = []
         dataset_list = []
@@ -248,8 +250,7 @@ class Charts(commands.Cog):
         shortened_link = shortener.tinyurl.short(link)
 
         await self.update_chart(storage, title, shortened_link)
-        with open('./data/charts/chartstorage.json', 'w', encoding='utf-8') as file:
-            json.dump(storage, file, indent=4)
+        store.mark_dirty(CHARTS, str(title))
         await ctx.send(f"{shortened_link}")
 
     @customchart.error
@@ -273,6 +274,64 @@ class Charts(commands.Cog):
                 "EX. If # of categories is 5, there should be 5 category names "
                 "and 5 category numbers")
 
+    @commands.command(name="activity",
+                      help="View message activity of the server, a member or a channel; "
+                           "FORMAT: [@member or #channel] [days], ex. $activity #general 30")
+    async def activity(self, ctx,
+                       target: typing.Optional[typing.Union[discord.Member, discord.TextChannel]] = None,
+                       days: int = ACTIVITY_DAYS):
+        """
+            Charts the messages sent per UTC day, today included so far, or per hour over the last
+            24 hours for a single day
+            Parameters:
+                ctx: used to access the values passed through the current context.
+                target: the member or channel to chart; the whole server if not given
+                days: the number of days to chart, at most HISTORY_DAYS
+            Returns:
+                returns a graph in the chat box
+        """
+        days = max(1, min(days, HISTORY_DAYS))
+        tracker = get_activity()
+        timestamp = time.time()
+        now = datetime.utcfromtimestamp(timestamp)
+        # whole UTC days before today, then today's hours so far
+        window = 24 if days == 1 else (days - 1) * 24 + now.hour + 1
+        if isinstance(target, discord.Member):
+            counts = tracker.users.series(str(target.id), window, timestamp)
+        elif isinstance(target, discord.TextChannel):
+            counts = tracker.channels.series(str(target.id), window, timestamp)
+        else:
+            counts = tracker.channels.total(window, timestamp)
+        if days == 1:
+            labels = [(now - timedelta(hours=hours)).strftime("%H:00") for hours in range(23, -1, -1)]
+        else:
+            counts = daily(counts, int(timestamp // 3600))
+            labels = [(now - timedelta(days=day)).strftime("%m-%d") for day in range(days - 1, -1, -1)]
+        name = target.display_name if isinstance(target, discord.Member) else \
+            f"#{target.name}" if target else "server"
+
+        quick_chart = QuickChart()
+        quick_chart.width = 500
+        quick_chart.height = 300
+        quick_chart.device_pixel_ratio = 2.0
+        quick_chart.config = {
+            "type": "line",
+            "data": {
+                "labels": labels,
+                "datasets": [{
+                    "backgroundColor": 'rgb(128, 177, 229)',
+                    "borderColor": 'rgb(128, 177, 229)',
+                    "fill": False,
+                    "label": f"messages in {name}, last {days} days (UTC)",
+                    "data": counts.tolist()
+                }]
+            }
+        }
+        link = quick_chart.get_url()
+        shortener = pyshorteners.Shortener()
+        shortened_link = shortener.tinyurl.short(link)
+        await ctx.send(f"{shortened_link}")
+
     async def update_chart(self, storage, name, link):
         """
             Updates the URL of the chart
@@ -7,25 +7,143 @@ or delete a reminder if needed.
 """
 import os
 import json
-import asyncio
 import time
-from datetime import datetime
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from datetime import datetime, timedelta
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
+from Utility.data_store import store
+from Utility.scheduler import Scheduler
+from Utility.reminder_index import ReminderIndex
+from Utility.reply_pages import get_renderer
+from Utility.email_outbox import outbox
+
+REMINDERS = "remindme/reminders.json"
+PERSONAL_REMINDERS = "remindme/personal.json"
+WEEK = 604800
+# Hour of the day at which the homeworks due that day are announced and emailed
+DIGEST_HOUR = int(os.getenv("REMINDER_DIGEST_HOUR", "0"))
+
+
+def day_bounds(moment: datetime) -> tuple:
+    """ epoch seconds of the local midnights starting and ending the day of moment """
+    start = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start.timestamp(), (start + timedelta(days=1)).timestamp()
+
+
+def digest_time(moment: datetime) -> float:
+    """ epoch seconds at which the digest of the day of moment is sent """
+    return (moment.replace(hour=0, minute=0, second=0, microsecond=0)
+            + timedelta(hours=DIGEST_HOUR)).timestamp()
+
+
 class Deadline(commands.Cog):
     # pylint: disable=no-member
     """Class provides several methods to manage remainders."""
 
     def __init__(self, bot):
         self.bot = bot
+        self.renderer = get_renderer(bot)
         cur_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         os.chdir(cur_dir)
-        self.reminders = json.load(open("./data/remindme/reminders.json"))
+        self.reminders = store.load(REMINDERS, default=[])
+        # the same reminders sorted by due time, overall and per course
+        self.index = ReminderIndex(self.reminders)
+        # $remindme reminders by id, kept until they have been delivered
+        self.personal_reminders = store.load(PERSONAL_REMINDERS, default={})
+        self.next_personal_id = max(map(int, self.personal_reminders), default=0) + 1
         self.units = {"second": 1, "minute": 60, "hour": 3600, "day": 86400, "week": 604800,
                       "month": 2592000}
+        # channel picked with $start_reminders for the "due today" notifications
+        self.notify_channel = None
+        self.scheduler = Scheduler()
+        for reminder in self.reminders:
+            self.schedule_reminder(reminder)
+        self.schedule_digest()
+        # reminders that came due while the bot was offline are sent right after start
+        for reminder_id, reminder in self.personal_reminders.items():
+            self.schedule_personal_reminder(reminder_id, reminder)
+        self.scheduler.start(bot.loop)
+
+    def cog_unload(self):
+        self.scheduler.stop()
+
+    def schedule_reminder(self, reminder):
+        """
+            Schedules the removal of a homework once it is due. Scheduling it again replaces it.
+
+            Parameters:
+                reminder: the homework reminder as stored in reminders.json.
+        """
+        self.scheduler.schedule(("expire", reminder["COURSE"], reminder["HOMEWORK"]), reminder["FUTURE"],
+                                lambda: self.expire_reminder(reminder))
+
+    def schedule_digest(self):
+        """
+            Schedules the next daily digest of the homeworks due that day.
+        """
+        now = datetime.today()
+        when = digest_time(now)
+        if when <= now.timestamp():
+            when = digest_time(now + timedelta(days=1))
+        self.scheduler.schedule(("digest",), when, self.send_digest)
+
+    async def send_digest(self):
+        """
+            Announces and emails the homeworks due for the rest of today, then schedules tomorrow's.
+        """
+        self.schedule_digest()
+        await self.notify_reminders(self.index.due_between(time.time(), day_bounds(datetime.today())[1]))
+
+    def schedule_personal_reminder(self, reminder_id: str, reminder: dict):
+        """
+            Schedules the delivery of a $remindme reminder.
+
+            Parameters:
+                reminder_id: key of the reminder in personal.json.
+                reminder: the reminder with the USER, CHANNEL, FUTURE and TEXT to send.
+        """
+        self.scheduler.schedule(("remindme", reminder_id), reminder["FUTURE"],
+                                lambda: self.send_personal_reminder(reminder_id))
+
+    async def send_personal_reminder(self, reminder_id: str):
+        """
+            Sends a $remindme reminder in the channel it was asked in, or as a direct message if
+            that channel is gone, and forgets it.
+        """
+        reminder = self.personal_reminders.pop(reminder_id, None)
+        if reminder is None:
+            return
+        store.mark_dirty(PERSONAL_REMINDERS, reminder_id)
+        target = self.bot.get_channel(reminder["CHANNEL"]) or self.bot.get_user(reminder["USER"])
+        if target is None:
+            return
+        try:
+            await target.send("<@{}> Reminder : {}".format(reminder["USER"], reminder["TEXT"]))
+        except discord.errors.HTTPException as error:
+            print("reminder could not be sent: " + str(error))
+
+    def add_reminder(self, reminder: dict):
+        """
+            Stores, indexes and schedules a homework reminder.
+        """
+        self.reminders.append(reminder)
+        self.index.add(reminder)
+        self.schedule_reminder(reminder)
+        store.mark_dirty(REMINDERS)
+        # a homework due later today that was added after today's digest is announced on its own
+        now = time.time()
+        if now >= digest_time(datetime.today()) and now < reminder["FUTURE"] < day_bounds(datetime.today())[1]:
+            self.bot.loop.create_task(self.notify_reminders([reminder]))
+
+    def remove_reminder(self, reminder: dict):
+        """
+            Deletes a homework reminder and cancels its notification and removal.
+        """
+        self.reminders.remove(reminder)
+        key = (reminder["COURSE"], reminder["HOMEWORK"])
+        self.index.remove(*key)
+        self.scheduler.cancel(("expire",) + key)
+        store.mark_dirty(REMINDERS)
 
     @commands.command(name="addhw",
                       help="add homework and due-date "
@@ -56,21 +174,10 @@ class Deadline(commands.Cog):
             except:
                 await ctx.send("Due date could not be parsed")
                 return
-        a_timedelta = duedate - datetime.today()
-        seconds = (time.time() + a_timedelta.total_seconds())
-        flag = True
-        if self.reminders:
-            for reminder in self.reminders:
-                if ((reminder["COURSE"] == coursename) and (reminder["HOMEWORK"] == hwcount)):
-                    flag = False
-                    break
-        if flag:
-            self.reminders.append({"ID": author.id, "COURSE": coursename, "HOMEWORK": hwcount,
-                                   "DUEDATE": str(duedate),
-                                   "FUTURE": seconds})
-            cur_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            os.chdir(cur_dir)
-            json.dump(self.reminders, open("./data/remindme/reminders.json", "w"))
+        if self.index.get(coursename, hwcount) is None:
+            self.add_reminder({"ID": author.id, "COURSE": coursename, "HOMEWORK": hwcount,
+                               "DUEDATE": str(duedate),
+                               "FUTURE": duedate.timestamp()})
             await ctx.send(
                 "A date has been added for: {} homework named: {} which is due on: {} by {}.".
                 format(
@@ -105,20 +212,9 @@ class Deadline(commands.Cog):
                 indicating that the reminder has been deleted.
 
         """
-        author = ctx.message.author
-        to_remove = []
-        for reminder in self.reminders:
-            # print('in json '+str(reminder["HOMEWORK"])+' hwName '+hwName)
-            if ((reminder["HOMEWORK"] == hwName) and (reminder["COURSE"] == courseName)):
-                # print('true '+hwName)
-                to_remove.append(reminder)
-                # print('to_remove '+ str(to_remove))
-        for reminder in to_remove:
-            self.reminders.remove(reminder)
-        if to_remove:
-            cur_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            os.chdir(cur_dir)
-            json.dump(self.reminders, open("./data/remindme/reminders.json", "w"))
+        reminder = self.index.get(courseName, hwName)
+        if reminder is not None:
+            self.remove_reminder(reminder)
             await ctx.send(
                 "Following reminder has been deleted: Course: {},"
                 " Homework Name: {}, Due Date: {}".format(
@@ -151,7 +247,6 @@ class Deadline(commands.Cog):
 
         """
         author = ctx.message.author
-        flag = False
         try:
             duedate = datetime.strptime(date, '%b %d %Y %H:%M')
         except ValueError:
@@ -160,22 +255,16 @@ class Deadline(commands.Cog):
             except:
                 await ctx.send("Due date could not be parsed")
                 return
-        for reminder in self.reminders:
-            flag = False
-            if ((reminder["HOMEWORK"] == hwid) and (reminder["COURSE"] == classid)):
-                reminder["DUEDATE"] = str(duedate)
-                a_timedelta = duedate - datetime.today()
-                seconds = (time.time() + a_timedelta.total_seconds())
-                reminder["FUTURE"] = seconds
-                reminder["ID"] = author.id
-                flag = True
-                if flag:
-                    cur_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-                    os.chdir(cur_dir)
-                    json.dump(self.reminders, open("./data/remindme/reminders.json", "w"))
-                    await ctx.send(
-                        "{} {} has been updated with"
-                        " following date: {}".format(classid, hwid, reminder["DUEDATE"]))
+        reminder = self.index.get(classid, hwid)
+        if reminder is not None:
+            self.remove_reminder(reminder)
+            reminder["DUEDATE"] = str(duedate)
+            reminder["FUTURE"] = duedate.timestamp()
+            reminder["ID"] = author.id
+            self.add_reminder(reminder)
+            await ctx.send(
+                "{} {} has been updated with"
+                " following date: {}".format(classid, hwid, reminder["DUEDATE"]))
 
     @changeduedate.error
     async def changeduedate_error(self, ctx, error):
@@ -199,14 +288,11 @@ class Deadline(commands.Cog):
                 assignments that are due this week.
 
         """
-        time = ctx.message.created_at
-        for reminder in self.reminders:
-            timeleft = datetime.strptime(reminder["DUEDATE"], '%Y-%m-%d %H:%M:%S') - time
-            print("timeleft: " + str(timeleft) + " days left: " + str(timeleft.days))
-            if timeleft.days <= 7:
-                await ctx.send(
-                    "{} {} is due this week at {}".format(reminder["COURSE"], reminder["HOMEWORK"],
-                                                          reminder["DUEDATE"]))
+        now = time.time()
+        await self.renderer.send(ctx, [
+            "{} {} is due this week at {}".format(reminder["COURSE"], reminder["HOMEWORK"],
+                                                  reminder["DUEDATE"])
+            for reminder in self.index.due_between(now, now + WEEK)])
 
     @commands.command(name="duetoday", pass_context=True,
                       help="check all the homeworks that are due today $duetoday")
@@ -222,16 +308,11 @@ class Deadline(commands.Cog):
                 assignments that are due on the execution date of this command.
 
         """
-        flag = True
-        for reminder in self.reminders:
-            timedate = datetime.strptime(reminder["DUEDATE"], '%Y-%m-%d %H:%M:%S')
-            if timedate.date() == ctx.message.created_at.date():
-                flag = False
-                await ctx.send(
-                    "{} {} is due today at {}".format(reminder["COURSE"], reminder["HOMEWORK"],
-                                                      timedate.time()))
-        if flag:
-            await ctx.send("You have no dues today..!!")
+        await self.renderer.send(ctx, [
+            "{} {} is due today at {}".format(reminder["COURSE"], reminder["HOMEWORK"],
+                                              reminder["DUEDATE"].split(" ")[1])
+            for reminder in self.index.due_between(*day_bounds(datetime.today()))],
+                                 empty="You have no dues today..!!")
 
     @commands.command(name="coursedue", pass_context=True,
                       help="check all the homeworks that are due for a specific course "
@@ -248,13 +329,10 @@ class Deadline(commands.Cog):
                 assignments that are due for the provided course.
 
         """
-        course_due = []
-        for reminder in self.reminders:
-            if reminder["COURSE"] == courseid:
-                course_due.append(reminder)
-                await  ctx.send("{} is due at {}".format(reminder["HOMEWORK"], reminder["DUEDATE"]))
-        if not course_due:
-            await ctx.send("Rejoice..!! You have no pending homeworks for {}..!!".format(courseid))
+        await self.renderer.send(ctx, [
+            "{} is due at {}".format(reminder["HOMEWORK"], reminder["DUEDATE"])
+            for reminder in self.index.course_due(courseid)],
+                                 empty="Rejoice..!! You have no pending homeworks for {}..!!".format(courseid))
 
     @coursedue.error
     async def coursedue_error(self, ctx, error):
@@ -276,23 +354,12 @@ class Deadline(commands.Cog):
                 assignments.
 
         """
-        to_remove = []
-        for reminder in self.reminders:
-            try:
-                await ctx.send(
-                    "{} homework named: {} which is due on: {} by {}".format(reminder["COURSE"],
-                                                                             reminder["HOMEWORK"],
-                                                                             reminder["DUEDATE"],
-                                                                             self.bot.get_user(
-                                                                                 reminder["ID"])))
-            except (discord.errors.Forbidden, discord.errors.NotFound):
-                to_remove.append(reminder)
-            except discord.errors.HTTPException:
-                pass
-            else:
-                to_remove.append(reminder)
-        if not self.reminders:
-            await ctx.send("Mission Accomplished..!! You don't have any more dues..!!")
+        await self.renderer.send(ctx, [
+            "{} homework named: {} which is due on: {} by {}".format(
+                reminder["COURSE"], reminder["HOMEWORK"], reminder["DUEDATE"],
+                self.bot.get_user(reminder["ID"]))
+            for reminder in self.index.due_between()],
+                                 empty="Mission Accomplished..!! You don't have any more dues..!!")
 
     @commands.command(name="clearreminders", pass_context=True, help="deletes all reminders")
     async def clearallreminders(self, ctx):
@@ -307,30 +374,29 @@ class Deadline(commands.Cog):
                 success message stating that reminders have been deleted.
 
         """
-        to_remove = []
-        for reminder in self.reminders:
-            to_remove.append(reminder)
-        for reminder in to_remove:
-            self.reminders.remove(reminder)
-        if to_remove:
-            cur_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            os.chdir(cur_dir)
-            json.dump(self.reminders, open("./data/remindme/reminders.json", "w"))
+        if self.reminders:
+            for reminder in self.reminders:
+                self.scheduler.cancel(("expire", reminder["COURSE"], reminder["HOMEWORK"]))
+            self.reminders.clear()
+            self.index.clear()
+            store.mark_dirty(REMINDERS)
             await ctx.send("All reminders have been cleared..!!")
 
     @commands.command(name="remindme", pass_context=True,
                       help="Request the bot to set a reminder for a due date")
-    async def remindme(self, ctx, quantity: int, time_unit: str, *, text: str): # pragma: no cover
+    async def remindme(self, ctx, quantity: int, time_unit: str, *, text: str):
         """
             Personal remind me functionality.
 
             Parameters:
                 ctx: used to access the values passed through the current context.
-                quantity: time after which the data will be erased
+                quantity: time after which the reminder is sent.
+                time_unit: unit of the quantity, e.g. minutes.
+                text: the reminder text.
 
             Returns:
                 returns either an error stating a reason for failure or
-                returns a success message stating that reminders have been deleted.
+                returns a success message stating when the reminder will be sent.
 
         """
         time_unit = time_unit.lower()
@@ -350,80 +416,79 @@ class Deadline(commands.Cog):
             await ctx.send("Text is too long.")
             return
 
-        self.seconds = self.units[time_unit] * quantity
-        future = int(time.time() + self.seconds)
-
-        #self.reminders.append({"ID": author.id, "FUTURE": future, "TEXT": text})
+        future = time.time() + self.units[time_unit] * quantity
+        reminder_id = str(self.next_personal_id)
+        self.next_personal_id += 1
+        self.personal_reminders[reminder_id] = {"USER": author.id, "CHANNEL": ctx.channel.id,
+                                                "FUTURE": future, "TEXT": text}
+        store.mark_dirty(PERSONAL_REMINDERS, reminder_id)
+        self.schedule_personal_reminder(reminder_id, self.personal_reminders[reminder_id])
         await ctx.send("I will remind you that in {} {}.".format(str(quantity), time_unit + s))
-        #json.dump(self.reminders, open("./data/remindme/reminders.json", "w"))
-        self.remindme_timer.start(ctx, text)
 
+    async def notify_reminders(self, reminders: list):
+        """
+            Announces homeworks that are due today in the notification channel and emails them.
 
-    @tasks.loop(seconds=1)
-    async def remindme_timer(self, ctx, text): # pragma: no cover
-        self.seconds -= 1
-        if self.seconds == 0:
-            await ctx.send("Reminder : " + text)
-            await self.stop_task()
+            Parameters:
+                reminders: the homework reminders to announce.
+        """
+        if self.notify_channel is None or not reminders:
+            return
+        rows = ["{} {} is due today at {}".format(reminder["COURSE"], reminder["HOMEWORK"],
+                                                  reminder["DUEDATE"].split(" ")[1])
+                for reminder in reminders]
+        await self.renderer.send(self.notify_channel, rows)
+        self.email_digest(rows)
 
-    async def stop_task(self):
-        self.remindme_timer.cancel()
+    def email_digest(self, rows: list):
+        """
+            Queues one email per configured address listing every homework in rows, so each
+            student gets a single email however many homeworks are due.
 
-    @tasks.loop(hours = 6)
-    async def reminder(self, ctx): # pragma: no cover
-        flag = True
-        for reminder in self.reminders:
-            print(reminder)
-            timedate = datetime.strptime(reminder["DUEDATE"], '%Y-%m-%d %H:%M:%S')
-            print(timedate)
-            if timedate.date() == datetime.today().date():
-                flag = False
-                await ctx.send("{} {} is due today at {}".
-                format(reminder["COURSE"], reminder["HOMEWORK"],timedate.time()))
-                send_email_notify(reminder, timedate)
-        if flag:
-            await ctx.send("You have no dues today..!!")
-    @commands.command()
+            Parameters:
+                rows: the "... is due today at ..." lines to send.
+        """
+        listing = "\n".join("- " + row for row in rows)
+        batch = []
+        for user_id, address in store.load("email/emails.json").items():
+            user = self.bot.get_user(int(user_id))
+            batch.append((str(address), 'You have one/more assignments coming up.',
+                          "Hello {},\n\nThe following homeworks are due today:\n{}\n".format(
+                              user.name if user else "there", listing)))
+        outbox.enqueue_many(batch)
+
+    @commands.command(name="start_reminders",
+                      help="Post the homeworks due today in this channel every day $start_reminders")
     async def start_reminders(self, ctx):
-        self.reminder.start(ctx)
-
-
+        """
+            Makes the current channel the one where homeworks are announced on their due day
+            and lists the homeworks that are due today.
 
+            Parameters:
+                ctx: used to access the values passed through the current context.
+        """
+        self.notify_channel = ctx.channel
+        today = self.index.due_between(time.time(), day_bounds(datetime.today())[1])
+        if today:
+            await self.notify_reminders(today)
+        else:
+            await ctx.send("You have no dues today..!!")
 
     @commands.Cog.listener()
     async def on_command_error(self, ctx, error):
         await ctx.send(
             '\nUnidentified command... Refer to $help to get the list of available commands')
 
-    async def delete_old_reminders(self):
+    async def expire_reminder(self, reminder):
         """
-            asynchronously keeps on tracking the json file for expired reminders and cleans them.
+            Deletes a homework reminder once it is due.
 
             Parameters:
-
-            Returns:
-                return nothing as this is task to delete the old reminders.
-
+                reminder: the homework reminder as stored in reminders.json.
         """
-        while self is self.bot.get_cog("Deadline"):
-            to_remove = []
-            for reminder in self.reminders:
-                if reminder["FUTURE"] <= int(time.time()):
-                    try:
-                        print("Deleting an old reminder..!!")
-                    except (discord.errors.Forbidden, discord.errors.NotFound):
-                        to_remove.append(reminder)
-                    except discord.errors.HTTPException:
-                        pass
-                    else:
-                        to_remove.append(reminder)
-            for reminder in to_remove:
-                self.reminders.remove(reminder)
-            if to_remove:
-                cur_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-                os.chdir(cur_dir)
-                json.dump(self.reminders, open("./data/remindme/reminders.json", "w"))
-            await asyncio.sleep(5)
+        if self.index.get(reminder["COURSE"], reminder["HOMEWORK"]) is reminder:
+            print("Deleting an old reminder..!!")
+            self.remove_reminder(reminder)
 
 
 def check_folders():
@@ -451,38 +516,4 @@ def setup(bot):
     """add the file to the bot's cog system"""
     check_folders()
     check_files()
-    n = Deadline(bot)
-    loop = asyncio.get_event_loop()
-    loop.create_task(n.delete_old_reminders())
-    bot.add_cog(n)
-
-
-
-def send_email_notify(reminder, timedate): # pragma: no cover
-    sender_address = 'rightwritesupp0rt@gmail.com'
-    sender_pass = 'WriteRight20$'
-    receiver_address = json.load(open("./data/email/emails.json"))
-    mail_content = "{} {} is due today at {}".format(
-        reminder["COURSE"], reminder["HOMEWORK"], timedate.time())
-
-    receiver_address = receiver_address.values()
-    for receiver_email in receiver_address:
-        print(receiver_email)
-        message = MIMEMultipart()
-        message['From'] = sender_address
-        message['To'] = str(receiver_email)
-        message['Subject'] = 'You have one/more assignments coming up.'   #The subject line
-        #The body and the attachments for the mail
-        message.attach(MIMEText(mail_content, 'plain'))
-        #Create SMTP session for sending the mail
-        print("email 1")
-        session = smtplib.SMTP('smtp.gmail.com', 587) #use gmail with port
-        print("email 2")
-        session.starttls() #enable security
-        print("email 3")
-        session.login(sender_address, sender_pass) #login with mail_id and password
-        print("Login success")
-        text = message.as_string()
-        session.sendmail(sender_address, receiver_address, text)
-        session.quit()
-        print('Mail Sent')
+    bot.add_cog(Deadline(bot))
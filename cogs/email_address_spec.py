@@ -5,9 +5,11 @@
 """
 import os
 import re
-import json
 
 from discord.ext import commands
+from Utility.data_store import store
+
+EMAILS = "email/emails.json"
 
 
 class EmailAddressCRUD(commands.Cog):
@@ -20,11 +22,9 @@ class EmailAddressCRUD(commands.Cog):
             initialize
         """
         self.bot = bot
-        self.email_list = None
         cur_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         os.chdir(cur_dir)
-        with open("./data/email/emails.json", "r", encoding='utf-8') as file:
-            self.email_list = json.load(file)
+        self.email_list = store.load(EMAILS)
 
     @commands.command(name="add_email",
                       help="add email address to receive notifications and files,"
@@ -48,10 +48,6 @@ class EmailAddressCRUD(commands.Cog):
             await ctx.send("Enter a valid Email Address..!")
             return
 
-        if not self.email_list:
-            with open("./data/email/emails.json", "r", encoding='utf-8') as file:
-                self.email_list = json.load(file)
-
         if str(author.id) in self.email_list.keys():
             await ctx.send(
                 "There is already an email address configured, "
@@ -59,8 +55,7 @@ class EmailAddressCRUD(commands.Cog):
             return
         else:
             self.email_list[str(author.id)] = email_address
-            with open("./data/email/emails.json", "w", encoding='utf-8') as file:
-                json.dump(self.email_list, file)
+            store.mark_dirty(EMAILS, str(author.id))
             await ctx.send("Email address has been configured successfully..!")
 
     @add_email_address.error
@@ -87,10 +82,6 @@ class EmailAddressCRUD(commands.Cog):
         """
         author = ctx.message.author
 
-        if not self.email_list:
-            with open("./data/email/emails.json", "r", encoding='utf-8') as file:
-                self.email_list = json.load(file)
-
         if str(author.id) in self.email_list:
             await ctx.send(
                 "currently configured email address:{}".format(self.email_list[str(author.id)]))
@@ -119,14 +110,9 @@ class EmailAddressCRUD(commands.Cog):
             await ctx.send("Enter a valid Email Address..!")
             return
 
-        if not self.email_list:
-            with open("./data/email/emails.json", "r", encoding='utf-8') as file:
-                self.email_list = json.load(file)
-
         if str(author.id) in self.email_list:
             self.email_list[str(author.id)] = email_address
-            with open("./data/email/emails.json", "w", encoding='utf-8') as file:
-                json.dump(self.email_list, file)
+            store.mark_dirty(EMAILS, str(author.id))
             await ctx.send("Email address has been updated successfully..!")
         else:
             await ctx.send("There is no email address configured, "
@@ -156,14 +142,9 @@ class EmailAddressCRUD(commands.Cog):
         """
         author = ctx.message.author
 
-        if not self.email_list:
-            with open("./data/email/emails.json", "r", encoding='utf-8') as file:
-                self.email_list = json.load(file)
-
         if str(author.id) in self.email_list:
             del self.email_list[str(author.id)]
-            with open("./data/email/emails.json", "w", encoding='utf-8') as file:
-                json.dump(self.email_list, file)
+            store.mark_dirty(EMAILS, str(author.id))
             await ctx.send("Email address has been deleted successfully..!")
         else:
             await ctx.send("There is no email address configured..!")
@@ -1,10 +1,12 @@
 """
  Copyright (c) 2021 War-Keeper
 """
-import os
-import csv
 import discord
 from discord.ext import commands
+from Utility.reply_pages import get_renderer
+from Utility.group_roster import get_roster, GROUP_SIZE
+from Utility.group_formation import form_groups
+from Utility.ledger import ResourceLocks
 
 
 
@@ -14,14 +16,15 @@ class Groups(commands.Cog):
      This File contains commands for joining a group, leaving a group,
      and displaying which groups are available
     """
-    student_pool = {}
-    groups = {}
 
     """
      initialize
     """
     def __init__(self, bot):
         self.bot = bot
+        self.roster = get_roster()
+        # one lock per group and per member, so joins of different groups never wait on each other
+        self.locks = ResourceLocks()
 
 
     @commands.command(name='join', help='To use the join command, do: $join \'Group\' <Num> \n \
@@ -38,10 +41,6 @@ class Groups(commands.Cog):
             Outputs: adds the user to the given group or returns an error if the group is invalid or in case of
                      syntax errors
         """
-        # load the groups from the csv
-        groups = load_groups()
-        student_pool = load_pool()
-
         # get the name of the caller
         member_name = ctx.message.author.display_name.upper()
 
@@ -49,29 +48,25 @@ class Groups(commands.Cog):
         group_num = arg.upper() + ' ' + arg2
 
         # if the the group is a valid option
-        if group_num in groups:
+        if group_num in self.roster.groups:
+            async with self.locks.hold(('GROUP', group_num), ('MEMBER', member_name)):
 
-            # check if group has more than 6 people
-            if len(groups[group_num]) == 6:
-                await ctx.send('A group cannot have more than 6 people!')
-                return
+                # check if group has more than 6 people
+                if self.roster.is_full(group_num):
+                    await ctx.send('A group cannot have more than 6 people!')
+                    return
 
-            # check if member is already in another group
-            for key in groups.keys():
-                if member_name in groups[key]:
-                    await ctx.send('You are already in ' + key.title())
+                # check if member is already in another group
+                current = self.roster.group_of(member_name)
+                if current is not None:
+                    await ctx.send('You are already in ' + current.title())
                     return
 
-            # add the member to the group and send confirmation
-            groups[group_num].append(member_name)
+                # add the member to the group, which also updates name_mapping.csv, and wait until
+                # the change is in the ledger before confirming
+                self.roster.join(member_name, group_num, save=False)
+                await self.roster.commit()
             await ctx.send('You are now in ' + group_num.title() + '!')
-            print_groups(groups)
-            # updates the group number of the member in the name_mapping.csv
-            for key in student_pool.keys():
-                if key == member_name:
-                    student_pool[key][1] = group_num
-                    break
-            print_pool(student_pool)
 
         # error handling
         else:
@@ -103,10 +98,6 @@ class Groups(commands.Cog):
                         case of syntax errors
            """
 
-        # load groups csv
-        groups = load_groups()
-        student_pool = load_pool()
-
         # get the name of the caller
         member_name = ctx.message.author.display_name.upper()
 
@@ -114,29 +105,27 @@ class Groups(commands.Cog):
         group_num = arg.upper() + ' ' + arg2
 
         # if the the group is a valid option
-        if group_num in groups:
-
-            # if member in is the group, then remove them from it
-            if member_name in groups[group_num]:
-                groups[group_num].remove(member_name)
+        if group_num in self.roster.groups:
+
+            async with self.locks.hold(('GROUP', group_num), ('MEMBER', member_name)):
+                # if member in is the group, then remove them from it
+                removed = self.roster.group_of(member_name) == group_num
+                if removed:
+                    self.roster.leave(member_name, save=False)
+                    await self.roster.commit()
+            if removed:
                 await ctx.send('You have been removed from ' + group_num.title() + '!')
-                for key in student_pool.keys():
-                    if key == member_name:
-                        student_pool[key][1] = -1
-                        break
-                print_pool(student_pool)
             # else error message
             else:
                 await ctx.send('You are not in ' + group_num.title())
-            print_groups(groups)
 
         # if the arguments are not listed, then try to find out what group the member is in and remove them
         elif arg2 == '-1':
-            for key in groups.keys():
-                if member_name in groups[key]:
-                    groups[key].remove(member_name)
-                    await ctx.send('You are been removed from ' + key.title() + '!')
-            print_groups(groups)
+            async with self.locks.hold(('MEMBER', member_name)):
+                group = self.roster.leave(member_name, save=False)
+                await self.roster.commit()
+            if group is not None:
+                await ctx.send('You are been removed from ' + group.title() + '!')
 
         # error handling
         else:
@@ -168,8 +157,7 @@ class Groups(commands.Cog):
             Outputs: prints the list of groups
         """
 
-        # load groups csv
-        groups = load_groups()
+        groups = self.roster.groups
 
         # create embedded objects
         embed = discord.Embed(title='Group List', color=discord.Color.teal())
@@ -178,15 +166,14 @@ class Groups(commands.Cog):
         embed2 = discord.Embed(title='Group List', color=discord.Color.teal())
         embed2.set_thumbnail(url="https://i.pinimg.com/474x/e7/e3/bd/e7e3bd1b5628510a4e9d7a9a098b7be8.jpg")
 
-        # ignoring the first line, add all group member counts to the embedded objects
+        # add all group member counts to the embedded objects
         count = 0
         for key in groups.keys():
-            if key != 'GROUP_NUM':
-                if count < 20:
-                    embed.add_field(name=key, value=str(len(groups[key])), inline=True)
-                else:
-                    embed2.add_field(name=key, value=str(len(groups[key])), inline=True)
-                count += 1
+            if count < 20:
+                embed.add_field(name=key, value=str(len(groups[key])), inline=True)
+            else:
+                embed2.add_field(name=key, value=str(len(groups[key])), inline=True)
+            count += 1
 
         # print the embedded objects
         embed.set_footer(text="Number Represents the Group Size")
@@ -233,43 +220,107 @@ class Groups(commands.Cog):
                      syntax errors
        """
 
-        # load name_mapping csv
-        student_pool = load_pool()
+        # fills the groups with the most vacant spots first and writes both csv files once
+        modifications = self.roster.auto_assign(save=False)
+        await self.roster.commit()
 
-        # load groups csv
-        groups = load_groups()
+        if bool(modifications):
+            await get_renderer(self.bot).send(
+                ctx, [key + " : " + values for key, values in modifications.items()]
+                + ["Successfully assigned students into groups"], header="Following updates are made:")
 
-        # returns a dictionary with group numbers as keys and number of vacant spots available as values.
-        vacant_groups = get_vacant_groups(groups)
-        modifications = {}
+        else:
+            await ctx.send("No modifications made. Every Student is part of a Group")
 
-        for key in student_pool.keys():
-            if student_pool[key][1] == '-1':
-                vacant_group = get_minimum(vacant_groups)
-                if None in groups[vacant_group]:
-                    index = groups[vacant_group].index(None)
-                    groups[vacant_group][index] = key
-                else :
-                    groups[vacant_group].append(key)
-                print_groups(groups) # update groups csv file to reflect new members in the group
-                student_pool[key][1] = vacant_group
-                print_pool(student_pool) # update group number in name_mapping csv
-                modifications[key] = vacant_group
-                vacant_groups[vacant_group] = vacant_groups[vacant_group]+1
+    @commands.command(
+        name='group-preferences',
+        help="To set who you want in your group or when you can meet, do: $group-preferences teammates|slots "
+             "<comma separated values> \n ( For example: $group-preferences teammates Jane Doe, John Roe )",
+        pass_context=True
+    )
+    async def group_preferences(self, ctx, kind: str = '', *, values: str = ''):
+        """
+            Function: group_preferences(self, ctx, kind, *, values)
+            Description: records the teammates or the time slots a student prefers, used by $form-groups
+            Inputs:
+            - self: used to access parameters passed to the class through the constructor
+            - ctx: used to access the values passed through the current context
+            - kind: teammates or slots
+            - values: comma separated student names or time slots; when empty the current ones are shown
+            Outputs: confirms the saved preferences, or lists names that could not be found
+        """
+        kind = kind.upper()
+        if kind not in ('TEAMMATES', 'SLOTS'):
+            await ctx.send('To use the group-preferences command, do: $group-preferences teammates|slots '
+                           '<comma separated values> \n ( For example: $group-preferences slots Mon 5pm, Wed 5pm )')
+            return
+
+        username = self.roster.find_student(ctx.message.author.name) \
+            or self.roster.find_student(ctx.message.author.display_name)
+        if username is None:
+            await ctx.send('Please verify before setting group preferences')
+            return
+
+        entries = [value.strip() for value in values.split(',') if value.strip()]
+        if not entries:
+            current = self.roster.preferences.get(username, {}).get(kind, [])
+            await ctx.send('Your ' + kind.lower() + ' preferences: ' + (', '.join(current) or 'none'))
+            return
+
+        if kind == 'TEAMMATES':
+            found = [self.roster.find_student(entry) for entry in entries]
+            missing = [entry for entry, mate in zip(entries, found) if mate is None]
+            if missing:
+                await ctx.send('Could not find ' + ', '.join(missing) + ', please check the names and try again')
+                return
+            entries = [mate for mate in found if mate != username]
+        else:
+            entries = [entry.upper() for entry in entries]
 
+        self.roster.set_preferences(username, kind, entries)
+        await ctx.send('Your ' + kind.lower() + ' preferences are saved: ' + ', '.join(entries))
 
-        if bool(modifications):
-            await ctx.send("Following updates are made:")
-            for key, values in modifications.items():
-                await ctx.send(key +  " : " + values)
-            await ctx.send("Successfully assigned students into groups")
+    @commands.command(
+        name='form-groups',
+        help="Instructor only: place students who are not part of a group into groups following their "
+             "$group-preferences, ex. $form-groups",
+        pass_context=True
+    )
+    async def form_groups(self, ctx):
+        """
+            Function: form_groups(self, ctx)
+            Description: places students who are not part of a group into the vacant groups so that as many
+                         teammate and time slot preferences as possible are met, keeping groups balanced
+            Inputs:
+            - self: used to access parameters passed to the class through the constructor
+            - ctx: used to access the values passed through the current context
+            Outputs: the students and the groups they are placed in, with groups.csv written once
+        """
+        if ctx.channel.name != 'instructor-channel':
+            await ctx.author.send('Command works only in instructor-channel')
+            return
 
-        else:
+        students, groups, preferences = self.roster.formation_input()
+        if not students:
             await ctx.send("No modifications made. Every Student is part of a Group")
+            return
+
+        # the optimisation takes seconds for a large class, so it runs off the event loop
+        assignments = await self.bot.loop.run_in_executor(
+            None, form_groups, students, groups, preferences, GROUP_SIZE)
+        modifications = self.roster.assign(assignments, save=False)
+        await self.roster.commit()
+
+        if bool(modifications):
+            await get_renderer(self.bot).send(
+                ctx, [key + " : " + values for key, values in modifications.items()]
+                + ["Successfully formed groups from preferences"], header="Following updates are made:")
+        else:
+            await ctx.send("No modifications made. There are no vacant groups")
 
 
     @commands.Cog.listener()
-    async def on_member_remove(self,member):
+    async def on_member_remove(self, member):
         """
             Function: on_member_remove(member)
             Description: Handles on_member_remove events, removes a member from assigned group if the member leaves
@@ -279,20 +330,8 @@ class Groups(commands.Cog):
             Outputs:
                - groups.csv and name_mapping.csv files are updated to reflect removal of a member
        """
-        groups = load_groups()
-        student_pool = load_pool()
-
-        name = member.display_name
-        for key in groups.keys():
-            if name.upper() in groups[key]:
-                groups[key].remove(name.upper())
-        print_groups(groups)
-
-        for key in student_pool.keys():
-            if name.upper() == key.upper() or name.upper() == student_pool[key][0].upper():
-                del student_pool[key]
-                break
-        print_pool(student_pool)
+        self.roster.remove_student(member.display_name, save=False)
+        await self.roster.commit()
 
     # @commands.dm_only()
     @commands.command(
@@ -315,16 +354,10 @@ class Groups(commands.Cog):
                     command  with proper arguments.
         """
 
-        student_pool = load_pool()
-        match_found = False
-        name = name.upper()
-        for key in student_pool.keys():
-            if name == key.upper() or name == student_pool[key][0].upper():
-                await ctx.send(student_pool[key][1])
-                match_found = True
-                break
-
-        if not match_found:
+        username = self.roster.find_student(name)
+        if username is not None:
+            await ctx.send(self.roster.student_group(username))
+        else:
             await  ctx.send("Please check the name entered and try again")
             await ctx.send('To use the find-group command, do: $find-group <StudentName> \n \
                             ( For example: $find-group Jane Doe )')
@@ -338,99 +371,6 @@ class Groups(commands.Cog):
             await ctx.send('To use the find-group command, do: $find-group <StudentName> \n \
             ( For example: $find-group Jane Doe )')
 
-def load_groups() -> dict:
-    """
-     Used to load the groups from the csv file into a dictionary
-    """
-    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.chdir(directory)
-    os.chdir('data')
-    os.chdir('server_data')
-    with open('groups.csv', mode='r') as infile:
-        reader = csv.reader(infile)
-        group = {rows[0].upper(): [rows[1].upper(), rows[2].upper(), rows[3].upper(), rows[4].upper(),
-                                   rows[5].upper(), rows[6].upper()] for rows in reader}
-
-    for key in group.keys():
-        group[key] = list(filter(None, group[key]))
-
-    return group
-
-
-def print_groups(group):
-    """
-     Used to print the groups to the csv file
-    """
-    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.chdir(directory)
-    os.chdir('data')
-    os.chdir('server_data')
-    with open('groups.csv', mode='w', newline="") as outfile:
-        writer = csv.writer(outfile)
-        for key in group.keys():
-            while len(group[key]) < 6:
-                group[key].append(None)
-            writer.writerow([key] + group[key])
-
-
-def load_pool() -> dict:
-    """
-     Used to load the members from the csv file into a dictionary
-    """
-    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.chdir(directory)
-    os.chdir('data')
-    os.chdir('server_data')
-    with open('name_mapping.csv', mode='r') as infile:
-        reader = csv.reader(infile)
-        for rows in reader:
-            if rows == []:
-                break
-            student_pools = {rows[0].upper(): [rows[1].upper(), rows[2]]}
-
-    return student_pools
-
-
-def print_pool(pools):
-    """
-     Used to print the members to the csv file
-    """
-    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.chdir( directory)
-    os.chdir('data')
-    os.chdir('server_data')
-    with open('name_mapping.csv', mode='w', newline="") as outfile:
-        writer = csv.writer(outfile)
-        for key in pools.keys():
-            while len(pools[key]) < 2:
-                pools[key].append(None)
-            writer.writerow([key]+ pools[key])
-
-
-def get_vacant_groups(groups)-> dict:
-    """
-     retrieves group numbers with vacant spots
-    """
-
-    vacant_groups = {}
-    for group_number in groups.keys():
-        if len(groups[group_number]) < 6:
-            vacant_groups[group_number] = len(groups[group_number])
-
-    return vacant_groups
-
-
-def get_minimum(vacant_groups):
-    """
-     retrieves group number with minimum student count
-    """
-
-    vacant_groups = dict(sorted(vacant_groups.items(), key=lambda x: x[1]))
-    minimum = list(vacant_groups.keys())[0]
-
-    return minimum
-
-
 def setup(bot):
     """
      add the file to the bot's cog system
@@ -1,7 +1,7 @@
 """This file contains several modules to store or display messages which contain urls"""
-import re
 import discord
 from discord.ext import commands
+from Utility.message_pipeline import get_pipeline
 
 
 
@@ -10,26 +10,17 @@ class Links(commands.Cog):
         Display all the messages which contains links."""
     def __init__(self, bot):
         self.bot = bot
+        get_pipeline(bot).add_stage("links", self.store_links, 40)
 
-    @commands.Cog.listener()
-    async def on_message(self, message):
+    def cog_unload(self):
+        """remove the message pipeline stage"""
+        get_pipeline(self.bot).remove_stage("links")
+
+    async def store_links(self, context):
         """TO store messgaes contanning url to links.txt"""
-        url=[]
-        message_links = []
-        temp=[]
-        print(message.content)
-        regex = r"(?i)\b((?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+" \
-                r"\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:'\".,<>?«»“”‘’]))"
-        url = re.findall(regex, message.content)
-        for url_count in url:
-            temp.append(url_count[0])
-        if temp:
-            message_links.append(message.content)
+        if context.urls:
             with open('./data/links/links.txt', "a") as text_file:
-                text_file.write("Message containing url :-  " + message.content + "\n")
-                text_file.close()
-        else:
-            pass
+                text_file.write("Message containing url :-  " + context.message.content + "\n")
 
 
     @commands.command(name='send_links', help='Command will output all the messages which contain url')
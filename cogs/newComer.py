@@ -1,9 +1,9 @@
 """This file contains several methods to verify new user"""
 import os
-import csv
 import random
 import discord
 from discord.ext import commands
+from Utility.group_roster import get_roster
 
 
 
@@ -57,11 +57,8 @@ class Helper(commands.Cog):
                 verified = discord.utils.get(
                     guild.roles, name=self.VERIFIED_MEMBER_ROLE
                 )  # finds the verified role in the guild
-                with open(
-                    "./data/server_data/name_mapping.csv", mode="a", newline=""
-                ) as outfile:  # storing discord name and actual name in name_mapping.csv
-                    writer = csv.writer(outfile)
-                    writer.writerow([member.name, name, -1]) # initially group number is assigned to -1
+                # storing discord name and actual name in name_mapping.csv, initially in no group
+                get_roster().add_student(member.name, name)
                 await member.add_roles(verified)  # adding verfied role
                 await member.remove_roles(unverified)  # removed verfied role
                 await ctx.send(
@@ -9,13 +9,18 @@ import discord
 from discord.ext import commands
 import json
 import os
+from Utility.data_store import store
+from Utility.reply_pages import get_renderer
+
+PINS = "PinMessage/PinnedMessages.json"
 
 
 class Pinning(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
-        self.pinned_messages = json.load(open("./data/PinMessage/PinnedMessages.json"))
+        self.pinned_messages = store.load(PINS, default=[])
+        self.renderer = get_renderer(bot)
 
     # Test command to check if the bot is working
     @commands.command()
@@ -41,7 +46,7 @@ class Pinning(commands.Cog):
 
         self.pinned_messages.append(
             {"ID": author.id, "TAG": tagname, "DESCRIPTION": description, "LINK": link})
-        json.dump(self.pinned_messages, open("./data/PinMessage/PinnedMessages.json", "w"))
+        store.mark_dirty(PINS)
         await ctx.send(
             "A new message has been pinned with tag: {} and link: {} with a description: {} by {}.".format(tagname,
                                                                                                            link,
@@ -83,7 +88,7 @@ class Pinning(commands.Cog):
         for pin_mes in to_remove:
             self.pinned_messages.remove(pin_mes)
         if to_remove:
-            json.dump(self.pinned_messages, open("./data/PinMessage/PinnedMessages.json", "w"))
+            store.mark_dirty(PINS)
             await ctx.send(
                 "{} pinned message(s) has been deleted with tag: {} and description: {}.".format(len(to_remove),
                                                                                                  str(pin_mes["TAG"]),
@@ -110,12 +115,10 @@ class Pinning(commands.Cog):
     @commands.command(name="pinnedmessages", help="Retrieve the pinned messages by passing the tagname")
     async def retrieveMessages(self, ctx, tagname: str):
         author = ctx.message.author
-        for pin_mes in self.pinned_messages:
-            if (pin_mes["ID"] == author.id and pin_mes["TAG"] == tagname):
-                await ctx.send("Tag: {}, Message Link: {}, Description: {}".format(tagname, pin_mes["LINK"],
-                                                                                   pin_mes["DESCRIPTION"]))
-            else:
-                await ctx.send("No messages found with the given tagname and author combination")
+        await self.renderer.send(ctx, [
+            "Tag: {}, Message Link: {}, Description: {}".format(tagname, pin_mes["LINK"], pin_mes["DESCRIPTION"])
+            for pin_mes in self.pinned_messages if pin_mes["ID"] == author.id and pin_mes["TAG"] == tagname],
+            empty="No messages found with the given tagname and author combination")
 
     @retrieveMessages.error
     async def retrieveMessages_error(self, ctx, error):
@@ -148,7 +151,7 @@ class Pinning(commands.Cog):
                 pin_mes["LINK"] = new_link
                 flag = True
                 if (flag):
-                    json.dump(self.pinned_messages, open("./data/PinMessage/PinnedMessages.json", "w"))
+                    store.mark_dirty(PINS)
                     await ctx.send(
                         "A pinned message has been updated with tag: {} and new link: {} by: {}.".format(tagname,
                                                                                                          new_link,
@@ -1,9 +1,9 @@
 # Copyright (c) 2021 War-Keeper
 """This file contains serval methods to greet Hello"""
 
-from operator import contains
 from discord.ext import commands
 from better_profanity import profanity
+from Utility.message_pipeline import get_pipeline, MessageContext
 profanity.load_censor_words()
 
 
@@ -11,21 +11,33 @@ class Profanity(commands.Cog):
     """Class which deltes profane words and custom profane words"""
     def __init__(self, bot):
         self.bot = bot
-        self.custom_words = []
+        self.custom_words = set()
+        get_pipeline(bot).add_stage("profanity", self.filter_message, 30)
 
-    @commands.Cog.listener()
-    async def on_message(self, message):
+    def cog_unload(self):
+        get_pipeline(self.bot).remove_stage("profanity")
+
+    # ------------------------------------------------------------------------------------------------------------------
+    #    Function: filter_message
+    #    Description: message pipeline stage, censors and deletes profane messages and stops the later stages;
+    #                 commands such as $custom itself and the bot's own replies are never checked for custom words
+    #    Inputs:
+    #    - context: MessageContext of the received message
+    #    Outputs:
+    #    -
+    # ------------------------------------------------------------------------------------------------------------------
+    async def filter_message(self, context):
+        message = context.message
         if profanity.contains_profanity(message.content):
             await message.channel.send(message.author.name + ' says: ' +
                 profanity.censor(message.content))
-            print(profanity.censor(message.content))
             await message.delete()
-        else:
-            print(self.custom_words)
-            if message in self.custom_words:
-                await message.channel.send(message.author.name + 'says: ' +
-                    '****')
-                await message.delete()        
+            context.stop()
+        elif self.custom_words.intersection(context.tokens) and not await context.exempt(self.bot):
+            await message.channel.send(message.author.name + 'says: ' +
+                '****')
+            await message.delete()
+            context.stop()
 
     # ------------------------------------------------------------------------------------------------------------------
     #    Function: on_message_edit
@@ -44,7 +56,8 @@ class Profanity(commands.Cog):
                 profanity.censor(after.content))
             await after.delete()
         else:
-            if after in self.custom_words:
+            context = MessageContext(after)
+            if self.custom_words.intersection(context.tokens) and not await context.exempt(self.bot):
                 await after.channel.send(after.author.name + 'says' +
                     '****')
                 await after.delete()        
@@ -52,10 +65,10 @@ class Profanity(commands.Cog):
 
     @commands.command(help='Add a word to be declared as profane from here on out')
     async def custom(self, ctx, text):
-        if text in self.custom_words:
+        if text.lower() in self.custom_words:
             await ctx.send("Already Added!!")
         else:
-            self.custom_words.append(text)
+            self.custom_words.add(text.lower())
             await ctx.message.delete()
             await ctx.send("Word added to custom profanity filter")
 
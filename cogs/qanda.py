@@ -1,14 +1,15 @@
 from discord import NotFound
 from discord.ext import commands
-import json
+from Utility.data_store import store
+
+QANDA = 'qanda/qandastorage.json'
 
 
 class QuestionsAnswers(commands.Cog):
     ''' Class containing needed question/answer information and identification '''
     def __init__(self, bot):
         self.bot = bot
-        with open('./data/qanda/qandastorage.json', 'r', encoding='utf-8') as file:
-            self.data = json.load(file)
+        self.data = store.load(QANDA)
 
     @commands.command()
     async def ask(self, ctx, question):
@@ -16,9 +17,6 @@ class QuestionsAnswers(commands.Cog):
             ''' add a question '''
             global QUESTION_NUMBER
 
-            with open('./data/qanda/qandastorage.json', 'r', encoding='utf-8') as file:
-                self.data = json.load(file)
-
             if self.data:
                 QUESTION_NUMBER = len(self.data) + 1
             else:
@@ -35,8 +33,7 @@ class QuestionsAnswers(commands.Cog):
                 "id": str(message.id),
                 "answer": ""
             }
-            with open('./data/qanda/qandastorage.json', 'w', encoding='utf-8') as file:
-                json.dump(self.data, file)
+            store.mark_dirty(QANDA, str(QUESTION_NUMBER))
 
             # delete original question
             await ctx.message.delete()
@@ -49,9 +46,6 @@ class QuestionsAnswers(commands.Cog):
         if ctx.channel.name == 'q-and-a':
             ''' add a question '''
             global QUESTION_NUMBER
-
-            with open('./data/qanda/qandastorage.json', 'r', encoding='utf-8') as file:
-                self.data = json.load(file)
             if self.data:
                 QUESTION_NUMBER = len(self.data) + 1
             else:
@@ -68,8 +62,7 @@ class QuestionsAnswers(commands.Cog):
                 "id": str(message.id),
                 "answer": ""
             }
-            with open('./data/qanda/qandastorage.json', 'w', encoding='utf-8') as file:
-                json.dump(self.data, file)
+            store.mark_dirty(QANDA, str(QUESTION_NUMBER))
 
             # delete original question
             await ctx.message.delete()
@@ -80,9 +73,6 @@ class QuestionsAnswers(commands.Cog):
     @commands.command()
     async def answer(self, ctx, q_num, ans):
         if ctx.channel.name == 'q-and-a':
-            with open('./data/qanda/qandastorage.json', 'r', encoding='utf-8') as file:
-                self.data = json.load(file)
-
             if not self.data or q_num not in self.data.keys():
                 await ctx.author.send('Invalid question number: ' + str(q_num))
                 # delete user msg
@@ -113,8 +103,7 @@ class QuestionsAnswers(commands.Cog):
 
             try:
                 await message.edit(content=content)
-                with open('./data/qanda/qandastorage.json', 'w', encoding='utf-8') as file:
-                    json.dump(self.data, file)
+                store.mark_dirty(QANDA, q_num)
             except NotFound:
                 await ctx.author.send('Invalid question number: ' + str(q_num))
 
@@ -0,0 +1,82 @@
+# Copyright (c) 2021 War-Keeper
+"""
+This File contains commands for inspecting how long the bot's handlers take,
+so admins can find out which cog makes the bot lag under load.
+"""
+import os
+from datetime import datetime
+
+import discord
+from discord.ext import commands
+from Utility.bot_stats import instrument
+
+STATS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "stats")
+
+
+class Stats(commands.Cog):
+    """
+        Class measures every command and listener and reports the numbers to admins.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.stats = instrument(bot)
+
+    @commands.command(name='botstats', help='Admin only: p50/p95/p99 latency of every command, listener '
+                                            'and message stage, ex. $botstats')
+    @commands.has_permissions(administrator=True)
+    async def botstats(self, ctx):
+        """
+            Sends the wall and event-loop blocking time percentiles of every handler seen so far.
+
+            Parameters:
+                ctx: used to access the values passed through the current context.
+
+            Returns:
+                one code block per 1900 characters, slowest handlers first.
+        """
+        report = self.stats.report()
+        if not report:
+            await ctx.send("No handler has run yet.")
+            return
+        lines = [f"{'handler':<40} {'calls':>6} {'err':>4}  {'wall p50/p95/p99 ms':>22}  {'block p95 ms':>12}"]
+        for name, summary in report.items():
+            wall = "{wall_p50_ms:g}/{wall_p95_ms:g}/{wall_p99_ms:g}".format(**summary)
+            lines.append(f"{name[:40]:<40} {summary['calls']:>6} {summary['errors']:>4}  {wall:>22}"
+                         f"  {summary['blocking_p95_ms']:>12g}")
+        block = ""
+        for line in lines:
+            if len(block) + len(line) > 1900:
+                await ctx.send(f"```{block}```")
+                block = ""
+            block += line + "\n"
+        await ctx.send(f"```{block}```")
+
+    @commands.command(name='dumpstats', help='Admin only: write the handler latency numbers to a JSON file, '
+                                             'ex. $dumpstats')
+    @commands.has_permissions(administrator=True)
+    async def dumpstats(self, ctx):
+        """
+            Writes the $botstats numbers to data/stats/ and uploads the file.
+
+            Parameters:
+                ctx: used to access the values passed through the current context.
+        """
+        os.makedirs(STATS_DIR, exist_ok=True)
+        path = os.path.join(STATS_DIR, "botstats-{}.json".format(datetime.now().strftime("%Y%m%d-%H%M%S")))
+        self.stats.dump(path)
+        await ctx.send("Handler stats written to " + os.path.relpath(path), file=discord.File(path))
+
+    @botstats.error
+    @dumpstats.error
+    async def stats_error(self, ctx, error):
+        """
+            this handles errors related to the stats commands
+        """
+        if isinstance(error, commands.MissingPermissions):
+            await ctx.send("Only admins can look at the bot stats.")
+
+
+def setup(bot):
+    """add the file to the bot's cog system"""
+    bot.add_cog(Stats(bot))
@@ -2,21 +2,40 @@
 This functionality tracks student activity and rewards students
  with level ups. Students can track their activities with $level and see their
  progress towards the next level. The bot continually listens for user messages
- and adds it to the user's personal experience/level score
+ and adds it to the user's personal experience/level score, and counts them
+ towards the hourly activity shown by $activity
 """
 from math import floor
-import json
-import os
 from datetime import datetime
 import discord
 from discord.ext import commands
+from Utility.message_pipeline import get_pipeline
+from Utility.reply_pages import get_renderer
+from Utility.xp_engine import get_xp_engine, level_cap
+from Utility.xp_backfill import XPBackfill
+from Utility.activity_series import get_activity
+
+# Users shown by $leaderboard unless asked otherwise, and the most it shows
+LEADERBOARD_SIZE = 10
+LEADERBOARD_MAX = 100
+
 
 class userRanking(commands.Cog):
     """Class provides several methods to manage user ranking."""
     def __init__(self, client):
-        cur_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        os.chdir(cur_dir)
         self.client = client
+        self.engine = get_xp_engine()
+        self.backfill = XPBackfill(self.engine)
+        self.activity = get_activity()
+        get_pipeline(client).add_stage("ranking", self.on_message, 60)
+
+    def cog_unload(self):
+        """
+            Removes the message pipeline stage of the cog and writes pending XP and activity
+        """
+        get_pipeline(self.client).remove_stage("ranking")
+        self.engine.flush()
+        self.activity.save()
 
     @commands.Cog.listener()
 
@@ -27,76 +46,34 @@ class userRanking(commands.Cog):
                 self: used to access parameters passed to the class through
                 member: used to access the values passed through the current context
         """
-        with open('./data/participation/users.json', 'r', encoding='utf-8') as file:
-            users = json.load(file)
-
-        await self.update_data(users, member)
+        self.engine.user(member.id)
 
-        with open('./data/participation/users.json', 'w', encoding='utf-8') as file:
-            json.dump(users, file, indent=4)
-
-    @commands.Cog.listener()
-    async def on_message(self, message):
+    async def on_message(self, context):
         """
-            Sees a user has messaged and adds their information
+            Sees a user has messaged and adds their experience in memory, at most once per XP_COOLDOWN;
+            runs as a message pipeline stage
             Parameters:
                 self: used to access parameters passed to the class through
-                message: used to access the values passed through the current context
+                context: MessageContext of the message that was received
         """
+        message = context.message
         if not message.author.bot:
-            cur_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            os.chdir(cur_dir)
-            with open('./data/participation/users.json', 'r', encoding='utf-8') as file:
-                users = json.load(file)
-            await self.update_data(users, message.author)
-            await self.add_experience(users, message.author)
-            await self.level_up(message, users)
-
-            with open('./data/participation/users.json', 'w', encoding='utf-8') as file:
-                json.dump(users, file, indent=4)
-
-    async def update_data(self, users, user):
-        """
-            Updates the data of the user
-            Parameters:
-                self: used to access parameters passed to the class through
-                users: the json file
-                user: the user
-        """
-        if not str(user.id) in users:
-            users[str(user.id)] = {}
-            users[str(user.id)]['experience'] = 0
-            users[str(user.id)]['level'] = 1
-
-    async def add_experience(self, users, user):
-        """
-            Adds experience to the user
-            Parameters:
-                self: used to access parameters passed to the class through
-                users: the json file
-                user: the user
-        """
-        users[str(user.id)]['experience'] += 15
+            self.activity.record(message.author.id, message.channel.id)
+            level = self.engine.message(message.author.id)
+            if level is not None:
+                await self.level_up(message, level)
 
-    async def level_up(self, ctx, users):
+    async def level_up(self, ctx, level):
         """
-            Levels up a user
+            Announces that a user levelled up
             Parameters:
                 self: used to access parameters passed to the class through
                 ctx: used to access the values passed through the current context
-                users: the json file
+                level: the level the user reached
         """
-        user = ctx.author
-        experience = users[str(user.id)]['experience']
-        lvl = users[str(user.id)]['level']
-        lvl_end = 5 * (lvl ** 2) + (50 * lvl) + 100
-
-        if lvl_end <= experience:
-            channel = discord.utils.get(ctx.guild.channels, name="general")
-            await channel.send('{} has levelled up to level {} ! 🙌'.format(user.mention, lvl + 1))
-            # .format(user.mention, lvl + 1))
-            users[str(user.id)]['level'] = lvl + 1
-            users[str(user.id)]['experience'] -= lvl_end
+        channel = discord.utils.get(ctx.guild.channels, name="general") if ctx.guild else None
+        if channel is not None:
+            await channel.send('{} has levelled up to level {} ! 🙌'.format(ctx.author.mention, level))
 
     async def to_integer(self, dt_time):
         """
@@ -120,66 +97,71 @@ class userRanking(commands.Cog):
                 ctx: used to access the values passed through the current context
                 user: the discord member
         """
-        with open('./data/participation/users.json', 'r', encoding='utf-8') as file:
-            users = json.load(file)
         await ctx.send('Contribute more to level up!')
-        if user is None:
-            if not str(ctx.author.id) in users:
-                users[str(ctx.author.id)] = {}
-                users[str(ctx.author.id)]['experience'] = 0
-                users[str(ctx.author.id)]['level'] = 0
-
-            user = ctx.author
-            lvl = int(users[str(ctx.author.id)]['level'])
-            exp = int(5 * (lvl ** 2) + (50 * lvl) + 100)  # XP cap
-            experience = int(users[str(user.id)]['experience'])
-            boxes = floor((experience * 20) / exp)
-            embed = discord.Embed(Title=f"**{user}'s Rank**",
-                                  Description=f"Experience: {lvl}/{exp}", color=0x0091ff)
-            embed.set_thumbnail(url=f"{user.avatar_url}")
-            embed.add_field(name=f"**{user}'s Rank**",
-                            value="🙌  ", inline=False)
-            embed.add_field(name="Level",
-                            value=f"**{users[str(user.id)]['level']}**", inline=True)
-            embed.add_field(name="Experience",
-                            value=f"**{str(int(users[str(user.id)]['experience']))} / {exp}**",
-                            inline=True)
-            embed.add_field(name="Progress Bar",
-                            value=boxes * ":blue_square:" + (20 - boxes) *
-                                    ":white_large_square:", inline=False)
-            embed.set_footer(text=f"next level: {lvl + 1}")
-            await ctx.send(embed=embed)
-
-        else:
-            if not str(user.id) in users:
-                users[str(user.id)] = {}
-                users[str(user.id)]['experience'] = 0
-                users[str(user.id)]['level'] = 0
-                users[str(user.id)]['LastMessage'] = await self.to_integer(datetime.now())
-            lvl = int(users[str(user.id)]['level'])
-            exp = int(5 * (lvl ** 2) + (50 * lvl) + 100)
-            experience = int(users[str(user.id)]['experience'])
-            boxes = floor((experience * 20) / exp)
-
-            embed = discord.Embed(Title=f"**{user}'s Rang**",
-                                  Description=f"Experience: {lvl}/"
-                                              f"{5 * (lvl ** 2) + (50 * lvl) + 100}",
-                                  color=0x0091ff)
-            embed.set_thumbnail(url=f"{user.avatar_url}")
-            embed.add_field(name=f"**{user}'s Rang**", value="🙌  ", inline=False)
-            embed.add_field(name="Level",
-                            value=f"**{users[str(user.id)]['level']}**", inline=True)
-            embed.add_field(name="Experience",
-                            value=f"**{str(int(users[str(user.id)]['experience']))} / {exp}**",
-                            inline=True)
-            embed.add_field(name="Progress Bar",
-                            value=boxes * ":blue_square:" + (20 - boxes) *
-                                  ":white_large_square:", inline=False)
-            embed.set_footer(text=f"next level: {lvl + 1}")
-            await ctx.send(embed=embed)
-
-        with open('./data/participation/users.json', 'w', encoding='utf-8') as file:
-            json.dump(users, file, indent=4)
+        user = user or ctx.author
+        record = self.engine.user(user.id)
+        lvl = int(record['level'])
+        exp = level_cap(lvl)  # XP cap
+        experience = int(record['experience'])
+        boxes = floor((experience * 20) / exp)
+        embed = discord.Embed(Title=f"**{user}'s Rank**",
+                              Description=f"Experience: {lvl}/{exp}", color=0x0091ff)
+        embed.set_thumbnail(url=f"{user.avatar_url}")
+        embed.add_field(name=f"**{user}'s Rank**",
+                        value="🙌  ", inline=False)
+        embed.add_field(name="Level",
+                        value=f"**{lvl}**", inline=True)
+        embed.add_field(name="Experience",
+                        value=f"**{experience} / {exp}**",
+                        inline=True)
+        embed.add_field(name="Rank",
+                        value=f"**#{self.engine.rank(user.id)} of {len(self.engine.users)}**", inline=True)
+        embed.add_field(name="Progress Bar",
+                        value=boxes * ":blue_square:" + (20 - boxes) *
+                                ":white_large_square:", inline=False)
+        embed.set_footer(text=f"next level: {lvl + 1}")
+        await ctx.send(embed=embed)
+
+    @commands.command(name='leaderboard', help='Shows the most active members, ex. $leaderboard or $leaderboard 25')
+    async def leaderboard(self, ctx, size: int = LEADERBOARD_SIZE):
+        """
+            Presents the users with the highest level and experience
+            Parameters:
+                self: used to access parameters passed to the class through
+                ctx: used to access the values passed through the current context
+                size: number of users to show
+        """
+        size = max(1, min(size, LEADERBOARD_MAX))
+        lines = []
+        for position, (user_id, record) in enumerate(self.engine.top(size), start=1):
+            member = ctx.guild.get_member(int(user_id)) if ctx.guild else None
+            name = member.display_name if member else self.client.get_user(int(user_id)) or f"User {user_id}"
+            lines.append(f"{position}. {name} - level {record['level']} ({record['experience']} XP)")
+        await get_renderer(self.client).send(ctx, lines, header="**Leaderboard**", empty="No one has XP yet!")
+
+    @commands.command(name='backfill-xp', help='Admin only: gives members the XP of the messages they sent before '
+                                               'the bot tracked XP, ex. $backfill-xp or $backfill-xp restart')
+    @commands.has_permissions(administrator=True)
+    @commands.guild_only()
+    async def backfill_xp(self, ctx, restart: str = ''):
+        """
+            Rebuilds every member's XP from the history of all text channels, resuming an
+            interrupted backfill unless asked to restart
+            Parameters:
+                self: used to access parameters passed to the class through
+                ctx: used to access the values passed through the current context
+                restart: 'restart' to drop the checkpoint of an interrupted backfill
+        """
+        if self.backfill.running:
+            await ctx.send('A backfill is already running.')
+            return
+        if restart.lower() == 'restart':
+            self.backfill.reset()
+        channels = [channel for channel in ctx.guild.text_channels
+                    if channel.permissions_for(ctx.guild.me).read_message_history]
+        await ctx.send(f'Backfilling XP from {len(channels)} channels, this can take a while...')
+        messages, members = await self.backfill.run(channels)
+        await ctx.send(f'Backfilled {messages} messages that earned XP: XP set for {members} members.')
 
     @commands.command()
     async def add_database(self, ctx, user: discord.Member):
@@ -190,20 +172,13 @@ class userRanking(commands.Cog):
                 ctx: used to access the values passed through the current context
                 user: the discord member to be added
         """
-        with open('./data/participation/users.json', 'r', encoding='utf-8') as file:
-            users = json.load(file)
-        if not str(user.id) in users:
-            users[str(user.id)] = {}
-            users[str(user.id)]['experience'] = 0
-            users[str(user.id)]['level'] = 0
-            users[str(user.id)]['LastMessage'] = await self.to_integer(datetime.now())
+        if not str(user.id) in self.engine.users:
+            record = self.engine.user(user.id, level=0)
+            record['LastMessage'] = await self.to_integer(datetime.now())
             await ctx.send("added to database!")
         else:
             await ctx.send("already in database!")
 
-        with open('./data/participation/users.json', 'w', encoding='utf-8') as file:
-            json.dump(users, file, indent=4)
-
 def setup(bot):
     """
         Adds the cog to the bots list
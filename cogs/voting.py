@@ -3,10 +3,16 @@
 This File contains commands for voting on projects,
 displaying which groups have signed up for which project.
 """
-import csv
-import discord
 from discord.ext import commands
-import os
+from Utility.data_store import store
+from Utility.reply_pages import get_renderer
+from Utility.group_roster import get_roster
+from Utility.project_matching import match_projects, PROJECT_CAPACITY
+from Utility.ledger import ledger, entry, ResourceLocks, VOTE
+
+PROJECTS = "server_data/Project_mapping.csv"
+# group -> projects, most wanted first
+RANKINGS = "server_data/project_rankings.json"
 
 
 class Voting(commands.Cog):
@@ -16,6 +22,32 @@ class Voting(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.project_groups = store.load(PROJECTS)
+        self.rankings = store.load(RANKINGS, default={})
+        # one lock per project and per voting group
+        self.locks = ResourceLocks()
+        # votes the CSV snapshot missed when the bot stopped before it was flushed
+        changed = [self.move_vote(item["NAME"], item["TARGET"]) for item in ledger.replay(VOTE)]
+        if any(changed):
+            store.mark_dirty(PROJECTS)
+
+    def move_vote(self, group: str, project) -> bool:
+        """
+            Makes a group vote for project, or for none when project is None.
+
+            Returns:
+                False if nothing changed.
+        """
+        if project not in self.project_groups:
+            project = None
+        current = next((key for key, groups in self.project_groups.items() if group in groups), None)
+        if current == project:
+            return False
+        if current is not None:
+            self.project_groups[current].remove(group)
+        if project is not None:
+            self.project_groups[project].append(group)
+        return True
 
     @commands.command(name='vote', help='Used for voting for Project 2 and 3, \
     To use the vote command, do: $vote \'Project\' <Num> \n \
@@ -34,10 +66,7 @@ class Voting(commands.Cog):
                 the user is not in a valid group.
 
         """
-        # load the groups from the csv
-        groups = load_groups()
-        # load the projects from the csv
-        projects = load_projects()
+        projects = self.project_groups
 
         # get the arguments for the project to vote on
         project_num = arg.upper() + ' ' + arg2
@@ -45,17 +74,11 @@ class Voting(commands.Cog):
         # get the name of the caller
         member_name = ctx.message.author.display_name.upper()
 
-        # initialize which group the member in in
-        member_group = '-1'
-
         # check which group the member is in
-        for key in groups.keys():
-            if member_name in groups[key]:
-                member_group = key
-                print(member_group)
+        member_group = get_roster().group_of(member_name)
 
         # error handle if member is not in a group
-        if member_group == '-1':
+        if member_group is None:
             await ctx.send(
                 "Could not fine the Group you are in,"
                 " please contact a TA or join with your group number")
@@ -63,23 +86,30 @@ class Voting(commands.Cog):
 
         # if the project is a valid option
         if project_num in projects:
+            async with self.locks.hold(('PROJECT', project_num), ('GROUP', member_group)):
 
-            # check if project has more than 6 groups voting on it
-            if len(projects[project_num]) == 6:
-                await ctx.send('A Project cannot have more than 6 Groups working on it!')
-                return
-
-            # check if you have already voted for another group
-            for key in projects.keys():
-                if member_group in projects[key]:
-                    print(member_group)
-                    await ctx.send('You already voted for ' + key.title())
+                # check if project has more than 6 groups voting on it
+                if len(projects[project_num]) >= PROJECT_CAPACITY:
+                    await ctx.send('A Project cannot have more than 6 Groups working on it!')
                     return
 
-            # add the group to the project list
-            projects[project_num].append(member_group)
+                # check if you have already voted for another group
+                for key in projects.keys():
+                    if member_group in projects[key]:
+                        await ctx.send('You already voted for ' + key.title())
+                        return
+
+                # add the group to the project list, and only confirm once the vote is in the ledger
+                projects[project_num].append(member_group)
+                try:
+                    await ledger.append([entry(VOTE, member_group, project_num)])
+                except OSError:
+                    projects[project_num].remove(member_group)
+                    # a flush during the write may have saved the undone vote
+                    store.mark_dirty(PROJECTS)
+                    raise
+                store.mark_dirty(PROJECTS)
             await ctx.send(member_group + ' has voted for ' + project_num.title() + '!')
-            print_projects(projects)
 
         # error handling
         else:
@@ -96,6 +126,91 @@ class Voting(commands.Cog):
             await ctx.send('To join a group, use the join command, do: $vote \'Project\' <Num> \n \
             ( For example: $vote Project 0 )')
 
+    @commands.command(name='rank-projects', help='Rank the projects your group wants, most wanted first. \
+    To use the rank-projects command, do: $rank-projects <Num> <Num> ... \n \
+    (For example: $rank-projects 3 1 7)', pass_context=True)
+    async def rank_projects(self, ctx, *numbers: str):
+        """
+            records the ranked project preferences of the caller's group, used by $assign-projects.
+
+            Parameters:
+                ctx: used to access the values passed through the current context.
+                numbers: project numbers, most wanted first.
+
+            Returns:
+                confirms the ranking or returns an error if a project is invalid or the user is not
+                in a valid group.
+
+        """
+        member_group = get_roster().group_of(ctx.message.author.display_name.upper())
+        if member_group is None:
+            await ctx.send(
+                "Could not fine the Group you are in,"
+                " please contact a TA or join with your group number")
+            return
+
+        ranking = list(dict.fromkeys('PROJECT ' + number for number in numbers))
+        invalid = [project for project in ranking if project not in self.project_groups]
+        if not ranking or invalid:
+            await ctx.send('Not a valid Project' + (': ' + ', '.join(p.title() for p in invalid) if invalid else ''))
+            await ctx.send('To use the rank-projects command, do: $rank-projects <Num> <Num> ... \n '
+                           '(For example: $rank-projects 3 1 7)')
+            return
+
+        self.rankings[member_group] = ranking
+        store.mark_dirty(RANKINGS, member_group)
+        await ctx.send(member_group.title() + ' ranked ' + ', '.join(p.title() for p in ranking))
+
+    @commands.command(name='assign-projects', help='Instructor only: assign every group that ranked projects \
+    to a project, meeting the rankings as well as possible, ex. $assign-projects', pass_context=True)
+    async def assign_projects(self, ctx):
+        """
+            assigns the groups that ranked projects with an optimal matching and writes
+            Project_mapping.csv once.
+
+            Parameters:
+                ctx: used to access the values passed through the current context.
+
+            Returns:
+                the project of every ranked group.
+
+        """
+        if ctx.channel.name != 'instructor-channel':
+            await ctx.author.send('Command works only in instructor-channel')
+            return
+        if not self.rankings:
+            await ctx.send('No group has ranked projects yet')
+            return
+
+        # the matching reads every project, so no $vote may run until it is in the ledger;
+        # rankings sent meanwhile wait for the next $assign-projects
+        rankings = dict(self.rankings)
+        keys = [('PROJECT', project) for project in self.project_groups] + [('GROUP', group) for group in rankings]
+        async with self.locks.hold(*keys):
+            # ranked groups are matched again from scratch; first-come votes of other groups stay
+            previous = {group: project for project, groups in self.project_groups.items()
+                        for group in groups if group in rankings}
+            for groups in self.project_groups.values():
+                groups[:] = [group for group in groups if group not in rankings]
+            capacities = {project: PROJECT_CAPACITY - len(groups)
+                          for project, groups in self.project_groups.items()}
+            matching = match_projects(rankings, capacities)
+            for group, project in matching.items():
+                self.project_groups[project].append(group)
+            try:
+                await ledger.append([entry(VOTE, group, matching.get(group)) for group in rankings])
+            except OSError:
+                for group in rankings:
+                    self.move_vote(group, previous.get(group))
+                # a flush during the write may have saved the undone matching
+                store.mark_dirty(PROJECTS)
+                raise
+            store.mark_dirty(PROJECTS)
+
+        await get_renderer(self.bot).send(
+            ctx, [group.title() + ': ' + (matching[group].title() if group in matching else 'no project left')
+                  for group in rankings], header='Project assignments:')
+
     @commands.command(name='projects', help='print projects with groups assigned to them',
                       pass_context=True)
     @commands.dm_only()
@@ -110,85 +225,9 @@ class Voting(commands.Cog):
                 prints the list of current projects.
 
         """
-        projects = load_projects()
-        overall = ''
-        for key in projects.keys():
-            if key != 'PROJECT_NUM':
-                s = ''
-                temp = projects[key]
-                for num in temp:
-                    s += num + ', '
-                if s != '':
-                    overall += key + ': ' + s[:-2] + '\n'
-                else:
-                    overall += key + ': \n'
-        await ctx.send(overall)
-
-
-def load_projects() -> dict:
-    """
-        Used to load the Project from the csv file into a dictionary.
-    """
-    dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.chdir(dir)
-    os.chdir('data')
-    os.chdir('server_data')
-    with open('Project_mapping.csv', mode='r') as infile:
-        reader = csv.reader(infile)
-        student_pools = {
-            rows[0].upper(): [rows[1].upper(), rows[2].upper(), rows[3].upper(), rows[4].upper(),
-                              rows[5].upper(), rows[6].upper()] for rows in reader}
-    for key in student_pools.keys():
-        student_pools[key] = list(filter(None, student_pools[key]))
-
-    return student_pools
-
-
-def print_projects(projects):
-    """
-        Used to print the Projects to the csv file.
-    """
-    dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.chdir(dir)
-    os.chdir('data')
-    os.chdir('server_data')
-    with open('Project_mapping.csv', mode='w', newline="") as outfile:
-        writer = csv.writer(outfile)
-        for key in projects.keys():
-            while len(projects[key]) < 6:
-                projects[key].append(None)
-            writer.writerow([key] + projects[key])
-
-
-def load_groups() -> dict:
-    """
-        Used to load the groups from the csv file into a dictionary.
-    """
-    dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    os.chdir(dir)
-    os.chdir('data')
-    os.chdir('server_data')
-    with open('groups.csv', mode='r') as infile:
-        reader = csv.reader(infile)
-        group = {rows[0].upper(): [rows[1].upper(), rows[2].upper(), rows[3].upper(), rows[4].upper(),
-                                   rows[5].upper(), rows[6].upper()] for rows in reader}
-
-    for key in group.keys():
-        group[key] = list(filter(None, group[key]))
-
-    return group
-
-
-def print_groups(group):
-    """
-        Used to print the groups to the csv file.
-    """
-    with open('./data/server_data/groups.csv', mode='w', newline="") as outfile:
-        writer = csv.writer(outfile)
-        for key in group.keys():
-            while len(group[key]) < 6:
-                group[key].append(None)
-            writer.writerow([key] + group[key])
+        await get_renderer(self.bot).send(ctx, [key + ': ' + ', '.join(groups)
+                                                for key, groups in self.project_groups.items()],
+                                          empty='No projects yet')
 
 
 def setup(bot):
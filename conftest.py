@@ -17,7 +17,10 @@ sys.path.append(root_dir)
 # Default parameters for the simulated dpytest bot. Loads the bot with commands from the /cogs directory
 # Ran everytime pytest is called
 @pytest.fixture
-def bot(event_loop):
+def bot(event_loop, tmp_path):
+    # group and vote changes are journaled to a ledger of the test, not data/server_data/ledger.jsonl
+    from Utility.ledger import ledger
+    ledger.path = str(tmp_path / "ledger.jsonl")
     bot = Bot(intents=intents, command_prefix="$", loop=event_loop)
     dir = os.path.dirname(os.path.abspath(__file__))
     os.chdir(dir)
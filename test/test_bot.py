@@ -1,14 +1,41 @@
 # Copyright (c) 2021 War-Keeper
 from asyncio.tasks import sleep
+import asyncio
 import discord
 import discord.ext.test as dpytest
 from discord.utils import get, sleep_until
 import os
 import sys
+import json
+import time
+import smtplib
+import threading
+import tempfile
 from Utility.email_utility import EmailUtility
-from datetime import datetime, timedelta
+from Utility.data_store import DataStore, store, atomic_write, UMASK
+from Utility.sqlite_store import SqliteDataStore, migrate
+from Utility.spam_limiter import SpamLimiter
+from Utility.message_pipeline import MessagePipeline
+from Utility.bot_stats import BotStats, measure
+from Utility.sentiment_model import SentimentModel
+from Utility.scheduler import Scheduler
+from Utility.reminder_index import ReminderIndex
+from Utility.reply_pages import ReplyRenderer, paginate
+from Utility.email_outbox import EmailOutbox, save_attachment
+from Utility.attachment_cache import AttachmentCache
+from Utility.group_roster import GroupRoster
+from Utility.group_formation import form_groups
+from Utility.project_matching import match_projects
+from Utility.ledger import Ledger, ResourceLocks
+from Utility.xp_engine import XPEngine, level_for, xp_to_reach
+from Utility.xp_backfill import XPBackfill
+from Utility.activity_series import ActivitySeries, ActivityTracker, daily
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from aiohttp import web, test_utils
 from dotenv import load_dotenv
 import pytest
+import numpy as np
 
 
 # ------------------------------------------------------------------------------------------------------
@@ -16,6 +43,7 @@ import pytest
 # ------------------------------------------------------------------------------------------------------
 
 VERIFIED_MEMBER_ROLE = os.getenv("VERIFIED_MEMBER_ROLE")
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 # ---------------------------
 # Tests cog/cogMaintenance
@@ -221,6 +249,19 @@ async def test_negative_sentiment(bot):
     await dpytest.message("$sentiment")
     assert dpytest.verify().message().contains().content("NEGATIVE")
 
+@pytest.mark.asyncio
+async def test_mood(bot):
+    channel = dpytest.get_config().channels[0]
+    await dpytest.message("This is a good idea")
+    await dpytest.message(f"$mood {channel.mention} 10")
+    assert dpytest.verify().message().contains().content("POSITIVE: 1")
+    # the second report reuses the cached score
+    cog = bot.get_cog('Sentiment')
+    scored = dict(cog.scores)
+    await dpytest.message(f"$mood {channel.mention} 10")
+    assert dpytest.verify().message().contains().content("POSITIVE: 1")
+    assert cog.scores == scored
+
 
 
 
@@ -282,6 +323,15 @@ async def test_automatic_grouping(bot):
         assert dpytest.verify().message().contains().content("No modifications made. Every Student is part of a Group")
 
 
+# ------------------------------------
+# Tests cogs/groups.py group-preferences
+# ------------------------------------
+@pytest.mark.asyncio
+async def test_group_preferences(bot):
+    await dpytest.message("$group-preferences colours red")
+    assert dpytest.verify().message().contains().content('To use the group-preferences command')
+
+
 # ------------------------------------
 #Tests cogs/groups.py find-group
 # # ------------------------------------
@@ -295,6 +345,113 @@ async def test_find_group(bot):
             assert dpytest.verify().message().contains().content('To use the find-group command, do: $find-group <StudentName> \n \
                 ( For example: $find-group Jane Doe )')
 
+# ------------------------------
+# Tests Utility/group_roster
+# ------------------------------
+def test_group_roster(tmp_path):
+    os.makedirs(tmp_path / 'server_data')
+    (tmp_path / 'server_data' / 'groups.csv').write_text(
+        'GROUP_NUM,NAME 1,NAME 2,NAME 3,NAME 4,NAME 5,NAME 6\nGROUP 1,JANE,,,,,\nGROUP 2,,,,,,\n')
+    (tmp_path / 'server_data' / 'name_mapping.csv').write_text(
+        'USERNAME,REALNAME,GROUP_NUM\nJANE,Jane Doe,GROUP 1\nJOHN,John Roe,-1\n')
+    data_store = DataStore(str(tmp_path))
+    journal = Ledger(str(tmp_path / 'ledger.jsonl'), fsync=False)
+    roster = GroupRoster(data_store, journal)
+    assert roster.group_of('JANE') == 'GROUP 1'
+    assert roster.find_student('john roe') == 'JOHN'
+    roster.join('JOHN', 'GROUP 2')
+    assert roster.student_group('JOHN') == 'GROUP 2'
+    assert roster.leave('JANE') == 'GROUP 1' and roster.group_of('JANE') is None
+    roster.add_student('Max', 'Max Mustermann')
+    roster.remove_student('John Roe')
+    assert roster.find_student('JOHN') is None and roster.groups['GROUP 2'] == []
+    data_store.flush()
+    reloaded = GroupRoster(DataStore(str(tmp_path)), journal)
+    assert reloaded.students == {'JANE': ['Jane Doe', '-1'], 'Max': ['Max Mustermann', '-1']}
+    assert reloaded.groups == {'GROUP 1': [], 'GROUP 2': []}
+
+
+def test_group_auto_assign(tmp_path):
+    os.makedirs(tmp_path / 'server_data')
+    (tmp_path / 'server_data' / 'groups.csv').write_text(
+        'GROUP_NUM,NAME 1,NAME 2,NAME 3,NAME 4,NAME 5,NAME 6\n'
+        'GROUP 1,A,B,,,,\nGROUP 2,C,D,E,F,G,H\nGROUP 3,I,,,,,\n')
+    (tmp_path / 'server_data' / 'name_mapping.csv').write_text(
+        'USERNAME,REALNAME,GROUP_NUM\n' + ''.join('S{},Student {},-1\n'.format(n, n) for n in range(10)))
+    roster = GroupRoster(DataStore(str(tmp_path)), Ledger(str(tmp_path / 'ledger.jsonl'), fsync=False))
+    assignments = roster.auto_assign()
+    # the emptiest group is filled first, full groups are skipped, ties go to the first group
+    assert list(assignments.values())[:3] == ['GROUP 3', 'GROUP 1', 'GROUP 3']
+    assert len(assignments) == 9 and 'S9' not in assignments
+    assert [len(roster.groups[g]) for g in ('GROUP 1', 'GROUP 2', 'GROUP 3')] == [6, 6, 6]
+    assert roster.auto_assign() == {}
+
+
+@pytest.mark.asyncio
+async def test_ledger(tmp_path):
+    os.makedirs(tmp_path / 'server_data')
+    (tmp_path / 'server_data' / 'groups.csv').write_text('GROUP_NUM,NAME 1\nGROUP 1,\nGROUP 2,\n')
+    (tmp_path / 'server_data' / 'name_mapping.csv').write_text('USERNAME,REALNAME,GROUP_NUM\nJANE,Jane Doe,-1\n')
+    journal = Ledger(str(tmp_path / 'ledger.jsonl'), fsync=False)
+    roster = GroupRoster(DataStore(str(tmp_path), flush_delay=60), journal)
+    roster.join('JANE', 'GROUP 1', save=False)
+    await roster.commit()
+    roster.leave('JANE', save=False)
+    roster.join('JANE', 'GROUP 2', save=False)
+    await roster.commit()
+    # the bot stops before the CSV snapshots are flushed: the ledger brings the changes back
+    restarted = GroupRoster(DataStore(str(tmp_path)), journal)
+    assert restarted.group_of('JANE') == 'GROUP 2' and restarted.student_group('JANE') == 'GROUP 2'
+    assert restarted.groups['GROUP 1'] == []
+    # once the snapshots are flushed, the checkpoint drops the entries they hold
+    restarted.store.flush_hooks.append(journal.checkpoint)
+    restarted.store.flush()
+    await asyncio.get_running_loop().run_in_executor(journal.executor, lambda: None)
+    assert (tmp_path / 'ledger.jsonl').read_text() == ''
+    assert GroupRoster(DataStore(str(tmp_path)), journal).group_of('JANE') == 'GROUP 2'
+
+    # a change whose ledger write fails is undone instead of confirmed
+    broken = GroupRoster(DataStore(str(tmp_path)), Ledger(str(tmp_path / 'ledger.jsonl' / 'broken'), fsync=False))
+    broken.leave('JANE', save=False)
+    broken.join('JANE', 'GROUP 1', save=False)
+    with pytest.raises(OSError):
+        await broken.commit()
+    assert broken.group_of('JANE') == 'GROUP 2' and broken.student_group('JANE') == 'GROUP 2'
+    assert broken.groups == {'GROUP 1': [], 'GROUP 2': ['JANE']}
+    # and written again, in case a flush saved it while the write was awaited
+    assert broken.store.dirty == {'server_data/groups.csv', 'server_data/name_mapping.csv'}
+
+    # commands on the same resource run one after the other, other resources do not wait
+    locks, order = ResourceLocks(), []
+
+    async def command(name, *keys):
+        async with locks.hold(*keys):
+            order.append(name + ' start')
+            await asyncio.sleep(0.01)
+            order.append(name + ' end')
+    await asyncio.gather(command('a', 'GROUP 1'), command('b', 'GROUP 1'), command('c', 'GROUP 2'))
+    assert order.index('a end') < order.index('b start')
+    assert order.index('c start') < order.index('a end')
+    assert not locks.locks
+
+
+def test_group_formation():
+    students = ['P{}'.format(n) for n in range(24)]
+    # P0 and P1 want each other, P2 wants a member already in GROUP 1
+    preferences = {'P0': {'TEAMMATES': ['P1']}, 'P1': {'TEAMMATES': ['P0']}, 'P2': {'TEAMMATES': ['JANE']}}
+    for n in range(4, 24):
+        preferences['P{}'.format(n)] = {'SLOTS': ['MON' if n % 2 else 'WED']}
+    groups = {'GROUP 1': ['JANE'], 'GROUP 2': [], 'GROUP 3': [], 'GROUP 4': [], 'GROUP 5': []}
+    assignments = form_groups(students, groups, preferences, 6)
+    assert len(assignments) == 24
+    assert assignments['P0'] == assignments['P1']
+    assert assignments['P2'] == 'GROUP 1'
+    sizes = [list(assignments.values()).count(group) + len(groups[group]) for group in groups]
+    assert max(sizes) - min(sizes) <= 1 and max(sizes) <= 6
+    # groups that are full take nobody
+    assert form_groups(['P0'], {'GROUP 1': ['A', 'B', 'C', 'D', 'E', 'F']}, {}, 6) == {}
+
+
 # -----------------------
 # Tests cogs/deadline.py
 # -----------------------
@@ -341,9 +498,9 @@ async def test_listreminders(bot):
     assert dpytest.verify().message().contains().content(
         "A date has been added for: CSC510 homework named: HW1 which is due on: 2050-12-21 19:59:00")
     await dpytest.message("$listreminders")
-    assert dpytest.verify().message().contains().content(
-        "CSC505 homework named: DANCE which is due on: 2050-09-21 10:00:00")
-    assert dpytest.verify().message().contains().content(
+    # both reminders arrive in one message, soonest first
+    listing = dpytest.get_message().content
+    assert listing.index("CSC505 homework named: DANCE which is due on: 2050-09-21 10:00:00") < listing.index(
         "CSC510 homework named: HW1 which is due on: 2050-12-21 19:59:00")
     # Test $coursedue
     await dpytest.message("$coursedue CSC505")
@@ -372,10 +529,73 @@ async def test_duethisweek(bot):
     # Check to see that the reminder is due this week
     await dpytest.message("$duethisweek")
     assert dpytest.verify().message().contains().content("CSC600 HW0 is due this week")
+    # homeworks that are already overdue are not due this week
+    cog = bot.get_cog('Deadline')
+    cog.index.get('CSC600', 'HW0')["FUTURE"] = 0
+    cog.index = ReminderIndex(cog.reminders)
+    await dpytest.message("$duethisweek")
+    assert dpytest.verify().message().nothing()
     # Clear reminders at the end of testing since we're using a local JSON file to store them
     await dpytest.message("$clearreminders")
     assert dpytest.verify().message().contains().content("All reminders have been cleared..!!")
 
+
+# ------------------------------
+# Tests the daily deadline digest
+# ------------------------------
+@pytest.mark.asyncio
+async def test_deadline_digest(bot, monkeypatch, tmp_path):
+    queued = []
+    deadline = sys.modules['cogs.deadline']
+    monkeypatch.setattr(deadline.outbox, 'enqueue_many', queued.extend)
+    # the configured addresses come from a temp store, not the shared email/emails.json
+    data_store = DataStore(str(tmp_path))
+    data_store.load('email/emails.json').update({'1': 'student@example.com', '2': 'other@example.com'})
+    monkeypatch.setattr(deadline, 'store', data_store)
+    cog = bot.get_cog('Deadline')
+    cog.notify_channel = bot.guilds[0].text_channels[0]
+    await cog.notify_reminders([{"COURSE": "CSC510", "HOMEWORK": "HW1", "DUEDATE": "2050-12-21 18:00:00"},
+                                {"COURSE": "CSC505", "HOMEWORK": "HW2", "DUEDATE": "2050-12-21 19:59:00"}])
+    assert dpytest.verify().message().contains().content("CSC505 HW2 is due today at 19:59:00")
+    # one email per address, listing both homeworks
+    assert len(queued) == 2
+    address, _, body = next(email for email in queued if email[0] == 'student@example.com')
+    assert "CSC510 HW1 is due today at 18:00:00" in body and "CSC505 HW2" in body
+
+
+# ------------------------------
+# Tests Utility/reminder_index
+# ------------------------------
+def test_reminder_index():
+    def hw(course, name, due):
+        return {"COURSE": course, "HOMEWORK": name, "FUTURE": due}
+    index = ReminderIndex([hw('CSC510', 'HW2', 30), hw('CSC505', 'HW1', 10), hw('CSC510', 'HW1', 20)])
+    assert [r["HOMEWORK"] for r in index.due_between()] == ['HW1', 'HW1', 'HW2']
+    assert [r["FUTURE"] for r in index.due_between(15, 30)] == [20]
+    assert [r["FUTURE"] for r in index.course_due('CSC510', 25)] == [30]
+    # moving a homework keeps both indexes sorted
+    moved = index.remove('CSC510', 'HW2')
+    moved["FUTURE"] = 5
+    index.add(moved)
+    assert [r["FUTURE"] for r in index.due_between()] == [5, 10, 20]
+    assert [r["HOMEWORK"] for r in index.course_due('CSC510')] == ['HW2', 'HW1']
+    assert index.remove('CSC999', 'HW1') is None
+    assert index.course_due('CSC999') == []
+
+
+# ------------------------------
+# Tests personal reminders
+# ------------------------------
+@pytest.mark.asyncio
+async def test_remindme(bot):
+    await dpytest.message("$remindme 1 second Submit the project")
+    assert dpytest.verify().message().content("I will remind you that in 1 second.")
+    cog = bot.get_cog('Deadline')
+    assert len(cog.personal_reminders) == 1
+    await asyncio.sleep(1.5)
+    assert dpytest.verify().message().contains().content("Reminder : Submit the project")
+    assert not cog.personal_reminders
+
     
 # --------------------
 # Tests cogs/pinning
@@ -512,17 +732,563 @@ async def test_voting(bot):
             "Could not fine the Group you are in, please contact a TA or join with your group number")
 
 
+@pytest.mark.asyncio
+async def test_rank_projects(bot, monkeypatch, tmp_path):
+    # Ranking projects also needs a group; the roster is an empty one under tmp_path
+    roster = GroupRoster(DataStore(str(tmp_path)), Ledger(str(tmp_path / 'ledger.jsonl'), fsync=False))
+    monkeypatch.setattr(sys.modules['cogs.voting'], 'get_roster', lambda: roster)
+    await dpytest.empty_queue()
+    await dpytest.message(content="$rank-projects 3 1")
+    assert dpytest.verify().message().contains().content("Could not fine the Group you are in")
+
+
+@pytest.mark.asyncio
+async def test_assign_projects(bot, monkeypatch, tmp_path):
+    # projects are assigned from the rankings and written to a Project_mapping.csv under tmp_path
+    (tmp_path / 'server_data').mkdir()
+    (tmp_path / 'server_data' / 'Project_mapping.csv').write_text(
+        'PROJECT_NUM,GROUP_NUMBER 1,GROUP_NUMBER 2\nPROJECT 1,,\nPROJECT 2,,\n')
+    voting = sys.modules['cogs.voting']
+    data_store = DataStore(str(tmp_path))
+    monkeypatch.setattr(voting, 'store', data_store)
+    cog = bot.get_cog('Voting')
+    monkeypatch.setattr(cog, 'project_groups', data_store.load(voting.PROJECTS))
+    monkeypatch.setattr(cog, 'rankings', {'GROUP 1': ['PROJECT 1'], 'GROUP 2': ['PROJECT 2', 'PROJECT 1']})
+    channel = await bot.guilds[0].create_text_channel('instructor-channel')
+    await dpytest.empty_queue()
+    await dpytest.message(content="$assign-projects", channel=channel)
+    assert dpytest.verify().message().contains().content("Group 1: Project 1\nGroup 2: Project 2")
+    data_store.flush()
+    assert DataStore(str(tmp_path)).load(voting.PROJECTS) == {'PROJECT 1': ['GROUP 1'], 'PROJECT 2': ['GROUP 2']}
+
+
+# ------------------------------
+# Tests Utility/project_matching
+# ------------------------------
+def test_project_matching():
+    # everyone wants PROJECT 1, which takes one group; the matching keeps the total rank lowest
+    rankings = {'GROUP 1': ['PROJECT 1', 'PROJECT 2'], 'GROUP 2': ['PROJECT 1'],
+                'GROUP 3': ['PROJECT 1', 'PROJECT 3']}
+    capacities = {'PROJECT 1': 1, 'PROJECT 2': 1, 'PROJECT 3': 1}
+    assert match_projects(rankings, capacities) == {'GROUP 1': 'PROJECT 2', 'GROUP 2': 'PROJECT 1',
+                                                    'GROUP 3': 'PROJECT 3'}
+    # capacity is respected and unranked projects are a last resort
+    matching = match_projects({'GROUP {}'.format(n): ['PROJECT 1'] for n in range(4)},
+                              {'PROJECT 1': 2, 'PROJECT 2': 1})
+    assert list(matching.values()).count('PROJECT 1') == 2 and len(matching) == 3
+    assert match_projects({'GROUP 1': ['PROJECT 1']}, {'PROJECT 1': 0}) == {}
+
+
 # ---------------------------
 # Tests Utility/email_utility
 # ---------------------------
 @pytest.mark.asyncio
-async def test_email_utility(bot):
-    # Test email utility negative cases.
-    # Test email utility by providing just recipient email address.
-    with pytest.raises(Exception):
-        EmailUtility().send_email('noreplyclassmatebot@example.com')
-    # Test email utility by providing just recipient email address and attachment.
-    with pytest.raises(Exception):
-        with open('data/email/emails.json') as file:
-            EmailUtility().send_email('noreplyclassmatebot@example.com', attachment=file.read())
-            
+async def test_email_utility(tmp_path):
+    # Emails are only queued; the outbox worker sends them through a stand-in SMTP session
+    sent = []
+
+    class LocalSMTP:
+        def sendmail(self, sender, recipients, message):
+            sent.append((recipients, message))
+
+        def quit(self):
+            pass
+
+    data_store = DataStore(str(tmp_path))
+    mail_outbox = EmailOutbox(connect=LocalSMTP, workers=1, data_store=data_store,
+                              attachment_dir=str(tmp_path / 'attachments'))
+    email_id = EmailUtility(mail_outbox).send_email('noreplyclassmatebot@example.com')
+    assert mail_outbox.entries[email_id]['TO'] == ['noreplyclassmatebot@example.com']
+    assert mail_outbox.entries[email_id]['SUBJECT'] == 'CLASSMATE BOT NOTIFICATION'
+    # an attachment is stored encoded in the outbox's own folder
+    email_id = EmailUtility(mail_outbox).send_email('noreplyclassmatebot@example.com', attachment=b'hello',
+                                                    filename='notes.txt')
+    [(filename, path)] = mail_outbox.entries[email_id]['ATTACHMENTS']
+    assert filename == 'notes.txt' and os.path.dirname(path) == str(tmp_path / 'attachments')
+    for _ in range(100):
+        if not mail_outbox.pending():
+            break
+        await asyncio.sleep(0.02)
+    mail_outbox.stop()
+    assert len(sent) == 2 and 'aGVsbG8=' in sent[1][1]
+    data_store.flush()
+    assert json.loads((tmp_path / 'email' / 'outbox.json').read_text()) == {}
+
+
+# ---------------------------
+# Tests Utility/xp_engine
+# ---------------------------
+@pytest.mark.asyncio
+async def test_xp_engine(tmp_path):
+    data_store = DataStore(str(tmp_path), flush_delay=60)
+    engine = XPEngine(data_store, flush_interval=0.1)
+    # level 1 needs 155 experience: the 11th message levels up, nothing is written yet
+    levels = [engine.award(42) for _ in range(11)]
+    assert levels == [None] * 10 + [2]
+    assert engine.users['42'] == {'experience': 10, 'level': 2}
+    assert not (tmp_path / 'participation' / 'users.json').exists()
+    # a large award levels up several times at once
+    assert engine.award(7, 1000) == 4 and engine.users['7']['experience'] == 1000 - 155 - 220 - 295
+    await asyncio.sleep(0.2)
+    assert json.loads((tmp_path / 'participation' / 'users.json').read_text()) == engine.users
+
+
+def test_xp_leaderboard(tmp_path):
+    data_store = DataStore(str(tmp_path))
+    engine = XPEngine(data_store)
+    for user_id, (level, experience) in enumerate([(1, 50), (3, 10), (2, 90), (3, 40)]):
+        engine.users[str(user_id)] = {'experience': experience, 'level': level}
+    engine.rebuild()
+    assert [user_id for user_id, _ in engine.top(2)] == ['3', '1']
+    assert engine.rank(0) == 4 and engine.rank(3) == 1
+    # the cached page is kept while changes happen below it
+    page = engine.top(2)
+    engine.award(0, 15)
+    assert engine.top(2) is page
+    # and rebuilt once someone gets onto it
+    engine.award(2, 200)
+    assert [user_id for user_id, _ in engine.top(2)] == ['2', '3'] and engine.rank(1) == 3
+
+
+def test_xp_cooldown(tmp_path):
+    data_store = DataStore(str(tmp_path))
+    engine = XPEngine(data_store, cooldown=60)
+    # only the first message of a burst earns XP; later messages do not even mark the user dirty
+    engine.message(42, now=1000)
+    engine.flush()
+    for now in (1001, 1030, 1059.9):
+        engine.message(42, now=now)
+    assert engine.users['42']['experience'] == 15 and not engine.dirty
+    # the window counts from the last award, per user
+    engine.message(7, now=1030)
+    engine.message(42, now=1060)
+    assert engine.users['42']['experience'] == 30 and engine.users['7']['experience'] == 15
+
+
+def test_level_for():
+    # the closed-form inverse agrees with levelling up one step at a time
+    for total in list(range(0, 3000, 7)) + [10 ** 6, 10 ** 9]:
+        level, experience = level_for(total)
+        assert xp_to_reach(level) + experience == total
+        assert 0 <= experience < 5 * level ** 2 + 50 * level + 100
+
+
+@pytest.mark.asyncio
+async def test_xp_backfill(tmp_path):
+    data_store = DataStore(str(tmp_path), flush_delay=60)
+    engine = XPEngine(data_store)
+    backfill = XPBackfill(engine, data_store, concurrency=2, checkpoint_every=2, cooldown=60, page_size=2)
+    start = datetime(2021, 1, 1)
+
+    def channel(channel_id, authors, fail_at=None, spacing=60):
+        # like snowflakes, message ids grow with the time the message was sent
+        messages = [SimpleNamespace(id=spacing * n * 100 + channel_id, created_at=start + timedelta(seconds=spacing * n),
+                                    author=SimpleNamespace(id=author, bot=author == 0))
+                    for n, author in enumerate(authors)]
+
+        async def history(limit, after, **kwargs):
+            after = after.id if after else -1
+            for message in [m for m in messages if m.id > after][:limit]:
+                if messages.index(message) == fail_at:
+                    raise ConnectionError
+                yield message
+        return SimpleNamespace(id=channel_id, history=history)
+
+    # the connection drops when channel 1's second page is fetched
+    with pytest.raises(ConnectionError):
+        await backfill.run([channel(1, [1, 1, 2, 0, 1], fail_at=3), channel(2, [2] * 20, spacing=10)])
+    # messages are walked in the order they were sent, so channel 2 stopped at its last message
+    # sent before the end of channel 1's first page
+    assert backfill.state['CHANNELS'] == {'1': 6001, '2': 5002} and backfill.state['DONE'] == []
+    # the checkpoint only keeps counts and the last award of each author; user 2's burst in
+    # channel 2 earned a single award so far
+    assert backfill.state['AWARDS'] == {'1': 2, '2': 1}
+    assert backfill.state['LAST'] == {'1': start.replace(tzinfo=timezone.utc).timestamp() + 60,
+                                      '2': start.replace(tzinfo=timezone.utc).timestamp()}
+    # XP earned live meanwhile is kept; the resumed run walks no message twice, and user 2's
+    # messages across both channels earn one award per minute
+    engine.award(1, 15)
+    assert await backfill.run([channel(1, [1, 1, 2, 0, 1]), channel(2, [2] * 20, spacing=10)]) == (7, 2)
+    assert engine.users['1'] == {'experience': 60, 'level': 1}
+    assert engine.users['2'] == {'experience': 60, 'level': 1}
+    assert json.loads((tmp_path / 'participation' / 'users.json').read_text()) == engine.users
+    assert backfill.state == {}
+
+
+def test_activity_series(tmp_path):
+    hour = 3600 * 1000
+    tracker = ActivityTracker(str(tmp_path / 'activity.npz'), buckets=48)
+    tracker.record(1, 10, hour)
+    tracker.record(1, 10, hour + 60)
+    tracker.record(2, 11, hour + 3600)
+    assert tracker.users.series('1', 3, hour + 3600).tolist() == [0, 2, 0]
+    assert tracker.channels.total(3, hour + 3600).tolist() == [0, 2, 1]
+    assert tracker.users.series('3', 3, hour + 3600).tolist() == [0, 0, 0]
+    # the ring keeps 48 hours: older buckets are cleared as it turns, older messages are dropped
+    assert tracker.users.series('1', 48, hour + 48 * 3600).sum() == 0
+    assert tracker.users.series('2', 48, hour + 48 * 3600).sum() == 1
+    tracker.record(1, 10, hour)
+    assert tracker.users.total(48, hour + 48 * 3600).sum() == 1
+    # memory grows with the keys, not the messages
+    series = ActivitySeries(24)
+    for n in range(10000):
+        series.add(str(n % 20), hour + n)
+    assert series.counts.shape == (32, 24) and series.total(24, hour + 10000).sum() == 10000
+    # a fresh tracker reads back what was saved
+    tracker.save()
+    assert ActivityTracker(tracker.path, buckets=48).users.total(48, hour + 48 * 3600).tolist() == \
+        tracker.users.total(48, hour + 48 * 3600).tolist()
+    # hourly counts are summed into UTC days, the first and last day only partly covered
+    hourly = np.arange(1, 31)
+    assert daily(hourly, 24 * 1000 + 5).tolist() == [hourly[:24].sum(), hourly[24:].sum()]
+    assert daily(hourly, 24 * 1000 + 9).tolist() == [hourly[:20].sum(), hourly[20:].sum()]
+
+
+@pytest.mark.asyncio
+async def test_activity_save(tmp_path):
+    # while the bot runs, recorded messages are saved after save_interval instead of only at exit
+    tracker = ActivityTracker(str(tmp_path / 'activity.npz'), buckets=48, save_interval=0.05)
+    tracker.record(1, 10)
+    tracker.record(2, 10)
+    assert not os.path.exists(tracker.path)
+    await asyncio.sleep(0.2)
+    assert ActivityTracker(tracker.path, buckets=48).channels.total(1).tolist() == [2]
+
+
+@pytest.mark.asyncio
+async def test_leaderboard(bot, tmp_path):
+    # the cog ranks users from a temp store instead of participation/users.json
+    engine = XPEngine(DataStore(str(tmp_path)))
+    engine.award(1, 200)
+    engine.award(2, 15)
+    bot.get_cog('userRanking').engine = engine
+    await dpytest.empty_queue()
+    await dpytest.message("$leaderboard 5")
+    assert dpytest.verify().message().contains().content("Leaderboard**\n1. User 1 - level 2 (45 XP)")
+
+
+# ---------------------------
+# Tests Utility/data_store
+# ---------------------------
+@pytest.mark.asyncio
+async def test_data_store(tmp_path):
+    # Mutations stay in memory until the debounced flush writes them atomically
+    data_store = DataStore(str(tmp_path), flush_delay=0.1)
+    users = data_store.load('participation/users.json', indent=4)
+    users['1'] = {'experience': 15, 'level': 1}
+    data_store.mark_dirty('participation/users.json', '1')
+    assert not (tmp_path / 'participation' / 'users.json').exists()
+    await sleep(0.3)
+    assert json.loads((tmp_path / 'participation' / 'users.json').read_text()) == users
+    assert not list((tmp_path / 'participation').glob('.tmp-*'))
+    # A fresh store reads back what was flushed
+    assert DataStore(str(tmp_path)).load('participation/users.json') == users
+    # The file got the permissions of a new file and keeps its own across rewrites
+    path = tmp_path / 'participation' / 'users.json'
+    assert path.stat().st_mode & 0o777 == 0o666 & ~UMASK
+    path.chmod(0o640)
+    atomic_write(str(path), '{}')
+    assert path.stat().st_mode & 0o777 == 0o640 and path.read_text() == '{}'
+
+
+# ---------------------------
+# Tests Utility/sqlite_store
+# ---------------------------
+def test_sqlite_store(tmp_path):
+    # Migrating data files gives back the same datasets from the database
+    data_dir = tmp_path / 'data'
+    (data_dir / 'participation').mkdir(parents=True)
+    (data_dir / 'server_data').mkdir()
+    (data_dir / 'participation' / 'users.json').write_text(json.dumps({'1': {'experience': 15, 'level': 2}}))
+    (data_dir / 'server_data' / 'groups.csv').write_text(
+        'GROUP_NUM,NAME 1,NAME 2,NAME 3,NAME 4,NAME 5,NAME 6\nGROUP 1,,,,,,\nGROUP 2,ANN,BOB,,,,\n')
+    # a missing real name keeps its column, so the group does not shift into its place
+    (data_dir / 'server_data' / 'name_mapping.csv').write_text('USERNAME,REALNAME,GROUP_NUM\nann,,GROUP 2\n')
+    data_dir = str(data_dir)
+    db_path = str(tmp_path / 'classmate.db')
+    migrate(data_dir, db_path)
+    database = SqliteDataStore(db_path)
+    files = DataStore(data_dir)
+    for name in ('participation/users.json', 'server_data/groups.csv', 'server_data/name_mapping.csv'):
+        assert database.load(name) == files.load(name)
+    assert files.load('server_data/name_mapping.csv') == {'ann': ['', 'GROUP 2']}
+    # Only the changed row is rewritten and it survives a reopen
+    database.load('server_data/groups.csv')['GROUP 1'].append('JANE DOE')
+    database.dirty.add('server_data/groups.csv')
+    database.flush()
+    assert SqliteDataStore(db_path).load('server_data/groups.csv')['GROUP 1'] == ['JANE DOE']
+
+
+# ---------------------------
+# Tests Utility/spam_limiter
+# ---------------------------
+def test_spam_limiter():
+    now = [0.0]
+    limiter = SpamLimiter(max_messages=4, window=10, clock=lambda: now[0])
+    # Four messages in the window are fine, the fifth flags all of them
+    for message_id in range(4):
+        assert limiter.hit(1, 100, message_id) == {}
+    assert limiter.hit(2, 100, 50) == {}
+    assert limiter.hit(1, 101, 4) == {100: [0, 1, 2, 3], 101: [4]}
+    # Messages older than the window no longer count
+    for message_id in range(4):
+        assert limiter.hit(1, 100, message_id) == {}
+    now[0] = 11.0
+    assert limiter.hit(1, 100, 5) == {}
+    # Users whose window is empty are forgotten, so only recently active users are kept
+    now[0] = 30.0
+    assert limiter.hit(3, 100, 6) == {}
+    assert list(limiter.logs) == [3]
+
+
+# ---------------------------
+# Tests Utility/message_pipeline
+# ---------------------------
+@pytest.mark.asyncio
+async def test_message_pipeline():
+    pipeline = MessagePipeline()
+    seen = []
+
+    async def first(context):
+        seen.append(('first', context.urls, context.tokens))
+        if 'stop' in context.tokens:
+            context.stop()
+
+    async def second(context):
+        seen.append(('second', context.urls))
+
+    # Stages run by order, not by registration, and share the parsed facts
+    pipeline.add_stage('second', second, 20)
+    pipeline.add_stage('first', first, 10)
+    message = SimpleNamespace(content='See www.google.com now', author=SimpleNamespace(roles=[]))
+    await pipeline.run(message)
+    assert seen == [('first', ['www.google.com'], ['see', 'www', 'google', 'com', 'now']),
+                    ('second', ['www.google.com'])]
+    # A stage can stop the rest
+    seen.clear()
+    await pipeline.run(SimpleNamespace(content='Stop here', author=SimpleNamespace(roles=[])))
+    assert [stage[0] for stage in seen] == ['first']
+    assert pipeline.stats.handlers['stage first'].calls == 2
+    assert pipeline.stats.handlers['stage second'].calls == 1
+
+
+# ---------------------------
+# Tests Utility/bot_stats
+# ---------------------------
+@pytest.mark.asyncio
+async def test_bot_stats():
+    stats = BotStats()
+
+    async def handler(fail):
+        await sleep(0.05)
+        if fail:
+            raise ValueError('failed')
+
+    await measure(stats, 'handler', handler(False))
+    with pytest.raises(ValueError):
+        await measure(stats, 'handler', handler(True))
+    summary = stats.report()['handler']
+    assert summary['calls'] == 2 and summary['errors'] == 1
+    # Awaited time counts towards wall time but not towards loop blocking time
+    assert summary['wall_p50_ms'] >= 40
+    assert summary['blocking_p99_ms'] < 40
+
+
+# ---------------------------
+# Tests Utility/sentiment_model
+# ---------------------------
+@pytest.mark.asyncio
+async def test_sentiment_batching():
+    # Concurrent requests are answered by as few predict calls as the batch size allows
+    model = SentimentModel(batch_size=4)
+    model.state = 'ready'
+    batches = []
+    model._predict = lambda texts: batches.append(list(texts)) or [text.upper() for text in texts]
+    results = await asyncio.gather(*(model.predict(text) for text in 'abcdef'))
+    assert results == ['A', 'B', 'C', 'D', 'E', 'F']
+    assert batches == [['a', 'b', 'c', 'd'], ['e', 'f']]
+
+
+# ---------------------------
+# Tests Utility/scheduler
+# ---------------------------
+@pytest.mark.asyncio
+async def test_scheduler():
+    fired = []
+
+    def job(name):
+        async def run():
+            fired.append(name)
+        return run
+
+    scheduler = Scheduler()
+    scheduler.start()
+    now = time.time()
+    scheduler.schedule('late', now + 0.2, job('late'))
+    scheduler.schedule('early', now + 0.05, job('early'))
+    scheduler.schedule('cancelled', now + 0.01, job('cancelled'))
+    assert scheduler.cancel('cancelled')
+    # replacing a job moves it
+    scheduler.schedule('late', now + 0.1, job('moved'))
+    await asyncio.sleep(0.3)
+    assert fired == ['early', 'moved']
+    assert len(scheduler) == 0 and scheduler.next_time() is None
+    scheduler.stop()
+
+
+# ---------------------------
+# Tests Utility/reply_pages
+# ---------------------------
+@pytest.mark.asyncio
+async def test_reply_pages():
+    assert paginate(['a' * 5, 'b' * 5, 'c' * 5], limit=11) == ['aaaaa\nbbbbb', 'ccccc']
+    assert paginate(['x' * 12], limit=5) == ['xxxxx', 'xxxxx', 'xx']
+
+    sent = []
+
+    class Destination:
+        async def send(self, content):
+            message = SimpleNamespace(id=len(sent), content=content, reactions=[])
+
+            async def add_reaction(emoji):
+                message.reactions.append(emoji)
+            message.add_reaction = add_reaction
+            sent.append(message)
+            return message
+
+    renderer = ReplyRenderer(bot=None)
+    assert await renderer.send(Destination(), [], empty='nothing') is sent[0]
+    await renderer.send(Destination(), ['row %d' % i for i in range(500)], header='Rows:')
+    # one message for the whole list, with its pages cached for flipping
+    assert len(sent) == 2
+    pages, current = renderer.books[sent[1].id]
+    assert current == 0 and len(pages) > 1 and all(page.startswith('Rows:') for page in pages)
+    assert sent[1].content.endswith('*Page 1/%d*' % len(pages))
+    assert len(sent[1].reactions) == 2
+
+
+# ---------------------------
+# Tests Utility/email_outbox
+# ---------------------------
+@pytest.mark.asyncio
+async def test_email_outbox(tmp_path):
+    sent = []
+    refuse_once = {'flaky@example.com'}
+
+    class LocalSMTP:
+        # stands in for the SMTP server, counting the sessions opened
+        sessions = 0
+
+        def __init__(self):
+            LocalSMTP.sessions += 1
+
+        def sendmail(self, sender, recipients, message):
+            if recipients[0] in refuse_once:
+                refuse_once.remove(recipients[0])
+                raise smtplib.SMTPRecipientsRefused({recipients[0]: (450, b'try again')})
+            sent.append((recipients, message))
+
+        def quit(self):
+            pass
+
+    attachment_dir = str(tmp_path / 'attachments')
+    outbox = EmailOutbox(connect=LocalSMTP, workers=1, retry_delay=0.05, data_store=DataStore(str(tmp_path)),
+                         attachment_dir=attachment_dir)
+    attachment = save_attachment(b'hello', directory=attachment_dir)
+    outbox.enqueue('student@example.com', 'Notes', 'see attached', [('notes.txt', attachment)])
+    outbox.enqueue('flaky@example.com', 'Notes', 'retried')
+    for _ in range(100):
+        if not outbox.pending():
+            break
+        await asyncio.sleep(0.02)
+    outbox.stop()
+    assert sorted(recipients[0] for recipients, _ in sent) == ['flaky@example.com', 'student@example.com']
+    # the session is kept open across emails and the retry
+    assert LocalSMTP.sessions == 1
+    assert 'aGVsbG8=' in sent[0][1]
+    assert not os.path.exists(attachment)
+
+
+@pytest.mark.asyncio
+async def test_email_outbox_restart(tmp_path):
+    sent = []
+    release = threading.Event()
+
+    class SlowSMTP:
+        # holds the first email until released, as a slow server would
+        def sendmail(self, sender, recipients, message):
+            release.wait(5)
+            sent.append(recipients)
+
+        def quit(self):
+            pass
+
+    outbox = EmailOutbox(connect=SlowSMTP, workers=1, data_store=DataStore(str(tmp_path)))
+    outbox.enqueue('first@example.com', 'Notes', 'in flight')
+    await asyncio.sleep(0.05)
+    outbox.enqueue('second@example.com', 'Notes', 'still queued')
+    # restarting while the first email is being sent queues the second again, not the first
+    outbox.stop()
+    outbox.start()
+    release.set()
+    for _ in range(100):
+        if not outbox.pending():
+            break
+        await asyncio.sleep(0.02)
+    outbox.stop()
+    assert sorted(recipients[0] for recipients in sent) == ['first@example.com', 'second@example.com']
+
+
+# ------------------------------
+# Tests Utility/attachment_cache
+# ------------------------------
+@pytest.mark.asyncio
+async def test_attachment_cache():
+    downloads = []
+    files = {}
+
+    # attachments are real discord.Attachment objects served by a local CDN; their state has no
+    # http client, so the cache has to stream the url itself instead of calling save or read
+    async def cdn(request):
+        name = request.match_info['name']
+        downloads.append(int(name))
+        if name not in files:
+            return web.Response(status=404)
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for start in range(0, len(files[name]), 4):
+            await response.write(files[name][start:start + 4])
+        return response
+
+    app = web.Application()
+    app.router.add_get('/{name}', cdn)
+    server = test_utils.TestServer(app)
+    await server.start_server()
+
+    def attachment(attachment_id, data):
+        files[str(attachment_id)] = data
+        return discord.Attachment(data={'id': attachment_id, 'size': len(data), 'filename': 'notes.txt',
+                                        'url': str(server.make_url('/%d' % attachment_id))},
+                                  state=SimpleNamespace(http=None))
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = AttachmentCache(directory, max_bytes=100, cache_bytes=20)
+        lecture = attachment(1, b'hello')
+        # many reactions at once still download and encode the file once
+        paths = await asyncio.gather(*(cache.get(lecture) for _ in range(5)))
+        assert len(set(paths)) == 1 and downloads == [1]
+        with open(paths[0]) as file:
+            assert file.read().strip() == 'aGVsbG8='
+        assert await cache.get(lecture) == paths[0] and downloads == [1]
+        # over the size cap
+        assert await cache.get(attachment(2, b'x' * 101)) is None
+        # the oldest file is dropped once the cache is full
+        await cache.get(attachment(3, b'y' * 15))
+        assert not os.path.exists(paths[0]) and list(cache.files) == ['3']
+        # a failed download is raised like Attachment.save would, and nothing is cached
+        missing = attachment(4, b'')
+        del files['4']
+        with pytest.raises(discord.HTTPException):
+            await cache.get(missing)
+        assert list(cache.files) == ['3'] and not cache.pending
+    await server.close()